@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from .models import Dependency, Requirement
+from .models import Dependency, Project, Requirement
 
 
 class DepAdmin(admin.ModelAdmin):
@@ -13,6 +13,12 @@ class ReqAdmin(admin.ModelAdmin):
     search_fields = ["data", "dependency__name"]
 
 
+class ProjectAdmin(admin.ModelAdmin):
+    search_fields = ["name"]
+    exclude = ["data"]
+
+
 # Register your models here.
 admin.site.register(Dependency, DepAdmin)
 admin.site.register(Requirement, ReqAdmin)
+admin.site.register(Project, ProjectAdmin)
@@ -0,0 +1,90 @@
+"""An async client for Pypi, for the ASGI views. There's one client per event loop,
+so connections are pooled between requests, and a process can have hundreds of
+requests to Pypi outstanding without a thread for each. Responses are handled as
+in `pypi`, which the rest of the app uses."""
+
+import asyncio
+import weakref
+from typing import Optional
+
+import httpx
+from django.conf import settings
+
+from . import metrics
+from .pypi import RETRY_STATUSES, USER_AGENT, ProjectResponse
+
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]"
+_clients = weakref.WeakKeyDictionary()
+
+
+def client() -> httpx.AsyncClient:
+    """The running event loop's client. Clients can't be shared between loops."""
+    loop = asyncio.get_running_loop()
+    result = _clients.get(loop)
+    if result is None:
+        connect, read = settings.PYPI_TIMEOUT
+        result = httpx.AsyncClient(
+            headers={"User-Agent": USER_AGENT},
+            # Requests past the connection limit wait for a free one, however long.
+            timeout=httpx.Timeout(read, connect=connect, pool=None),
+            limits=httpx.Limits(
+                max_connections=settings.PYPI_ASYNC_CONNECTIONS,
+                max_keepalive_connections=settings.PYPI_ASYNC_CONNECTIONS,
+            ),
+            follow_redirects=True,
+        )
+        _clients[loop] = result
+    return result
+
+
+async def get(url: str, **kwargs) -> httpx.Response:
+    """A GET through the loop's client, retried with exponential backoff like the
+    sync session's: On connection errors, 429s, and 5xx responses."""
+    attempt = 0
+    while True:
+        last = attempt == settings.PYPI_RETRIES
+        try:
+            resp = await client().get(url, **kwargs)
+        except httpx.TransportError:
+            if last:
+                raise
+        else:
+            if last or resp.status_code not in RETRY_STATUSES:
+                return resp
+        await asyncio.sleep(settings.PYPI_BACKOFF * 2**attempt)
+        attempt += 1
+
+
+async def get_project(
+    name: str, etag: Optional[str] = None, last_modified: Optional[str] = None
+) -> Optional[ProjectResponse]:
+    """`pypi.get_project`, async."""
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+
+    with metrics.stage("pypi_project"):
+        resp = await get(f"{settings.PYPI_URL}/pypi/{name}/json", headers=headers)
+    metrics.DOWNLOADED_BYTES.inc(len(resp.content), kind="json")
+    if resp.status_code == 404:
+        return None
+    if resp.status_code == 304:
+        return ProjectResponse(None, etag, last_modified)
+    resp.raise_for_status()
+
+    return ProjectResponse(
+        resp.text, resp.headers.get("ETag"), resp.headers.get("Last-Modified")
+    )
+
+
+async def get_release(name: str, version: str) -> Optional[dict]:
+    """`pypi.get_release`, async."""
+    with metrics.stage("pypi_release"):
+        resp = await get(f"{settings.PYPI_URL}/pypi/{name}/{version}/json")
+    metrics.DOWNLOADED_BYTES.inc(len(resp.content), kind="json")
+    if resp.status_code == 404:
+        return None
+    resp.raise_for_status()
+    return resp.json()
@@ -0,0 +1,338 @@
+"""Async versions of the views that wait on Pypi, for the ASGI entry point,
+`pydeps/asgi.py`. Pypi's JSON API is requested with an async client, so one process
+can have hundreds of fetches outstanding, and still answer cached lookups straight
+away. The ORM is sync-only, so database work runs in threads via `sync_to_async`,
+as does reading dists for versions Pypi doesn't list reqs for. Responses match the
+sync views', except there's no browsable API, and `/multiple/` sends ndjson and
+msgpack all at once instead of streaming them."""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection
+from django.http import HttpRequest
+
+from rest_framework.exceptions import MethodNotAllowed, NotFound
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+from . import apypi, distfiles, locks, metrics, projects, snapshots
+from .caching import cacheable, cached_response
+from .models import Dependency, Project
+from .renderers import STREAMING_RENDERERS
+from .reqs import normalize_name
+from .version import Version
+from .views import (
+    DepFilesSerializer,
+    DepFilesSerializerWName,
+    DepSerializer,
+    DepSerializerWName,
+    cache_dep,
+    collect,
+    error_record,
+    files_ttl,
+    filter_versions,
+    group_by_name,
+    is_complete,
+    load_cached,
+    load_range,
+    many_response,
+    missing_failures,
+    parse_packages,
+    parse_version,
+    plan_pull,
+    print_heroku,
+    process_background,
+    range_response,
+    snapshot_response,
+    store_pulled,
+    unfinished,
+    wants_background,
+    wants_files,
+)
+
+
+async def fetch_release(name: str, version: str) -> Optional[dict]:
+    data = await apypi.get_release(name, version)
+    if data is None:
+        print_heroku(f'Unable to find {name} = "{version}" on Pypi')
+    return data
+
+
+async def fetch_releases(keys: List[Tuple[str, str]]) -> Dict[Tuple[str, str], dict]:
+    """All at once; the client's connection limit bounds how many are in flight."""
+    fetched = await asyncio.gather(*(fetch_release(*key) for key in keys))
+    return {key: data for key, data in zip(keys, fetched) if data is not None}
+
+
+# Reading dists is blocking I/O, so it gets threads of its own, rather than sharing
+# the default executor's handful.
+_inspect_pool = ThreadPoolExecutor(max_workers=settings.PYPI_FETCH_WORKERS)
+
+
+def inspect(name: str, version: str, release: Optional[dict]) -> None:
+    """`cache_dep`, from `_inspect_pool`. Its threads outlive the request; don't
+    leave a database connection open in them."""
+    try:
+        cache_dep(name, version, release)
+    finally:
+        connection.close()
+
+
+async def pull(keys: List[Tuple[str, str]]) -> None:
+    """`views.pull`, async."""
+    if not keys:
+        return
+    existing = await sync_to_async(load_cached)(group_by_name(keys))
+
+    misses = [key for key in keys if key not in existing]
+    with metrics.stage("fetch_releases"):
+        fetched = await fetch_releases(misses)
+    to_inspect = await sync_to_async(store_pulled)(keys, existing, fetched)
+
+    loop = asyncio.get_running_loop()
+    await asyncio.gather(
+        *(
+            loop.run_in_executor(_inspect_pool, inspect, *key, fetched.get(key))
+            for key in to_inspect
+        )
+    )
+    await sync_to_async(snapshots.refresh)(list(fetched) + to_inspect)
+
+    for name, version in fetched:
+        print_heroku(f'Cached {name} = "{version}" ')
+
+
+async def pull_single_flight(keys: List[Tuple[str, str]]) -> List[Tuple[str, str]]:
+    """Pull the keys no one else is pulling, under their locks. Returns the ones
+    someone else is, like `locks.single_flight`."""
+    # Locks are held by the request's thread, which `sync_to_async` reuses.
+    ours, theirs = await sync_to_async(locks.try_acquire)(keys)
+    try:
+        await pull(ours)
+    finally:
+        await sync_to_async(locks.release)(ours)
+    return theirs
+
+
+async def process_many(packages: Dict[str, List[str]]) -> List[Dependency]:
+    """`views.process_many`, async."""
+    cached = await sync_to_async(load_cached)(packages)
+    keys, cold, failed = await sync_to_async(plan_pull)(packages, cached)
+    if not cold:
+        return await sync_to_async(collect)(keys, cold, cached, failed)
+
+    theirs = await pull_single_flight(cold)
+    if theirs:
+        await sync_to_async(locks.wait)(theirs)
+        # Others may have been waiting on these too.
+        theirs = await pull_single_flight(await sync_to_async(unfinished)(theirs))
+        await sync_to_async(locks.wait)(theirs)
+
+    return await sync_to_async(collect)(keys, cold, cached, failed)
+
+
+async def process_reqs(name: str, versions: List[str]) -> List[Dependency]:
+    """`views.process_reqs`, async."""
+    return await process_many({normalize_name(name): versions})
+
+
+async def get_releases(name: str) -> Optional[List[str]]:
+    """`projects.get_releases`, async."""
+    releases = await sync_to_async(projects.fresh_releases)(name)
+    if releases is not None:
+        return releases
+
+    project = await sync_to_async(Project.objects.filter(name=name).first)()
+    try:
+        if project is None:
+            resp = await apypi.get_project(name)
+        else:
+            resp = await apypi.get_project(name, project.etag, project.last_modified)
+    except httpx.HTTPError:
+        if project is None:
+            raise
+        data = await sync_to_async(projects.use_stale)(name, project)
+    else:
+        data = await sync_to_async(projects.store_response)(name, project, resp)
+    return None if data is None else list(data["releases"])
+
+
+async def get_helper(
+    name: str,
+    min_vers: Optional[Version],
+    max_vers: Optional[Version],
+    background: bool = False,
+    files: bool = False,
+):
+    """`views.get_helper`, async."""
+    name = normalize_name(name)
+    releases = await get_releases(name)
+    if releases is None:
+        raise NotFound(f"Unable to find {name} on Pypi")
+    versions = filter_versions(releases, min_vers, max_vers)
+
+    if background:
+        return await sync_to_async(process_background)(
+            {name: versions}, DepFilesSerializer if files else DepSerializer, files
+        )
+
+    # Snapshots don't include files.
+    entries = None if files else await sync_to_async(snapshots.load)(name)
+    if entries is not None:
+        response = await sync_to_async(snapshot_response)(
+            name, versions, entries, min_vers, max_vers
+        )
+        if response is not None:
+            return response
+
+    found = await sync_to_async(load_range)(name, min_vers, max_vers)
+    result = [found[v] for v in versions if v in found]
+    missing = [v for v in versions if v not in found]
+    if missing:
+        result.extend(await process_reqs(name, missing))
+    return await sync_to_async(range_response)(name, versions, result, files)
+
+
+def api_view(methods: List[str], renderers: Optional[list] = None):
+    """DRF's `api_view`, for async views: The view gets a DRF request, and
+    returns a DRF response, which is rendered in the format the client asks for.
+    Exceptions go through DRF's exception handler, so error responses match the
+    sync views'."""
+    renderer_classes = renderers or [JSONRenderer]
+    # The sync views offer the browsable API too, so their responses vary on Accept.
+    headers = {"Allow": ", ".join(methods), "Vary": "Accept"}
+
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request: HttpRequest, *args, **kwargs):
+            request = Request(
+                request,
+                parsers=[parser() for parser in api_settings.DEFAULT_PARSER_CLASSES],
+                negotiator=api_settings.DEFAULT_CONTENT_NEGOTIATION_CLASS(),
+                authenticators=[
+                    auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES
+                ],
+            )
+            renderer, media_type = JSONRenderer(), JSONRenderer.media_type
+            try:
+                renderer, media_type = request.negotiator.select_renderer(
+                    request, [renderer() for renderer in renderer_classes]
+                )
+                request.accepted_renderer = renderer
+                if request.method not in methods:
+                    raise MethodNotAllowed(request.method)
+                # Authenticate up front, as DRF's views do. It may read the session,
+                # which makes responses vary on Cookie.
+                await sync_to_async(getattr)(request, "user")
+                response = await view(request, *args, **kwargs)
+            except Exception as e:
+                response = api_settings.EXCEPTION_HANDLER(
+                    e,
+                    {"view": None, "args": args, "kwargs": kwargs, "request": request},
+                )
+                if response is None:
+                    raise
+                response.exception = True
+
+            for key, value in headers.items():
+                response[key] = value
+            response.accepted_renderer = renderer
+            response.accepted_media_type = media_type
+            response.renderer_context = {"request": request}
+            return response
+
+        # As DRF does; these views don't use sessions.
+        wrapper.csrf_exempt = True
+        return wrapper
+
+    return decorator
+
+
+@cached_response
+@api_view(["GET", "HEAD"])
+async def get_one(request: Request, name: str, version: str):
+    vers = parse_version(version)
+    return await get_helper(
+        name, vers, vers, wants_background(request), wants_files(request)
+    )
+
+
+@api_view(["GET", "HEAD"])
+async def get_all(request: Request, name: str):
+    return await get_helper(
+        name, None, None, wants_background(request), wants_files(request)
+    )
+
+
+@api_view(["GET", "HEAD"])
+async def get_gte(request: Request, name: str, version: str):
+    return await get_helper(
+        name,
+        parse_version(version),
+        None,
+        wants_background(request),
+        wants_files(request),
+    )
+
+
+@api_view(["GET", "HEAD"])
+async def get_lte(request: Request, name: str, version: str):
+    return await get_helper(
+        name,
+        None,
+        parse_version(version),
+        wants_background(request),
+        wants_files(request),
+    )
+
+
+@api_view(["GET", "HEAD"])
+async def get_range(request: Request, name: str, min_vers: str, max_vers: str):
+    return await get_helper(
+        name,
+        parse_version(min_vers),
+        parse_version(max_vers),
+        wants_background(request),
+        wants_files(request),
+    )
+
+
+@cached_response
+@api_view(["POST"], [JSONRenderer] + STREAMING_RENDERERS)
+async def multiple(request: Request):
+    """`views.multiple`, async."""
+    packages, keys = parse_packages(request.data)
+    files = wants_files(request)
+
+    if wants_background(request):
+        return await sync_to_async(process_background)(
+            packages, DepFilesSerializerWName if files else DepSerializerWName, files
+        )
+
+    result = await process_many(packages)
+    if isinstance(request.accepted_renderer, tuple(STREAMING_RENDERERS)):
+        return await sync_to_async(records_response)(keys, result, files)
+    return await sync_to_async(many_response)(keys, result, files)
+
+
+def records_response(
+    keys: List[Tuple[str, str]], result: List[Dependency], files: bool = False
+):
+    """What `views.stream_records` streams, all at once."""
+    if files:
+        distfiles.attach(result)
+    serializer = DepFilesSerializerWName if files else DepSerializerWName
+    records = list(serializer(result, many=True).data)
+    records.extend(
+        error_record(failure)
+        for failure in missing_failures(keys, {(d.name, d.version) for d in result})
+    )
+    return cacheable(Response(records), is_complete(keys, result), files_ttl(files))
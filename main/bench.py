@@ -0,0 +1,231 @@
+"""End-to-end benchmarks of the API against a local fake Pypi, so runs are
+reproducible and don't depend on the network. Requests go through Django's test
+client in this process, from a pool of threads, and skip the HTTP server; they do
+go through middleware, views, the database and Pypi requests as in production."""
+
+import queue
+import resource
+import threading
+import time
+from typing import Callable, List, NamedTuple, Optional, Tuple
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client
+
+from . import projects
+from .fakepypi import FakePypi
+from .models import Dependency, FailedFetch, Job, Project, Snapshot
+from .views import group_by_name, process_many
+
+ENDPOINTS = ("get_one", "get_all", "range", "multiple")
+SCENARIOS = ("cold", "warm", "mixed")
+# Versions per /multiple/ request.
+MULTIPLE_BATCH = 10
+
+Key = Tuple[str, str]
+
+
+class Target(NamedTuple):
+    method: str
+    path: str
+    body: Optional[dict]
+    # The (name, version)s it needs cached.
+    keys: List[Key]
+
+
+class Sample(NamedTuple):
+    seconds: float
+    queries: int
+    ok: bool
+
+
+def targets(pypi: FakePypi, endpoint: str) -> List[Target]:
+    """Distinct requests for an endpoint, covering the fake Pypi's projects."""
+    names, versions = pypi.names, pypi.versions
+    if endpoint == "get_one":
+        return [
+            Target("GET", f"/{name}/{version}/", None, [(name, version)])
+            for version in versions
+            for name in names
+        ]
+    if endpoint == "get_all":
+        return [
+            Target("GET", f"/{name}/", None, [(name, v) for v in versions])
+            for name in names
+        ]
+    if endpoint == "range":
+        low, high = len(versions) // 4, len(versions) * 3 // 4
+        return [
+            Target(
+                "GET",
+                f"/range/{name}/{versions[low]}/{versions[high]}/",
+                None,
+                [(name, v) for v in versions[low : high + 1]],
+            )
+            for name in names
+        ]
+    if endpoint == "multiple":
+        keys = [(name, version) for version in versions for name in names]
+        batches = [
+            keys[i : i + MULTIPLE_BATCH] for i in range(0, len(keys), MULTIPLE_BATCH)
+        ]
+        return [
+            Target("POST", "/multiple/", {"packages": group_by_name(batch)}, batch)
+            for batch in batches
+        ]
+    raise ValueError(f"Unknown endpoint: {endpoint}")
+
+
+def reset(pypi: FakePypi) -> None:
+    """Forget everything we've cached from the fake Pypi."""
+    names = pypi.names
+    Dependency.objects.filter(name__in=names).delete()
+    Project.objects.filter(name__in=names).delete()
+    FailedFetch.objects.filter(name__in=names).delete()
+    Job.objects.filter(name__in=names).delete()
+    Snapshot.objects.filter(name__in=names).delete()
+    projects._lru.clear()
+    cache.clear()
+
+
+def request(client: Client, target: Target) -> Sample:
+    queries = 0
+
+    def count(execute, sql, params, many, context):
+        nonlocal queries
+        queries += 1
+        return execute(sql, params, many, context)
+
+    start = time.perf_counter()
+    with connection.execute_wrapper(count):
+        if target.method == "GET":
+            response = client.get(target.path)
+        else:
+            response = client.post(
+                target.path, target.body, content_type="application/json"
+            )
+        if response.streaming:
+            b"".join(response.streaming_content)
+    return Sample(time.perf_counter() - start, queries, response.status_code == 200)
+
+
+def drive(targets: List[Target], concurrency: int) -> Tuple[List[Sample], float]:
+    """Send each target once, `concurrency` at a time. Returns the samples, and the
+    wall time taken."""
+    todo: "queue.Queue[Target]" = queue.Queue()
+    for target in targets:
+        todo.put(target)
+    samples: List[Sample] = []
+    lock = threading.Lock()
+
+    def work():
+        client = Client(HTTP_HOST="localhost")
+        try:
+            while True:
+                try:
+                    target = todo.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    sample = request(client, target)
+                except Exception as e:
+                    print(f"{target.method} {target.path} failed: {e!r}")
+                    sample = Sample(0.0, 0, False)
+                with lock:
+                    samples.append(sample)
+        finally:
+            connection.close()
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=work) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples, time.perf_counter() - start
+
+
+def percentile(values: List[float], p: float) -> float:
+    """Nearest-rank percentile; 0 for no values."""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    rank = max(int(-(-p * len(values) // 100)), 1)
+    return values[rank - 1]
+
+
+def peak_rss_mb() -> float:
+    """The process's peak RSS so far. It only ever grows, so it's for the whole run,
+    not any one scenario."""
+    # Kilobytes, on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def summarize(samples: List[Sample], wall: float) -> dict:
+    ok = [s for s in samples if s.ok]
+    latencies = [s.seconds * 1000 for s in ok]
+    return {
+        "requests": len(samples),
+        "errors": len(samples) - len(ok),
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "throughput_rps": round(len(samples) / wall, 2) if wall else 0.0,
+        "queries_per_request": (
+            round(sum(s.queries for s in ok) / len(ok), 2) if ok else 0.0
+        ),
+    }
+
+
+def run(
+    pypi: FakePypi,
+    endpoints: List[str],
+    scenarios: List[str],
+    concurrency: List[int],
+    limit: int = 0,
+    report: Callable[[str], None] = print,
+) -> List[dict]:
+    """Every combination of endpoint, scenario and concurrency level. Cold runs start
+    from an empty cache; warm ones repeat the cold run's requests; mixed ones start
+    with every other request's versions cached. At most `limit` requests each, if
+    set."""
+    results = []
+    for endpoint in endpoints:
+        all_targets = targets(pypi, endpoint)
+        if limit:
+            all_targets = all_targets[:limit]
+        for level in concurrency:
+            # In this order, so warm runs follow the cold run that warmed them.
+            for scenario in (s for s in SCENARIOS if s in scenarios):
+                if scenario == "cold":
+                    reset(pypi)
+                elif scenario == "warm" and "cold" not in scenarios:
+                    reset(pypi)
+                    drive(all_targets, level)
+                elif scenario == "mixed":
+                    reset(pypi)
+                    process_many(
+                        group_by_name(
+                            key for target in all_targets[::2] for key in target.keys
+                        )
+                    )
+
+                pypi_requests = pypi.requests
+                samples, wall = drive(all_targets, level)
+                result = {
+                    "endpoint": endpoint,
+                    "scenario": scenario,
+                    "concurrency": level,
+                    **summarize(samples, wall),
+                    "pypi_requests": pypi.requests - pypi_requests,
+                }
+                report(
+                    f"{endpoint:>8} {scenario:>5} x{level:<3} "
+                    f"p50 {result['p50_ms']:9.2f} ms  p99 {result['p99_ms']:9.2f} ms  "
+                    f"{result['throughput_rps']:8.1f} req/s  "
+                    f"{result['queries_per_request']:6.1f} queries  "
+                    f"{result['errors']} errors"
+                )
+                results.append(result)
+    reset(pypi)
+    return results
@@ -0,0 +1,140 @@
+"""HTTP caching. Once a (name, version)'s reqs are complete, its response never
+changes, so complete responses get strong ETags and long-lived `Cache-Control`
+headers, and are kept in a response cache keyed by a hash of the request. Repeat
+requests, eg resolving the same lockfile, are then answered without touching the
+database. Responses that may still change get short-lived headers, and aren't
+kept. Complete responses that include files are cached for a limited time instead,
+like project documents, since Pypi can change files, eg yank them."""
+
+import asyncio
+from functools import wraps
+from hashlib import sha256
+from typing import Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpRequest, HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import parse_etags
+
+from . import metrics
+
+
+def cacheable(response, complete: bool, ttl: Optional[int] = None):
+    """Mark a view's response as complete, ie it won't change, or not. Complete
+    responses with data that may change anyway give `ttl`, in seconds."""
+    response.complete = complete
+    response.ttl = ttl
+    return response
+
+
+def cache_key(request: HttpRequest) -> str:
+    digest = sha256()
+    for part in (
+        request.method,
+        request.get_full_path(),
+        # Responses are rendered according to this.
+        request.META.get("HTTP_ACCEPT", ""),
+    ):
+        digest.update(part.encode())
+        digest.update(b"\0")
+    digest.update(request.body)
+    return f"response:{digest.hexdigest()}"
+
+
+def etag(body: bytes) -> str:
+    return f'"{sha256(body).hexdigest()}"'
+
+
+def not_modified(request: HttpRequest, tag: str) -> bool:
+    """Whether a conditional GET already has this version of the response."""
+    if request.method not in ("GET", "HEAD"):
+        return False
+    tags = parse_etags(request.META.get("HTTP_IF_NONE_MATCH", ""))
+    return tag in tags or "*" in tags
+
+
+def add_headers(
+    response: HttpResponse, tag: str, complete: bool, ttl: Optional[int] = None
+) -> HttpResponse:
+    response["ETag"] = tag
+    if complete and ttl is not None:
+        patch_cache_control(response, public=True, max_age=ttl)
+    elif complete:
+        patch_cache_control(
+            response, public=True, immutable=True, max_age=settings.CACHE_MAX_AGE
+        )
+    else:
+        patch_cache_control(response, max_age=settings.CACHE_MAX_AGE_INCOMPLETE)
+    patch_vary_headers(response, ["Accept"])
+    return response
+
+
+def respond(
+    request: HttpRequest,
+    response: HttpResponse,
+    tag: str,
+    complete: bool,
+    ttl: Optional[int] = None,
+):
+    if not_modified(request, tag):
+        response = HttpResponseNotModified()
+    return add_headers(response, tag, complete, ttl)
+
+
+def lookup(request: HttpRequest, key: str) -> Optional[HttpResponse]:
+    entry = cache.get(key)
+    if entry is None:
+        metrics.CACHE.inc(cache="response", result="miss")
+        return None
+    metrics.CACHE.inc(cache="response", result="hit")
+    tag, body, content_type, ttl = entry
+    return respond(
+        request, HttpResponse(body, content_type=content_type), tag, True, ttl
+    )
+
+
+def store(request: HttpRequest, key: str, response: HttpResponse) -> HttpResponse:
+    if response.streaming or response.status_code != 200:
+        return response
+    if hasattr(response, "render"):
+        response.render()
+
+    tag = etag(response.content)
+    complete = getattr(response, "complete", False)
+    ttl = getattr(response, "ttl", None)
+    if complete:
+        cache.set(
+            key,
+            (tag, response.content, response["Content-Type"], ttl),
+            settings.RESPONSE_CACHE_TIMEOUT if ttl is None else ttl,
+        )
+    return respond(request, response, tag, complete, ttl)
+
+
+def cached_response(view):
+    """Serve repeat requests from the response cache, and add caching headers.
+    Wraps the view outside `api_view`, so it sees the plain Django request.
+    Streaming responses are passed through. Works on async views too."""
+
+    if asyncio.iscoroutinefunction(view):
+
+        @wraps(view)
+        async def async_wrapper(request: HttpRequest, *args, **kwargs):
+            key = cache_key(request)
+            response = lookup(request, key)
+            if response is None:
+                response = store(request, key, await view(request, *args, **kwargs))
+            return response
+
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request: HttpRequest, *args, **kwargs):
+        key = cache_key(request)
+        response = lookup(request, key)
+        if response is None:
+            response = store(request, key, view(request, *args, **kwargs))
+        return response
+
+    return wrapper
@@ -0,0 +1,187 @@
+"""Transitive dependency closures, computed server-side: From root requirements,
+walk the graph over our cached tables, a level at a time, and return every
+(name, version) reachable from them. Each level's missing nodes are pulled from
+Pypi concurrently. Each (name, version, extras) node's direct dependencies are
+memoized in the cache, so closures sharing subgraphs, eg everything depending on
+`requests`, only work them out once; walking memoized nodes costs a cache lookup
+per level. A root's whole closure is memoized too, so repeat requests for popular
+packages cost a cache hit and one query."""
+
+from typing import Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import projects, reqs
+from .models import Dependency
+from .version import SpecifierSet
+
+Key = Tuple[str, str]
+# A version, and the extras it's required with.
+Node = Tuple[Key, FrozenSet[str]]
+
+
+class TooLarge(ValueError):
+    pass
+
+
+def cache_key(key: Key, extras: FrozenSet[str]) -> str:
+    name, version = key
+    return f"closure:{name}=={version}[{','.join(sorted(extras))}]"
+
+
+def node_key(node: Node) -> str:
+    (name, version), extras = node
+    return f"closure-node:{name}=={version}[{','.join(sorted(extras))}]"
+
+
+class Walk:
+    """State for one closure request. Releases, loaded versions and successors are
+    shared between the walks from each of its roots, so overlapping subgraphs are
+    only loaded once."""
+
+    def __init__(self):
+        self.releases: Dict[str, Optional[List[str]]] = {}
+        self.deps: Dict[Key, Dependency] = {}
+        self.edges: Dict[Node, List[Node]] = {}
+
+    def allowed(
+        self, parsed: Iterable[reqs.ParsedReq]
+    ) -> Dict[Tuple[str, str], List[str]]:
+        """The versions each requirement allows, keyed by (name, specifier).
+        Requirements on projects Pypi doesn't know about allow nothing."""
+        parsed = list(parsed)
+        self.releases.update(
+            projects.get_releases_many(
+                req.name for req in parsed if req.name not in self.releases
+            )
+        )
+
+        result = {}
+        for req in parsed:
+            if (req.name, req.specifier) in result:
+                continue
+            try:
+                specifier = SpecifierSet(req.specifier)
+            except ValueError:
+                print(f"Skipping requirement with an invalid specifier: {req}")
+                result[req.name, req.specifier] = []
+                continue
+            result[req.name, req.specifier] = list(
+                specifier.filter(self.releases.get(req.name) or [])
+            )
+        return result
+
+    def matching(self, parsed: Iterable[reqs.ParsedReq]) -> List[Node]:
+        """The (name, version) pairs each requirement allows, with the extras it asks
+        for."""
+        parsed = list(parsed)
+        allowed = self.allowed(parsed)
+        return [
+            ((req.name, version), req.extras)
+            for req in parsed
+            for version in allowed[req.name, req.specifier]
+        ]
+
+    def load(self, keys: Iterable[Key]) -> None:
+        # Avoid a circular import; views uses this module.
+        from .views import group_by_name, process_many
+
+        missing = [key for key in dict.fromkeys(keys) if key not in self.deps]
+        for dep in process_many(group_by_name(missing)):
+            self.deps[(dep.name, dep.version)] = dep
+
+    def successors(self, nodes: List[Node]) -> Dict[Node, List[Node]]:
+        """The nodes each node's requirements allow. Requirements gated on an extra
+        are only followed if the node was required with that extra. Memoized per
+        node; the rest are loaded, and pulled if need be, together."""
+        result = {node: self.edges[node] for node in nodes if node in self.edges}
+        memos = {node_key(node): node for node in nodes if node not in result}
+        for memo, found in cache.get_many(list(memos)).items():
+            result[memos[memo]] = [
+                ((name, version), frozenset(extras)) for name, version, extras in found
+            ]
+        missing = [node for node in nodes if node not in result]
+        if not missing:
+            self.edges.update(result)
+            return result
+
+        self.load(key for key, _ in missing)
+        node_reqs: Dict[Node, List[reqs.ParsedReq]] = {}
+        for node in missing:
+            key, extras = node
+            dep = self.deps.get(key)
+            if dep is None:  # Pypi doesn't know about it.
+                result[node] = []
+                continue
+            node_reqs[node] = []
+            for req in dep.requirements.all():
+                parsed = req.parsed()
+                if parsed is None:
+                    continue
+                needs = parsed.marker_extras
+                if needs and not needs & extras:
+                    continue
+                node_reqs[node].append(parsed)
+
+        allowed = self.allowed(req for parsed in node_reqs.values() for req in parsed)
+        to_cache = {}
+        for node, parsed in node_reqs.items():
+            edges = list(
+                dict.fromkeys(
+                    ((req.name, version), req.extras)
+                    for req in parsed
+                    for version in allowed[req.name, req.specifier]
+                )
+            )
+            result[node] = edges
+            to_cache[node_key(node)] = [
+                (name, version, sorted(extras)) for (name, version), extras in edges
+            ]
+        cache.set_many(to_cache, settings.CLOSURE_CACHE_TIMEOUT)
+        self.edges.update(result)
+        return result
+
+    def closure(self, root: Key, extras: FrozenSet[str]) -> Set[Key]:
+        """Every version reachable from `root`, including it."""
+        reached: Set[Node] = {(root, extras)}
+        keys = {root}
+        frontier: List[Node] = [(root, extras)]
+
+        while frontier:
+            if len(keys) > settings.CLOSURE_MAX_NODES:
+                raise TooLarge(f"{root[0]}=={root[1]} reaches too many versions")
+            level = self.successors(frontier)
+            frontier = []
+            for node in [child for children in level.values() for child in children]:
+                if node not in reached:
+                    reached.add(node)
+                    keys.add(node[0])
+                    frontier.append(node)
+
+        return keys
+
+    def resolve(self, requirements: List[str]) -> List[Dependency]:
+        """Everything reachable from the requirements, ordered by name and version."""
+        roots = []
+        for data in requirements:
+            parsed = reqs.parse(data)
+            if parsed is None:
+                raise ValueError(f"{data} isn't a valid requirement")
+            SpecifierSet(parsed.specifier)  # Raises if it's invalid.
+            roots.append(parsed)
+
+        keys: Set[Key] = set()
+        for key, extras in dict.fromkeys(self.matching(roots)):
+            memo = cache_key(key, extras)
+            found = cache.get(memo)
+            if found is None:
+                found = self.closure(key, extras)
+                cache.set(memo, list(found), settings.CLOSURE_CACHE_TIMEOUT)
+            keys.update(tuple(k) for k in found)
+
+        # Memoized closures' nodes are cached, so this is one query, with no Pypi work.
+        self.load(keys)
+        result = [self.deps[key] for key in keys if key in self.deps]
+        result.sort(key=lambda dep: (dep.name, dep.version_key))
+        return result
@@ -0,0 +1,91 @@
+"""The files of each version we cache: URLs, hashes and sizes, and wheel tags, so
+clients can go from resolving to downloading without asking Pypi about each
+version. They're recorded from the release documents we pull anyway. Versions
+cached before we kept them are filled in from their projects' documents, which are
+usually cached too, the first time they're asked for. Deps are marked once their
+files are recorded, so versions without any are only looked up once."""
+
+from typing import Dict, Iterable, List, Tuple
+
+from django.db.models import prefetch_related_objects
+
+from . import projects
+from .models import Dependency, DistFile
+
+Key = Tuple[str, str]
+
+
+def wheel_tags(filename: str) -> Tuple[str, str, str]:
+    """A wheel's (python, abi, platform) tags, from its filename. Empty for other
+    files."""
+    if not filename.endswith(".whl"):
+        return "", "", ""
+    parts = filename[: -len(".whl")].split("-")
+    if len(parts) < 5:
+        return "", "", ""
+    return parts[-3], parts[-2], parts[-1]
+
+
+def from_pypi(dep: Dependency, info: dict) -> DistFile:
+    """A file, from an entry in a warehouse document's `urls`, or its `releases`."""
+    python_tag, abi_tag, platform_tag = wheel_tags(info["filename"])
+    return DistFile(
+        dependency=dep,
+        filename=info["filename"],
+        url=info["url"],
+        sha256=(info.get("digests") or {}).get("sha256") or "",
+        size=info.get("size"),
+        packagetype=info.get("packagetype") or "",
+        python_version=info.get("python_version") or "",
+        requires_python=info.get("requires_python"),
+        yanked=bool(info.get("yanked")),
+        python_tag=python_tag,
+        abi_tag=abi_tag,
+        platform_tag=platform_tag,
+    )
+
+
+def record(files: Iterable[Tuple[Dependency, List[dict]]]) -> None:
+    """Save saved deps' files, as Pypi lists them, with one bulk insert, and mark the
+    deps as recorded. Files we already have are skipped."""
+    files = list(files)
+    DistFile.objects.bulk_create(
+        [from_pypi(dep, info) for dep, infos in files for info in infos],
+        ignore_conflicts=True,
+    )
+    Dependency.objects.filter(pk__in=[dep.pk for dep, _ in files]).update(
+        files_recorded=True
+    )
+    for dep, _ in files:
+        dep.files_recorded = True
+
+
+def fill(deps: List[Dependency]) -> None:
+    """Record the files of deps cached before we kept them, from their projects'
+    documents. Deps whose projects Pypi no longer has are left to try again."""
+    by_name: Dict[str, List[Dependency]] = {}
+    for dep in deps:
+        by_name.setdefault(dep.name, []).append(dep)
+
+    found = []
+    for name, named in by_name.items():
+        data = projects.get_project(name)
+        if data is None:
+            continue
+        for dep in named:
+            found.append((dep, data["releases"].get(dep.version) or []))
+    record(found)
+
+
+def attach(deps: List[Dependency]) -> None:
+    """Load deps' files, for serializing, in one query. Any deps whose files haven't
+    been recorded are filled in first."""
+    prefetch_related_objects(deps, "files")
+    missing = [dep for dep in deps if not dep.files_recorded]
+    if not missing:
+        return
+
+    fill(missing)
+    for dep in missing:
+        dep._prefetched_objects_cache.pop("files", None)
+    prefetch_related_objects(missing, "files")
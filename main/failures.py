@@ -0,0 +1,82 @@
+"""Negative caching: Versions we were unable to get reqs for are recorded with the
+reason, and not tried again until their backoff expires. Without this, every request
+for a known-bad version repeats the whole failed download or build."""
+
+from datetime import timedelta
+from typing import Dict, Iterable, List, Tuple
+
+from django.conf import settings
+from django.db import IntegrityError
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import FailedFetch
+
+Key = Tuple[str, str]
+
+
+def keys_query(keys: Iterable[Key]) -> Q:
+    query = Q()
+    for name, version in keys:
+        query |= Q(name=name, version=version)
+    return query
+
+
+def backoff(attempts: int) -> timedelta:
+    """Doubles with each attempt, up to `FAILURE_BACKOFF_MAX`."""
+    seconds = settings.FAILURE_BACKOFF * 2 ** min(attempts - 1, 32)
+    return timedelta(seconds=min(seconds, settings.FAILURE_BACKOFF_MAX))
+
+
+def record(key: Key, reason: str, detail: str = "") -> None:
+    name, version = key
+    now = timezone.now()
+    failure = FailedFetch.objects.filter(name=name, version=version).first()
+    if failure is None:
+        try:
+            FailedFetch.objects.create(
+                name=name,
+                version=version,
+                reason=reason,
+                detail=detail,
+                retry_after=now + backoff(1),
+            )
+        except IntegrityError:
+            pass  # Another worker recorded the same failure.
+        return
+
+    failure.reason = reason
+    failure.detail = detail
+    failure.attempts += 1
+    failure.retry_after = now + backoff(failure.attempts)
+    failure.save()
+
+
+def load(keys: List[Key]) -> Dict[Key, FailedFetch]:
+    """Recorded failures for these keys, with one indexed query, including ones
+    due a retry."""
+    query = keys_query(keys)
+    if not query:
+        return {}
+    return {(f.name, f.version): f for f in FailedFetch.objects.filter(query)}
+
+
+def is_active(failure: FailedFetch) -> bool:
+    return failure.retry_after > timezone.now()
+
+
+def active(keys: List[Key]) -> List[FailedFetch]:
+    """Failures we're not retrying yet, in the order of `keys`."""
+    failed = load(keys)
+    return [
+        failed[key]
+        for key in dict.fromkeys(keys)
+        if key in failed and is_active(failed[key])
+    ]
+
+
+def clear(keys: List[Key]) -> None:
+    """Forget failures for keys we've since succeeded with."""
+    query = keys_query(keys)
+    if query:
+        FailedFetch.objects.filter(query).delete()
@@ -0,0 +1,259 @@
+"""A fake Pypi for benchmarks: Serves the warehouse JSON API, and wheels and sdists
+of configurable size and count, generated on start, from a local HTTP server.
+Supports ETags and range requests, like Pypi, and can add latency to every
+response to stand in for a real network. Tests can also make it fail requests, or
+ignore Range headers, like some mirrors do."""
+
+import hashlib
+import io
+import json
+import random
+import re
+import tarfile
+import threading
+import time
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+
+class FakePypi:
+    """Projects `{prefix}0`..`{prefix}{n - 1}`, each with `versions` releases. Each
+    release requires the next project, and has a wheel of about `wheel_size`
+    bytes, or an sdist if `sdists`. A fraction `unlisted` of releases don't list
+    their requires_dist in the JSON API, so their files have to be read."""
+
+    def __init__(
+        self,
+        projects: int = 20,
+        versions: int = 20,
+        wheel_size: int = 64 * 1024,
+        sdists: bool = False,
+        unlisted: float = 0.5,
+        latency: float = 0.0,
+        prefix: str = "bench-",
+        seed: int = 0,
+    ):
+        self.latency = latency
+        # Statuses to answer a path with, one per request, before serving it.
+        self.failures: Dict[str, List[int]] = {}
+        # Whether to honour Range headers.
+        self.ranges = True
+        self.names = [f"{prefix}{i}" for i in range(projects)]
+        self.versions = [f"1.{i}.0" for i in range(versions)]
+        self.files: Dict[str, bytes] = {}
+        self.projects: Dict[str, dict] = {}
+        self.requests = 0
+        self.connections = 0
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+        self.url = ""
+
+        rand = random.Random(seed)
+        for i, name in enumerate(self.names):
+            reqs = [f"{self.names[(i + 1) % projects]}>=1.0"]
+            releases = {}
+            listed = {}
+            for version in self.versions:
+                if sdists:
+                    filename = f"{name}-{version}.tar.gz"
+                    data = make_sdist(name, version, reqs, wheel_size, rand)
+                    packagetype = "sdist"
+                else:
+                    filename = f"{name.replace('-', '_')}-{version}-py3-none-any.whl"
+                    data = make_wheel(name, version, reqs, wheel_size, rand)
+                    packagetype = "bdist_wheel"
+                self.files[filename] = data
+                releases[version] = [
+                    {
+                        "filename": filename,
+                        "packagetype": packagetype,
+                        # Filled in once we know the server's address.
+                        "url": filename,
+                        "size": len(data),
+                        "digests": {"sha256": hashlib.sha256(data).hexdigest()},
+                        "python_version": "source" if sdists else "py3",
+                        "requires_python": ">=3.6",
+                        "yanked": False,
+                    }
+                ]
+                listed[version] = None if rand.random() < unlisted else reqs
+            self.projects[name] = {"releases": releases, "requires_dist": listed}
+
+    def start(self) -> str:
+        """Serve on a free local port, in a background thread. Returns the URL to
+        use as `PYPI_URL`."""
+        handler = type("Handler", (_Handler,), {"pypi": self})
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self._server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}"
+        for project in self.projects.values():
+            for files in project["releases"].values():
+                for f in files:
+                    f["url"] = f"{self.url}/files/{f['filename']}"
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self.url
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def project_json(self, name: str) -> Optional[bytes]:
+        project = self.projects.get(name)
+        if project is None:
+            return None
+        info = {"name": name, "requires_python": ">=3.6", "requires_dist": None}
+        return json.dumps({"info": info, "releases": project["releases"]}).encode()
+
+    def release_json(self, name: str, version: str) -> Optional[bytes]:
+        project = self.projects.get(name)
+        if project is None or version not in project["releases"]:
+            return None
+        info = {
+            "name": name,
+            "version": version,
+            "requires_python": ">=3.6",
+            "requires_dist": project["requires_dist"][version],
+        }
+        return json.dumps({"info": info, "urls": project["releases"][version]}).encode()
+
+
+def metadata_text(name: str, version: str, reqs: List[str]) -> str:
+    lines = [
+        "Metadata-Version: 2.1",
+        f"Name: {name}",
+        f"Version: {version}",
+        "Requires-Python: >=3.6",
+    ]
+    lines.extend(f"Requires-Dist: {req}" for req in reqs)
+    return "\n".join(lines) + "\n\n"
+
+
+def make_wheel(
+    name: str, version: str, reqs: List[str], size: int, rand: random.Random
+) -> bytes:
+    module = name.replace("-", "_")
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as archive:
+        # Incompressible padding, so the file's about `size` bytes.
+        archive.writestr(
+            f"{module}/data.bin",
+            rand.getrandbits(size * 8).to_bytes(size, "big") if size else b"",
+        )
+        archive.writestr(f"{module}/__init__.py", "")
+        archive.writestr(
+            f"{module}-{version}.dist-info/METADATA", metadata_text(name, version, reqs)
+        )
+    return buf.getvalue()
+
+
+def make_sdist(
+    name: str, version: str, reqs: List[str], size: int, rand: random.Random
+) -> bytes:
+    buf = io.BytesIO()
+    root = f"{name}-{version}"
+    with tarfile.open(fileobj=buf, mode="w:gz") as archive:
+        members = {
+            "PKG-INFO": metadata_text(name, version, reqs)
+            .replace("Metadata-Version: 2.1", "Metadata-Version: 2.2")
+            .encode(),
+            "data.bin": (
+                rand.getrandbits(size * 8).to_bytes(size, "big") if size else b""
+            ),
+        }
+        for path, data in members.items():
+            info = tarfile.TarInfo(f"{root}/{path}")
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    return buf.getvalue()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    pypi: FakePypi
+
+    def log_message(self, *args):
+        pass
+
+    def setup(self):
+        # One handler per connection; keep-alive requests reuse it.
+        super().setup()
+        with self.pypi._lock:
+            self.pypi.connections += 1
+
+    def handle(self):
+        try:
+            super().handle()
+        except ConnectionError:
+            # The client hung up mid-request, eg after a timeout.
+            pass
+
+    def send(self, status: int, body: bytes = b"", headers: Dict[str, str] = {}):
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        try:
+            self.end_headers()
+            if self.command != "HEAD":
+                self.wfile.write(body)
+        except ConnectionError:
+            # The client timed out and hung up.
+            self.close_connection = True
+            return
+        if self.command != "HEAD":
+            with self.pypi._lock:
+                self.pypi.bytes_sent += len(body)
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_GET(self):
+        pypi = self.pypi
+        with pypi._lock:
+            pypi.requests += 1
+            failures = pypi.failures.get(self.path)
+            status = failures.pop(0) if failures else None
+        if pypi.latency:
+            time.sleep(pypi.latency)
+        if status is not None:
+            return self.send(status)
+
+        m = re.match(r"^/pypi/([^/]+)/json$", self.path)
+        if m:
+            return self.send_json(pypi.project_json(m.group(1)))
+        m = re.match(r"^/pypi/([^/]+)/([^/]+)/json$", self.path)
+        if m:
+            return self.send_json(pypi.release_json(m.group(1), m.group(2)))
+        m = re.match(r"^/files/(.+)$", self.path)
+        if m and m.group(1) in pypi.files:
+            return self.send_file(pypi.files[m.group(1)])
+        self.send(404)
+
+    def send_json(self, body: Optional[bytes]):
+        if body is None:
+            return self.send(404, b'{"message": "Not Found"}')
+        etag = f'"{hashlib.md5(body).hexdigest()}"'
+        if self.headers.get("If-None-Match") == etag:
+            return self.send(304, headers={"ETag": etag})
+        self.send(200, body, {"ETag": etag, "Content-Type": "application/json"})
+
+    def send_file(self, data: bytes):
+        if not self.pypi.ranges:
+            return self.send(200, data)
+        headers = {"Accept-Ranges": "bytes"}
+        m = re.match(r"^bytes=(\d*)-(\d*)$", self.headers.get("Range", ""))
+        if not m:
+            return self.send(200, data, headers)
+
+        start, end = m.groups()
+        if start:
+            first = int(start)
+            last = min(int(end), len(data) - 1) if end else len(data) - 1
+        else:
+            first = max(len(data) - int(end), 0)
+            last = len(data) - 1
+        headers["Content-Range"] = f"bytes {first}-{last}/{len(data)}"
+        self.send(206, data[first : last + 1], headers)
@@ -0,0 +1,98 @@
+"""A job queue for cold (name, version) work, kept in the database so we don't need
+an outside broker. Views enqueue work they don't want to do inside a request; the
+`ingest_worker` management command runs it with a pool of threads."""
+
+import threading
+import time
+from datetime import timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Job
+
+
+def enqueue(keys: Iterable[Tuple[str, str]]) -> Dict[Tuple[str, str], Job]:
+    """Queue work for (name, version) pairs, collapsing into existing jobs where
+    there are any. Finished jobs are queued again, since the caller's found the
+    work still needs doing."""
+    keys = list(dict.fromkeys(keys))
+    if not keys:
+        return {}
+
+    Job.objects.bulk_create(
+        [Job(name=name, version=version) for name, version in keys],
+        ignore_conflicts=True,
+    )
+    query = Q()
+    for name, version in keys:
+        query |= Q(name=name, version=version)
+
+    Job.objects.filter(query, status__in=[Job.DONE, Job.FAILED]).update(
+        status=Job.PENDING, error=None, updated=timezone.now()
+    )
+    return {(job.name, job.version): job for job in Job.objects.filter(query)}
+
+
+def claim() -> Optional[Job]:
+    """Take the oldest pending job, or one whose worker seems to have died. Other
+    workers skip rows we've locked, rather than waiting on them."""
+    stalled = timezone.now() - timedelta(seconds=settings.JOB_TIMEOUT)
+    with transaction.atomic():
+        job = (
+            Job.objects.select_for_update(skip_locked=True)
+            .filter(Q(status=Job.PENDING) | Q(status=Job.RUNNING, updated__lt=stalled))
+            .order_by("updated")
+            .first()
+        )
+        if job is not None:
+            job.status = Job.RUNNING
+            job.save()
+    return job
+
+
+def run(job: Job) -> None:
+    # Avoid a circular import; views uses this module to enqueue.
+    from .views import process_many
+
+    try:
+        process_many({job.name: [job.version]})
+    except Exception as e:
+        print(f"Job {job} failed: {e!r}")
+        job.status = Job.FAILED
+        job.error = repr(e)
+    else:
+        job.status = Job.DONE
+        job.error = None
+    job.save()
+
+
+def work(stop: threading.Event) -> None:
+    """Run jobs until told to stop, waiting a bit whenever the queue's empty."""
+    while not stop.is_set():
+        close_old_connections()
+        job = claim()
+        if job is None:
+            stop.wait(settings.JOB_POLL_INTERVAL)
+            continue
+        run(job)
+
+
+def serve(threads: int) -> None:
+    """Run a pool of worker threads until interrupted."""
+    stop = threading.Event()
+    workers: List[threading.Thread] = [
+        threading.Thread(target=work, args=(stop,), daemon=True) for _ in range(threads)
+    ]
+    for worker in workers:
+        worker.start()
+    try:
+        while any(worker.is_alive() for worker in workers):
+            time.sleep(1)
+    except KeyboardInterrupt:
+        stop.set()
+        for worker in workers:
+            worker.join()
@@ -0,0 +1,118 @@
+"""Single-flight for cold work: When several workers miss on the same (name, version)
+at once, one of them pulls it, and the rest wait for its result instead of pulling it
+too. On Postgres this uses session advisory locks, so it works across processes and
+machines; they're released if the holder's connection drops. Other databases fall
+back to locks shared between threads of this process."""
+
+import threading
+import time
+from contextlib import contextmanager
+from hashlib import blake2b
+from typing import Iterator, List, Tuple
+
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+
+from .version import Version
+
+Key = Tuple[str, str]
+
+# Process-local fallback. Keys are hashed onto a fixed set of locks, so this doesn't
+# grow; a collision just means waiting on unrelated work, after which callers
+# find their key still cold and pull it themselves.
+STRIPES = 256
+_local_locks = [threading.RLock() for _ in range(STRIPES)]
+
+
+def lock_id(key: Key) -> int:
+    """A stable, signed 64-bit id for a (name, version), for `pg_advisory_lock`.
+    Equal versions spelt differently, like 1.0 and 1.0.0, share an id."""
+    name, version = key
+    parsed = Version.from_str(version)
+    normalized = version if parsed is None else parsed.sortable()
+    digest = blake2b(f"{name}=={normalized}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+
+def use_advisory() -> bool:
+    return connection.vendor == "postgresql"
+
+
+def try_acquire(keys: List[Key]) -> Tuple[List[Key], List[Key]]:
+    """Try to lock each key without waiting. Returns (ours, theirs): the keys we
+    now hold, and the ones someone else is working on."""
+    if not keys:
+        return [], []
+
+    if use_advisory():
+        ids = [lock_id(key) for key in keys]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT pg_try_advisory_lock(id) FROM unnest(%s::bigint[]) AS id",
+                [ids],
+            )
+            acquired = [row[0] for row in cursor.fetchall()]
+    else:
+        acquired = [_local_locks[lock_id(key) % STRIPES].acquire(False) for key in keys]
+
+    ours = [key for key, got in zip(keys, acquired) if got]
+    theirs = [key for key, got in zip(keys, acquired) if not got]
+    return ours, theirs
+
+
+def release(keys: List[Key]) -> None:
+    if not keys:
+        return
+
+    if use_advisory():
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT pg_advisory_unlock(id) FROM unnest(%s::bigint[]) AS id",
+                [[lock_id(key) for key in keys]],
+            )
+    else:
+        for key in keys:
+            _local_locks[lock_id(key) % STRIPES].release()
+
+
+def wait(keys: List[Key]) -> None:
+    """Wait until whoever holds these keys is done with them, or for
+    `SINGLE_FLIGHT_TIMEOUT` seconds, whichever's first."""
+    deadline = time.monotonic() + settings.SINGLE_FLIGHT_TIMEOUT
+
+    for key in keys:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            print(f"Timed out waiting on other workers for {key}")
+            return
+
+        if use_advisory():
+            # One at a time, so a timeout doesn't leave us holding some of them.
+            try:
+                with transaction.atomic(), connection.cursor() as cursor:
+                    cursor.execute(
+                        "SET LOCAL lock_timeout = %s", [f"{int(remaining * 1000)}ms"]
+                    )
+                    cursor.execute("SELECT pg_advisory_lock(%s)", [lock_id(key)])
+            except DatabaseError:
+                print(f"Timed out waiting on other workers for {key}")
+                return
+            # We only wanted to know it's free.
+            release([key])
+        else:
+            lock = _local_locks[lock_id(key) % STRIPES]
+            if not lock.acquire(timeout=remaining):
+                print(f"Timed out waiting on other workers for {key}")
+                return
+            lock.release()
+
+
+@contextmanager
+def single_flight(keys: List[Key]) -> Iterator[Tuple[List[Key], List[Key]]]:
+    """Lock what we can of `keys` for the duration of the block. Yields (ours,
+    theirs); do the work for `ours`, then `wait` on `theirs`."""
+    ours, theirs = try_acquire(keys)
+    try:
+        yield ours, theirs
+    finally:
+        release(ours)
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+
+from main.models import Requirement
+
+
+class Command(BaseCommand):
+    help = (
+        "Parse the name, specifier, extras and marker of requirements saved before "
+        "we stored them. Safe to interrupt, and to run again."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=2000)
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        done = 0
+        unparseable = 0
+        last_id = 0
+
+        while True:
+            # Walk the primary key instead of re-querying for empty names, so rows
+            # we can't parse don't come back round.
+            batch = list(
+                Requirement.objects.filter(id__gt=last_id, name="")
+                .only("id", "data")
+                .order_by("id")[:batch_size]
+            )
+            if not batch:
+                break
+            last_id = batch[-1].id
+
+            for req in batch:
+                req.fill_parsed()
+                if not req.name:
+                    unparseable += 1
+            Requirement.objects.bulk_update(
+                batch, ["name", "specifier", "extras", "marker"]
+            )
+            done += len(batch)
+            self.stdout.write(f"Parsed {done} requirements")
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Done: {done} requirements, {unparseable} unparseable")
+        )
@@ -0,0 +1,128 @@
+import json
+import platform
+import subprocess
+import sys
+from contextlib import redirect_stdout
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from main import bench
+from main.fakepypi import FakePypi
+
+
+def csv(value: str):
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the API end to end against a local fake Pypi: cold, warm and mixed "
+        "cache scenarios at several concurrency levels. Writes p50/p99 latency, "
+        "throughput, queries per request and peak RSS as JSON. Only touches the fake "
+        "projects' rows, but use a scratch database anyway."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--endpoints", type=csv, default=list(bench.ENDPOINTS))
+        parser.add_argument("--scenarios", type=csv, default=list(bench.SCENARIOS))
+        parser.add_argument(
+            "--concurrency", type=csv, default=["1", "4", "16"], help="eg 1,4,16"
+        )
+        parser.add_argument("--projects", type=int, default=20)
+        parser.add_argument("--versions", type=int, default=20)
+        parser.add_argument(
+            "--file-size", type=int, default=64 * 1024, help="Bytes per wheel or sdist."
+        )
+        parser.add_argument(
+            "--sdists", action="store_true", help="Serve sdists instead of wheels."
+        )
+        parser.add_argument(
+            "--unlisted",
+            type=float,
+            default=0.5,
+            help="Fraction of releases without requires_dist in Pypi's JSON.",
+        )
+        parser.add_argument(
+            "--latency", type=float, default=0.0, help="Seconds added per Pypi request."
+        )
+        parser.add_argument(
+            "--requests", type=int, default=0, help="Cap on requests per run."
+        )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--output", help="Write JSON here, instead of stdout.")
+
+    def handle(self, *args, **options):
+        for name, allowed in (
+            ("endpoints", bench.ENDPOINTS),
+            ("scenarios", bench.SCENARIOS),
+        ):
+            unknown = set(options[name]) - set(allowed)
+            if unknown:
+                raise CommandError(f"Unknown {name}: {', '.join(sorted(unknown))}")
+        try:
+            concurrency = [int(level) for level in options["concurrency"]]
+        except ValueError:
+            raise CommandError("--concurrency takes numbers, eg 1,4,16")
+
+        pypi = FakePypi(
+            projects=options["projects"],
+            versions=options["versions"],
+            wheel_size=options["file_size"],
+            sdists=options["sdists"],
+            unlisted=options["unlisted"],
+            latency=options["latency"],
+            seed=options["seed"],
+        )
+        real_url = settings.PYPI_URL
+        settings.PYPI_URL = pypi.start()
+        # Progress and the views' logging go to stderr, so stdout is just the JSON.
+        try:
+            with redirect_stdout(sys.stderr):
+                results = bench.run(
+                    pypi,
+                    options["endpoints"],
+                    options["scenarios"],
+                    concurrency,
+                    options["requests"],
+                    report=self.stderr.write,
+                )
+        finally:
+            settings.PYPI_URL = real_url
+            pypi.stop()
+
+        config = {
+            key: options[key]
+            for key in (
+                "projects",
+                "versions",
+                "file_size",
+                "sdists",
+                "unlisted",
+                "latency",
+                "seed",
+            )
+        }
+        output = {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "database": settings.DATABASES["default"]["ENGINE"],
+            "config": config,
+            "run_peak_rss_mb": round(bench.peak_rss_mb(), 1),
+            "results": results,
+        }
+        text = json.dumps(output, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(text + "\n")
+        else:
+            self.stdout.write(text)
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
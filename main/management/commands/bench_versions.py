@@ -0,0 +1,48 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from main import projects
+from main.version import Version, clear_cache
+
+
+class Command(BaseCommand):
+    help = "Micro-benchmark Version: parse and sort every release string of a project."
+
+    def add_arguments(self, parser):
+        parser.add_argument("project", nargs="?", default="boto3")
+        parser.add_argument("--repeat", type=int, default=20)
+
+    def handle(self, *args, **options):
+        data = projects.get_project(options["project"])
+        if data is None:
+            raise CommandError(f"Unable to find {options['project']} on Pypi")
+        releases = list(data["releases"].keys())
+        repeat = options["repeat"]
+
+        def timed(fn) -> float:
+            """Best of `repeat` runs, in ms."""
+            best = float("inf")
+            for _ in range(repeat):
+                start = time.perf_counter()
+                fn()
+                best = min(best, time.perf_counter() - start)
+            return best * 1000
+
+        def parse_cold():
+            clear_cache()
+            return [Version.from_str(v) for v in releases]
+
+        versions = [v for v in parse_cold() if v is not None]
+        results = {
+            "parse (cold)": timed(parse_cold),
+            "parse (memoized)": timed(lambda: [Version.from_str(v) for v in releases]),
+            "sort": timed(lambda: sorted(versions)),
+        }
+
+        self.stdout.write(
+            f"{options['project']}: {len(releases)} releases, "
+            f"{len(releases) - len(versions)} unparseable"
+        )
+        for name, ms in results.items():
+            self.stdout.write(f"{name:>18}: {ms:8.3f} ms")
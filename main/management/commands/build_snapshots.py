@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from main import snapshots
+from main.models import Dependency
+from main.reqs import normalize_name
+
+
+class Command(BaseCommand):
+    help = (
+        "Build packages' snapshots from what's cached, eg for versions cached before "
+        "snapshots. Views never build them; pulls only catch up packages they touch."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "packages", nargs="*", help="Packages to build; all cached ones if omitted."
+        )
+
+    def handle(self, *args, **options):
+        names = [normalize_name(name) for name in options["packages"]]
+        if not names:
+            names = list(
+                Dependency.objects.filter(reqs_complete=True)
+                .values_list("name", flat=True)
+                .distinct()
+                .order_by("name")
+            )
+        for i, name in enumerate(names, 1):
+            snapshots.rebuild([name])
+            if i % 100 == 0:
+                self.stdout.write(f"Built {i} of {len(names)} snapshots")
+        self.stdout.write(self.style.SUCCESS(f"Done: {len(names)} snapshots"))
@@ -0,0 +1,20 @@
+import signal
+
+from django.core.management.base import BaseCommand
+
+from main import jobs
+
+
+class Command(BaseCommand):
+    help = "Run queued cold-cache jobs, with a pool of worker threads."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--threads", type=int, default=4, help="Jobs to run at once."
+        )
+
+    def handle(self, *args, **options):
+        # Heroku stops dynos with SIGTERM; finish the jobs in flight, then exit.
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        self.stdout.write(f"Running jobs with {options['threads']} threads")
+        jobs.serve(options["threads"])
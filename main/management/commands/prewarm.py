@@ -0,0 +1,87 @@
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from main import prewarm, snapshots
+
+
+class Command(BaseCommand):
+    help = (
+        "Pull versions into the cache ahead of users: From requirement specs, eg "
+        "`django>=3.2`, the most downloaded projects on Pypi, or a directory of "
+        "wheels and sdists. Resumable; finished versions are recorded in a "
+        "checkpoint file."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("specs", nargs="*", help="Requirement specs to pull.")
+        parser.add_argument("--file", help="A file of requirement specs, one per line.")
+        parser.add_argument(
+            "--top", type=int, default=0, help="Pull the N most downloaded projects."
+        )
+        parser.add_argument(
+            "--dir", help="Ingest the wheels and sdists in this directory instead."
+        )
+        parser.add_argument(
+            "--latest",
+            type=int,
+            default=0,
+            help="Only the N newest matching versions of each spec.",
+        )
+        parser.add_argument("--workers", type=int, default=4)
+        parser.add_argument(
+            "--batch-size", type=int, default=16, help="Versions per unit of work."
+        )
+        parser.add_argument("--checkpoint", default="prewarm.checkpoint")
+
+    def handle(self, *args, **options):
+        checkpoint = prewarm.Checkpoint(
+            Path(options["checkpoint"]) if options["checkpoint"] else None
+        )
+
+        if options["dir"]:
+            files = prewarm.dist_files(Path(options["dir"]))
+            keys = list(files)
+            batch_size = 1  # So one bad file doesn't fail its neighbours.
+
+            def handle(batch):
+                for key in batch:
+                    prewarm.ingest_file(key, files[key])
+
+        else:
+            specs = list(options["specs"])
+            if options["file"]:
+                with open(options["file"]) as f:
+                    specs.extend(
+                        line.strip()
+                        for line in f
+                        if line.strip() and not line.startswith("#")
+                    )
+            if options["top"]:
+                specs.extend(prewarm.top_projects(options["top"]))
+            if not specs:
+                raise CommandError("Pass specs, --file, --top, or --dir")
+
+            try:
+                keys = prewarm.spec_keys(specs, options["latest"])
+            except ValueError as e:
+                raise CommandError(str(e))
+            batch_size = options["batch_size"]
+            handle = prewarm.pull_batch
+
+        self.stdout.write(
+            f"{len(keys)} versions, {len(checkpoint.done)} already checkpointed"
+        )
+        progress = prewarm.run(
+            keys,
+            handle,
+            checkpoint,
+            options["workers"],
+            batch_size,
+            report=self.stdout.write,
+        )
+        if options["dir"]:
+            # Files are ingested one at a time; add them to snapshots in one go.
+            snapshots.refresh(keys)
+        if progress.failed:
+            raise CommandError(f"{progress.failed} versions failed")
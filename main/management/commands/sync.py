@@ -0,0 +1,40 @@
+import signal
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from main import sync
+
+
+class Command(BaseCommand):
+    help = (
+        "Follow an upstream change feed, refreshing the projects we cache and "
+        "pulling their new releases."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--feed",
+            default=settings.SYNC_FEED,
+            help="`pypi`, or the path or URL of a JSON-lines feed.",
+        )
+        parser.add_argument(
+            "--once", action="store_true", help="Sync once, instead of polling."
+        )
+
+    def handle(self, *args, **options):
+        feed = sync.get_feed(options["feed"])
+        if options["once"]:
+            count = sync.sync_once(feed)
+            self.stdout.write(f"Processed {count} changes from {feed.name}")
+            return
+
+        # Heroku stops dynos with SIGTERM; finish the batch in flight, then exit.
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        stop = threading.Event()
+        self.stdout.write(f"Following {feed.name}")
+        try:
+            sync.serve(feed, stop)
+        except KeyboardInterrupt:
+            stop.set()
@@ -0,0 +1,472 @@
+"""Reading dependency metadata out of distribution files, without installing them.
+
+A wheel is a zip archive, and zip archives keep their table of contents (the central
+directory) at the end of the file. So if the server supports HTTP range requests, we
+can read the tail of the wheel, find the `.dist-info/METADATA` member in it, and
+fetch just that member: Usually two small requests, regardless of wheel size.
+
+When we do have to download a file, it's streamed to a temporary directory owned by
+the job, so concurrent jobs don't interfere, and only the member we need is read.
+
+Sdists are read without building them where possible: From PKG-INFO if its metadata
+is static (Metadata-Version 2.2+), setuptools' `egg-info/requires.txt`, the
+`[project]` table of `pyproject.toml`, or a static `setup.cfg`. Only if all of these
+fail do we ask a build backend for the metadata, in a subprocess with a timeout."""
+
+import configparser
+import json
+import os
+import signal
+import subprocess
+import sys
+import tarfile
+import tempfile
+import zipfile
+from email.parser import HeaderParser
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+
+try:
+    import tomllib
+except ImportError:  # Python < 3.11
+    try:
+        import tomli as tomllib
+    except ImportError:
+        tomllib = None
+
+from . import metrics, pypi
+
+# Bytes to fetch per range request. The tail fetch usually covers the whole central
+# directory, and a member fetch usually covers the member.
+RANGE_CHUNK = 64 * 1024
+# Bytes held in memory at once while streaming a download to disk.
+DOWNLOAD_CHUNK = 1024 * 1024
+
+
+# Files we read from the root of an sdist. egg-info may also be under `src/`.
+SDIST_FILES = ("PKG-INFO", "pyproject.toml", "setup.cfg")
+
+
+class RangesUnsupported(Exception):
+    """The server ignored our Range header, or won't tell us the file's size."""
+
+
+class MetadataError(Exception):
+    """We were unable to determine a distribution's requirements."""
+
+
+class HttpRangeFile:
+    """A read-only, seekable file over HTTP, which fetches only the byte ranges
+    that are read. Enough of the file interface for `zipfile.ZipFile`."""
+
+    def __init__(self, url: str, size: Optional[int] = None):
+        self.url = url
+        self.pos = 0
+        # (start, data) for every range fetched so far.
+        self._chunks: List[Tuple[int, bytes]] = []
+
+        if size is None:
+            resp = pypi.head(url)
+            # Some servers refuse HEAD, eg with a 405 or 403, or leave out the
+            # length; downloading the file still works. If it's really missing,
+            # the download says so.
+            length = resp.headers.get("Content-Length", "")
+            if (
+                not resp.ok
+                or resp.headers.get("Accept-Ranges") != "bytes"
+                or not length.isdigit()
+            ):
+                raise RangesUnsupported(url)
+            size = int(length)
+        self.size = size
+
+        # The central directory's at the end; grab it up front.
+        self._fetch(max(size - RANGE_CHUNK, 0), size)
+
+    def _fetch(self, start: int, end: int) -> bytes:
+        resp = pypi.get(
+            self.url, headers={"Range": f"bytes={start}-{end - 1}"}, stream=True
+        )
+        if resp.status_code != 206:
+            # Don't download the whole file by accident.
+            resp.close()
+            raise RangesUnsupported(self.url)
+        data = resp.content
+        metrics.DOWNLOADED_BYTES.inc(len(data), kind="range")
+        self._chunks.append((start, data))
+        return data
+
+    def read(self, n: int = -1) -> bytes:
+        if n is None or n < 0:
+            n = self.size - self.pos
+        end = min(self.pos + n, self.size)
+        if end <= self.pos:
+            return b""
+
+        for start, data in self._chunks:
+            if start <= self.pos and end <= start + len(data):
+                result = data[self.pos - start : end - start]
+                break
+        else:
+            fetch_end = min(max(end, self.pos + RANGE_CHUNK), self.size)
+            result = self._fetch(self.pos, fetch_end)[: end - self.pos]
+
+        self.pos = end
+        return result
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        if whence == 0:
+            self.pos = offset
+        elif whence == 1:
+            self.pos += offset
+        else:
+            self.pos = self.size + offset
+        return self.pos
+
+    def tell(self) -> int:
+        return self.pos
+
+    def seekable(self) -> bool:
+        return True
+
+    def close(self):
+        self._chunks = []
+
+
+def job_dir() -> tempfile.TemporaryDirectory:
+    """A scratch directory for one job's downloads, removed when the job's done."""
+    Path(settings.DOWNLOAD_DIR).mkdir(parents=True, exist_ok=True)
+    return tempfile.TemporaryDirectory(prefix="job-", dir=settings.DOWNLOAD_DIR)
+
+
+def download(url: str, directory: str) -> Path:
+    """Stream a file into `directory`, a chunk at a time."""
+    path = Path(directory) / url.rsplit("/", 1)[-1].split("#")[0]
+    with metrics.stage("download"), pypi.get(url, stream=True) as resp:
+        resp.raise_for_status()
+        with open(path, "wb") as f:
+            for chunk in resp.iter_content(chunk_size=DOWNLOAD_CHUNK):
+                f.write(chunk)
+                metrics.DOWNLOADED_BYTES.inc(len(chunk), kind="download")
+    return path
+
+
+def find_metadata(archive: zipfile.ZipFile) -> Optional[str]:
+    """The archive path of a wheel's top-level METADATA file."""
+    for name in archive.namelist():
+        parts = name.split("/")
+        if (
+            len(parts) == 2
+            and parts[0].endswith(".dist-info")
+            and parts[1] == "METADATA"
+        ):
+            return name
+    return None
+
+
+def parse_requires_dist(metadata: str) -> List[str]:
+    """Pull the Requires-Dist entries from a METADATA or PKG-INFO file. These use
+    email header syntax, so headers may be folded across lines."""
+    headers = HeaderParser().parsestr(metadata)
+    return [" ".join(req.split()) for req in headers.get_all("Requires-Dist") or []]
+
+
+def parse_requires_python(metadata: str) -> Optional[str]:
+    """The Requires-Python of a METADATA or PKG-INFO file, if it has one."""
+    return HeaderParser().parsestr(metadata).get("Requires-Python")
+
+
+def read_wheel(file, source: str) -> List[str]:
+    """Read the requirements from a wheel's METADATA, without extracting anything
+    else. `file` is a path or file-like object. Raises `zipfile.BadZipFile` if the
+    wheel's bad or has no METADATA."""
+    with zipfile.ZipFile(file) as archive:
+        path = find_metadata(archive)
+        if path is None:
+            raise zipfile.BadZipFile(f"No METADATA in {source}")
+        return parse_requires_dist(archive.read(path).decode("utf-8", "replace"))
+
+
+def wheel_requires_dist(url: str, size: Optional[int] = None) -> List[str]:
+    """Read the requirements of a remote wheel. We use range requests to fetch only
+    its central directory and METADATA file if the server supports them, and download
+    it otherwise. Raises `zipfile.BadZipFile` if the wheel's bad or has no METADATA."""
+    try:
+        with metrics.stage("wheel_ranges"):
+            return read_wheel(HttpRangeFile(url, size), url)
+    except RangesUnsupported:
+        print(f"No range support for {url}; downloading")
+
+    with job_dir() as directory:
+        path = download(url, directory)
+        with metrics.stage("wheel_read"):
+            return read_wheel(path, url)
+
+
+def sdist_members(path: Path) -> Dict[str, str]:
+    """Read the metadata files we care about from an sdist, keyed by their path
+    relative to the sdist's root directory. Handles tarballs and zips."""
+    wanted = {}
+
+    def relative(name: str) -> Optional[str]:
+        parts = name.split("/")[1:]
+        if len(parts) == 1 and parts[0] in SDIST_FILES:
+            return parts[0]
+        if (
+            len(parts) >= 2
+            and parts[-2].endswith(".egg-info")
+            and parts[-1] == "requires.txt"
+            and parts[:-2] in ([], ["src"])
+        ):
+            return "requires.txt"
+        return None
+
+    if zipfile.is_zipfile(path):
+        try:
+            with zipfile.ZipFile(path) as archive:
+                for name in archive.namelist():
+                    rel = relative(name)
+                    if rel is not None:
+                        wanted[rel] = archive.read(name).decode("utf-8", "replace")
+        except zipfile.BadZipFile as e:
+            raise MetadataError(f"Unable to read {path.name}: {e}")
+        return wanted
+
+    try:
+        with tarfile.open(path, "r:*") as archive:
+            for member in archive:
+                rel = relative(member.name)
+                if rel is not None and member.isfile():
+                    data = archive.extractfile(member).read()
+                    wanted[rel] = data.decode("utf-8", "replace")
+    except tarfile.TarError as e:
+        raise MetadataError(f"Unable to read {path.name}: {e}")
+    return wanted
+
+
+def add_marker(req: str, marker: str) -> str:
+    """Combine a requirement with an environment marker, eg for an extra."""
+    if not marker:
+        return req
+    if ";" in req:
+        req, existing = (part.strip() for part in req.split(";", 1))
+        return f"{req}; ({existing}) and ({marker})"
+    return f"{req}; {marker}"
+
+
+def extra_marker(extra: str) -> str:
+    return f'extra == "{extra}"'
+
+
+def parse_requires_txt(text: str) -> List[str]:
+    """Convert setuptools' requires.txt format to Requires-Dist strings. Sections
+    are headed `[extra]`, `[extra:marker]`, or `[:marker]`."""
+    result = []
+    marker = ""
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        if line.startswith("[") and line.endswith("]"):
+            extra, _, env = line[1:-1].partition(":")
+            if extra and env:
+                marker = f"({env}) and {extra_marker(extra)}"
+            elif extra:
+                marker = extra_marker(extra)
+            else:
+                marker = env
+            continue
+        result.append(add_marker(line, marker))
+    return result
+
+
+def parse_pyproject(text: str) -> Optional[List[str]]:
+    """Requirements from the `[project]` table of pyproject.toml, or None if they're
+    dynamic, or we have no TOML parser."""
+    if tomllib is None:
+        return None
+    try:
+        project = tomllib.loads(text).get("project")
+    except (ValueError, tomllib.TOMLDecodeError):
+        return None
+    if not project:
+        return None
+
+    dynamic = project.get("dynamic", [])
+    if "dependencies" in dynamic or "optional-dependencies" in dynamic:
+        return None
+
+    result = list(project.get("dependencies", []))
+    for extra, reqs in project.get("optional-dependencies", {}).items():
+        result.extend(add_marker(req, extra_marker(extra)) for req in reqs)
+    return result
+
+
+def parse_setup_cfg(text: str) -> Optional[List[str]]:
+    """Requirements from a static setup.cfg, or None if they're not specified there,
+    or are loaded from elsewhere with `file:` or `attr:`."""
+    config = configparser.ConfigParser(interpolation=None)
+    try:
+        config.read_string(text)
+    except configparser.Error:
+        return None
+    if not config.has_option("options", "install_requires"):
+        return None
+
+    def split(value: str) -> Optional[List[str]]:
+        if value.strip().startswith(("file:", "attr:")):
+            return None
+        return [line.strip() for line in value.splitlines() if line.strip()]
+
+    result = split(config.get("options", "install_requires"))
+    if result is None:
+        return None
+    if config.has_section("options.extras_require"):
+        for extra, value in config.items("options.extras_require"):
+            reqs = split(value)
+            if reqs is None:
+                return None
+            result.extend(add_marker(req, extra_marker(extra)) for req in reqs)
+    return result
+
+
+def read_sdist(path: Path) -> Optional[List[str]]:
+    """Read the requirements of a downloaded sdist from its static metadata. Returns
+    None if it doesn't have any we can trust, ie they're computed by setup.py."""
+    members = sdist_members(path)
+
+    pkg_info = members.get("PKG-INFO")
+    if pkg_info is not None:
+        headers = HeaderParser().parsestr(pkg_info)
+        try:
+            version = tuple(
+                int(n) for n in (headers.get("Metadata-Version") or "0").split(".")[:2]
+            )
+        except ValueError:
+            # Unknown, so only an explicit Requires-Dist is trusted.
+            version = (0,)
+        dynamic = [field.lower() for field in headers.get_all("Dynamic") or []]
+        # Before 2.2, a missing Requires-Dist doesn't mean there are no requirements.
+        if (version >= (2, 2) and "requires-dist" not in dynamic) or headers.get_all(
+            "Requires-Dist"
+        ):
+            return parse_requires_dist(pkg_info)
+
+    if "requires.txt" in members:
+        return parse_requires_txt(members["requires.txt"])
+
+    for name, parse in (
+        ("pyproject.toml", parse_pyproject),
+        ("setup.cfg", parse_setup_cfg),
+    ):
+        if name in members:
+            result = parse(members[name])
+            if result is not None:
+                return result
+
+    return None
+
+
+def build_requires_dist(path: Path, directory: str) -> List[str]:
+    """Have the sdist's build backend prepare its metadata, and read the requirements
+    from that. This runs arbitrary code from the sdist, so it's done in a subprocess
+    in the job's directory, with a stripped-down environment and a timeout. pip
+    only prepares metadata for a dry run; it doesn't build or install anything."""
+    report = Path(directory) / "report.json"
+    cmd = [
+        sys.executable,
+        "-m",
+        "pip",
+        "install",
+        "--dry-run",
+        "--no-deps",
+        "--ignore-installed",
+        "--no-cache-dir",
+        "--disable-pip-version-check",
+        "--quiet",
+        "--report",
+        str(report),
+        str(path),
+    ]
+    env = {
+        "PATH": os.environ.get("PATH", ""),
+        "HOME": directory,
+        "TMPDIR": directory,
+        "PIP_NO_INPUT": "1",
+    }
+    # Its own session, so we can kill anything the build backend starts, too.
+    proc = subprocess.Popen(
+        cmd,
+        cwd=directory,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        start_new_session=True,
+    )
+    try:
+        _, err = proc.communicate(timeout=settings.SDIST_BUILD_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        os.killpg(proc.pid, signal.SIGKILL)
+        proc.communicate()
+        raise MetadataError(f"Timed out preparing metadata for {path.name}")
+
+    if proc.returncode != 0:
+        message = err.decode("utf-8", "replace").strip().splitlines()[-1:] or [""]
+        raise MetadataError(f"Unable to prepare metadata for {path.name}: {message[0]}")
+
+    with open(report) as f:
+        installs = json.load(f).get("install", [])
+    if not installs:
+        raise MetadataError(f"No metadata prepared for {path.name}")
+    return installs[0]["metadata"].get("requires_dist", [])
+
+
+def sdist_requires_dist(url: str) -> List[str]:
+    """Read the requirements of a remote sdist, preferring its static metadata.
+    Raises `MetadataError` if we're unable to."""
+    with job_dir() as directory:
+        return read_or_build_sdist(download(url, directory), directory)
+
+
+def read_or_build_sdist(path: Path, directory: str) -> List[str]:
+    with metrics.stage("sdist_read"):
+        result = read_sdist(path)
+    if result is None:
+        print(f"No static metadata in {path.name}; preparing it")
+        with metrics.stage("sdist_build"):
+            result = build_requires_dist(path, directory)
+    return result
+
+
+def file_requires_dist(path: Path) -> List[str]:
+    """Read the requirements of a local wheel or sdist, eg from a mirror. Raises
+    `MetadataError` if we're unable to."""
+    if path.name.endswith(".whl"):
+        try:
+            return read_wheel(path, path.name)
+        except zipfile.BadZipFile as e:
+            raise MetadataError(f"Bad wheel {path.name}: {e}")
+
+    with job_dir() as directory:
+        return read_or_build_sdist(path, directory)
+
+
+def file_requires_python(path: Path) -> Optional[str]:
+    """The Requires-Python of a local wheel or sdist, from its METADATA or PKG-INFO,
+    or None if it doesn't say. Raises `MetadataError` if we're unable to read it."""
+    if path.name.endswith(".whl"):
+        try:
+            with zipfile.ZipFile(path) as archive:
+                member = find_metadata(archive)
+                if member is None:
+                    return None
+                text = archive.read(member).decode("utf-8", "replace")
+        except zipfile.BadZipFile as e:
+            raise MetadataError(f"Bad wheel {path.name}: {e}")
+    else:
+        text = sdist_members(path).get("PKG-INFO")
+        if text is None:
+            return None
+    return parse_requires_python(text)
@@ -0,0 +1,117 @@
+import asyncio
+import time
+from contextlib import ExitStack, contextmanager
+from typing import Callable, Iterable, Iterator, Optional
+
+from django.db import connections
+
+from . import metrics
+
+
+class QueryCount:
+    """Counts the database queries made on this thread's connections while
+    active."""
+
+    def __init__(self):
+        self.queries = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+    @contextmanager
+    def active(self) -> Iterator[None]:
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(self))
+            yield
+
+
+class ObservedContent:
+    """A streaming response's content. The body's generated as it's sent, after the
+    middleware returns, so its queries are counted as it's read, and the request is
+    recorded when the response is closed, whether or not it was read to the end."""
+
+    def __init__(
+        self,
+        content: Iterable[bytes],
+        count: Optional[QueryCount],
+        on_close: Callable[[], None],
+    ):
+        self.content = iter(content)
+        self.count = count
+        self.on_close = on_close
+        self.closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> bytes:
+        if self.count is None:
+            return next(self.content)
+        with self.count.active():
+            return next(self.content)
+
+    def close(self) -> None:
+        if not self.closed:
+            self.closed = True
+            self.on_close()
+
+
+class MetricsMiddleware:
+    """Record each request's latency, and how many database queries it made.
+    Connections are per thread, so queries from helper threads, eg concurrent Pypi
+    fetches, aren't counted. Under ASGI, async views make their queries from other
+    threads too, so for them only latency is recorded. Streaming responses are
+    recorded once they've been sent."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # So Django calls us from the event loop, instead of from a thread.
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+
+        count = QueryCount()
+        start = time.perf_counter()
+        with count.active():
+            response = self.get_response(request)
+        return self.record(request, response, start, count)
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        response = await self.get_response(request)
+        return self.record(request, response, start, None)
+
+    def record(self, request, response, start: float, count: Optional[QueryCount]):
+        def observe():
+            self.observe(
+                request,
+                response,
+                time.perf_counter() - start,
+                None if count is None else count.queries,
+            )
+
+        if response.streaming:
+            # Django closes the content when it closes the response.
+            response.streaming_content = ObservedContent(
+                response.streaming_content, count, observe
+            )
+        else:
+            observe()
+        return response
+
+    def observe(self, request, response, elapsed: float, queries: Optional[int]):
+        match = request.resolver_match
+        route = getattr(match, "route", "") if match is not None else ""
+        metrics.REQUEST_SECONDS.observe(
+            elapsed, route=route, method=request.method, status=response.status_code
+        )
+        if queries is not None:
+            metrics.REQUEST_QUERIES.observe(queries, route=route, method=request.method)
@@ -0,0 +1,31 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("main", "0011_dependency_reqs_complete")]
+
+    operations = [
+        migrations.CreateModel(
+            name="Project",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=100, unique=True)),
+                ("data", models.TextField()),
+                ("etag", models.CharField(blank=True, max_length=200, null=True)),
+                (
+                    "last_modified",
+                    models.CharField(blank=True, max_length=100, null=True),
+                ),
+                ("fetched", models.DateTimeField()),
+            ],
+        )
+    ]
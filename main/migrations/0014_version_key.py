@@ -0,0 +1,52 @@
+import json
+
+from django.db import migrations, models
+
+from main.version import version_key
+
+BATCH_SIZE = 2000
+
+
+def fill_version_keys(apps, schema_editor):
+    Dependency = apps.get_model("main", "Dependency")
+    batch = []
+    for dep in Dependency.objects.only("id", "version").iterator():
+        dep.version_key = version_key(dep.version)
+        batch.append(dep)
+        if len(batch) >= BATCH_SIZE:
+            Dependency.objects.bulk_update(batch, ["version_key"])
+            batch = []
+    Dependency.objects.bulk_update(batch, ["version_key"])
+
+
+def fill_releases(apps, schema_editor):
+    Project = apps.get_model("main", "Project")
+    for project in Project.objects.iterator():
+        project.releases = json.dumps(list(json.loads(project.data)["releases"]))
+        project.save(update_fields=["releases"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("main", "0013_job")]
+
+    operations = [
+        migrations.AddField(
+            model_name="dependency",
+            name="version_key",
+            field=models.CharField(blank=True, default="", max_length=255),
+        ),
+        migrations.AddField(
+            model_name="project",
+            name="releases",
+            field=models.TextField(default="[]"),
+        ),
+        migrations.AddIndex(
+            model_name="dependency",
+            index=models.Index(
+                fields=["name", "version_key"], name="main_depend_name_2c22a6_idx"
+            ),
+        ),
+        migrations.RunPython(fill_version_keys, migrations.RunPython.noop),
+        migrations.RunPython(fill_releases, migrations.RunPython.noop),
+    ]
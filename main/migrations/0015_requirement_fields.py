@@ -0,0 +1,33 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("main", "0014_version_key")]
+
+    operations = [
+        migrations.AddField(
+            model_name="requirement",
+            name="extras",
+            field=models.CharField(blank=True, default="", max_length=200),
+        ),
+        migrations.AddField(
+            model_name="requirement",
+            name="marker",
+            field=models.CharField(blank=True, default="", max_length=500),
+        ),
+        migrations.AddField(
+            model_name="requirement",
+            name="name",
+            field=models.CharField(blank=True, default="", max_length=100),
+        ),
+        migrations.AddField(
+            model_name="requirement",
+            name="specifier",
+            field=models.CharField(blank=True, default="", max_length=500),
+        ),
+        migrations.AddIndex(
+            model_name="requirement",
+            index=models.Index(fields=["name"], name="main_requir_name_553655_idx"),
+        ),
+    ]
@@ -0,0 +1,19 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("main", "0015_requirement_fields")]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="requirement",
+            name="main_requir_name_553655_idx",
+        ),
+        migrations.AddIndex(
+            model_name="requirement",
+            index=models.Index(
+                fields=["name", "id"], name="main_requir_name_df4200_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,26 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("main", "0016_dependents_index")]
+
+    operations = [
+        migrations.CreateModel(
+            name="SyncState",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("feed", models.CharField(max_length=200, unique=True)),
+                ("serial", models.BigIntegerField()),
+                ("updated", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
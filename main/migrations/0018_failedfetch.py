@@ -0,0 +1,44 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("main", "0017_syncstate")]
+
+    operations = [
+        migrations.CreateModel(
+            name="FailedFetch",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=100)),
+                ("version", models.CharField(max_length=100)),
+                (
+                    "reason",
+                    models.CharField(
+                        choices=[
+                            ("not_found", "not_found"),
+                            ("no_files", "no_files"),
+                            ("bad_wheel", "bad_wheel"),
+                            ("no_metadata", "no_metadata"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                ("detail", models.TextField(blank=True, null=True)),
+                ("attempts", models.IntegerField(default=1)),
+                ("retry_after", models.DateTimeField()),
+                ("updated", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "unique_together": {("name", "version")},
+            },
+        ),
+    ]
@@ -0,0 +1,58 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("main", "0019_snapshot")]
+
+    operations = [
+        migrations.CreateModel(
+            name="DistFile",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("filename", models.CharField(max_length=300)),
+                ("url", models.CharField(max_length=500)),
+                ("sha256", models.CharField(blank=True, default="", max_length=64)),
+                ("size", models.BigIntegerField(blank=True, null=True)),
+                ("packagetype", models.CharField(max_length=20)),
+                (
+                    "python_version",
+                    models.CharField(blank=True, default="", max_length=50),
+                ),
+                (
+                    "requires_python",
+                    models.CharField(blank=True, max_length=200, null=True),
+                ),
+                ("yanked", models.BooleanField(default=False)),
+                (
+                    "python_tag",
+                    models.CharField(blank=True, default="", max_length=100),
+                ),
+                ("abi_tag", models.CharField(blank=True, default="", max_length=100)),
+                (
+                    "platform_tag",
+                    models.CharField(blank=True, default="", max_length=300),
+                ),
+                (
+                    "dependency",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="files",
+                        to="main.dependency",
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("dependency", "filename")},
+            },
+        ),
+    ]
@@ -0,0 +1,20 @@
+from django.db import migrations, models
+
+
+def mark_recorded(apps, schema_editor):
+    Dependency = apps.get_model("main", "Dependency")
+    Dependency.objects.filter(files__isnull=False).update(files_recorded=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("main", "0020_distfile")]
+
+    operations = [
+        migrations.AddField(
+            model_name="dependency",
+            name="files_recorded",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(mark_recorded, migrations.RunPython.noop),
+    ]
@@ -1,28 +1,37 @@
-from typing import List
+from typing import List, Optional
 
 from django.db import models
 
+from . import reqs
+from .version import version_key
+
 
 class Dependency(models.Model):
     """An analog of DepNode in pypackage."""
 
-    # todo: Perhaps store filename, hash etc here, so we don't pull multiple times in pypackage.
     name = models.CharField(max_length=100)
     version = models.CharField(max_length=100)  # Includes version info
+    # Sorts in version order; see `Version.sortable`. Empty if unparseable.
+    version_key = models.CharField(max_length=255, blank=True, default="")
     requires_python = models.CharField(max_length=200, blank=True, null=True)
     reqs_complete = models.BooleanField(default=False)
+    # Whether its files have been recorded, so ones with none aren't looked up again.
+    files_recorded = models.BooleanField(default=False)
 
-    # filename = models.CharField(max_length=100)
-    # hash = models.CharField(max_length=300)
-    # file_url = models.CharField(max_length=500)
     # version_reqs = models.ManyToManyField(Requirement)
     # dependencies = models.ManyToManyField("self")
 
     def requires_dist(self) -> List[str]:
         """ We only use Requirement as a separate model, since there's no
         no good way to represent a list in a relational DB. For serialization,
-        we just want the text"""
-        return [req.data for req in Requirement.objects.filter(dependency=self)]
+        we just want the text. Reads through the `requirements` relation, so
+        querysets using `prefetch_related("requirements")` don't hit the DB here."""
+        return [req.data for req in self.requirements.all()]
+
+    def save(self, *args, **kwargs):
+        if not self.version_key:
+            self.version_key = version_key(self.version)
+        super().save(*args, **kwargs)
 
     def __repr__(self):
         return f'{self.name}: "{self.version}"'
@@ -32,21 +41,93 @@ class Dependency(models.Model):
 
     class Meta:
         unique_together = ("name", "version")
+        indexes = [models.Index(fields=["name", "version_key"])]
+
+
+class DistFile(models.Model):
+    """A wheel or sdist of a version, as Pypi lists it, so clients can download and
+    verify it without asking Pypi. Wheel tags are from the filename; they're empty
+    for other kinds of file."""
+
+    dependency = models.ForeignKey(
+        Dependency, related_name="files", on_delete=models.CASCADE
+    )
+    filename = models.CharField(max_length=300)
+    url = models.CharField(max_length=500)
+    sha256 = models.CharField(max_length=64, blank=True, default="")
+    size = models.BigIntegerField(blank=True, null=True)
+    # eg "bdist_wheel", "sdist"
+    packagetype = models.CharField(max_length=20)
+    # eg "py3", "cp38", or "source"
+    python_version = models.CharField(max_length=50, blank=True, default="")
+    requires_python = models.CharField(max_length=200, blank=True, null=True)
+    yanked = models.BooleanField(default=False)
+    # From eg "...-cp38-cp38-manylinux2014_x86_64.whl". Compressed tag sets are kept
+    # as is, eg "py2.py3".
+    python_tag = models.CharField(max_length=100, blank=True, default="")
+    abi_tag = models.CharField(max_length=100, blank=True, default="")
+    platform_tag = models.CharField(max_length=300, blank=True, default="")
+
+    def __repr__(self):
+        return self.filename
+
+    def __str__(self):
+        return self.__repr__()
+
+    class Meta:
+        unique_together = ("dependency", "filename")
 
 
 class Requirement(models.Model):
-    # Let's not handle parsing in this project.
+    # The raw `Requires-Dist` string; this is what the API returns.
     data = models.CharField(max_length=500)
 
-    # name = models.CharField(max_length=100)
+    # Parsed from `data` when saved, so requirements can be queried by what they
+    # require. Name's empty if `data` isn't a requirement we can parse.
+    name = models.CharField(max_length=100, blank=True, default="")
     # eg "!=2.0.4,!=2.1.2,!=2.1.6,>=2.0.1"
-    # versions = models.CharField(max_length=500)
+    specifier = models.CharField(max_length=500, blank=True, default="")
+    # Sorted and comma-separated, eg "security,socks"
+    extras = models.CharField(max_length=200, blank=True, default="")
+    marker = models.CharField(max_length=500, blank=True, default="")
     dependency = models.ForeignKey(
         Dependency, related_name="requirements", on_delete=models.CASCADE
     )
 
-    # def from_str(self, dependency: Dependency) -> Requirement:
-    #     return Requirement(name=name, versions=versions)
+    @classmethod
+    def from_data(cls, data: str, dependency: Dependency) -> "Requirement":
+        """A requirement with its parsed fields set, for use with `bulk_create`,
+        which skips `save`."""
+        req = cls(data=data, dependency=dependency)
+        req.fill_parsed()
+        return req
+
+    def fill_parsed(self) -> None:
+        parsed = reqs.parse(self.data)
+        if parsed is None:
+            return
+        self.name = parsed.name
+        self.specifier = parsed.specifier
+        self.extras = ",".join(sorted(parsed.extras))
+        self.marker = parsed.marker
+
+    def parsed(self) -> Optional[reqs.ParsedReq]:
+        """The parsed requirement, from the stored fields where we have them."""
+        if not self.name:
+            # Unparseable, or saved before we parsed requirements.
+            return reqs.parse(self.data)
+        return reqs.ParsedReq(
+            name=self.name,
+            extras=frozenset(self.extras.split(",")) if self.extras else frozenset(),
+            specifier=self.specifier,
+            marker=self.marker,
+            url="",
+        )
+
+    def save(self, *args, **kwargs):
+        if not self.name:
+            self.fill_parsed()
+        super().save(*args, **kwargs)
 
     def __repr__(self):
         return f'{self.data}, required by {self.dependency.name}="{self.dependency.version}"'
@@ -56,3 +137,118 @@ class Requirement(models.Model):
 
     class Meta:
         unique_together = ("data", "dependency")
+        # Reverse dependencies, paged by id.
+        indexes = [models.Index(fields=["name", "id"])]
+
+
+class Project(models.Model):
+    """A cached copy of the Pypi warehouse document for a project, which lists all
+    its releases. We keep the validators Pypi sent with it, so it can be revalidated
+    cheaply once stale."""
+
+    name = models.CharField(max_length=100, unique=True)
+    data = models.TextField()  # The raw JSON document.
+    # A JSON list of the project's release versions, so we don't have to parse
+    # the whole document to get them.
+    releases = models.TextField(default="[]")
+    etag = models.CharField(max_length=200, blank=True, null=True)
+    last_modified = models.CharField(max_length=100, blank=True, null=True)
+    fetched = models.DateTimeField()
+
+    def __repr__(self):
+        return f"{self.name}, fetched {self.fetched}"
+
+    def __str__(self):
+        return self.__repr__()
+
+
+class Job(models.Model):
+    """Cold (name, version) work, queued for the ingest workers instead of being
+    done inside a request. There's at most one job per (name, version), so duplicate
+    requests collapse into it."""
+
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUSES = [(s, s) for s in (PENDING, RUNNING, DONE, FAILED)]
+
+    name = models.CharField(max_length=100)
+    version = models.CharField(max_length=100)
+    status = models.CharField(max_length=10, choices=STATUSES, default=PENDING)
+    error = models.TextField(blank=True, null=True)
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __repr__(self):
+        return f'{self.name} = "{self.version}": {self.status}'
+
+    def __str__(self):
+        return self.__repr__()
+
+    class Meta:
+        unique_together = ("name", "version")
+        indexes = [models.Index(fields=["status", "updated"])]
+
+
+class SyncState(models.Model):
+    """How far we've followed an upstream change feed, so syncing picks up from
+    there instead of re-reading it."""
+
+    feed = models.CharField(max_length=200, unique=True)
+    serial = models.BigIntegerField()
+    updated = models.DateTimeField(auto_now=True)
+
+    def __repr__(self):
+        return f"{self.feed}: serial {self.serial}"
+
+    def __str__(self):
+        return self.__repr__()
+
+
+class FailedFetch(models.Model):
+    """A (name, version) we were unable to get reqs for, so we don't repeat the
+    work on every request. It's retried once `retry_after` passes, backing off
+    exponentially with each failed attempt."""
+
+    NOT_FOUND = "not_found"  # Pypi doesn't know about it.
+    NO_FILES = "no_files"  # No wheel or sdist.
+    BAD_WHEEL = "bad_wheel"  # Corrupt, or no METADATA.
+    NO_METADATA = "no_metadata"  # Unable to read or build the sdist's metadata.
+    REASONS = [(r, r) for r in (NOT_FOUND, NO_FILES, BAD_WHEEL, NO_METADATA)]
+
+    name = models.CharField(max_length=100)
+    version = models.CharField(max_length=100)
+    reason = models.CharField(max_length=20, choices=REASONS)
+    detail = models.TextField(blank=True, null=True)
+    attempts = models.IntegerField(default=1)
+    retry_after = models.DateTimeField()
+    updated = models.DateTimeField(auto_now=True)
+
+    def __repr__(self):
+        return (
+            f'{self.name} = "{self.version}": {self.reason}, {self.attempts} attempts'
+        )
+
+    def __str__(self):
+        return self.__repr__()
+
+    class Meta:
+        unique_together = ("name", "version")
+
+
+class Snapshot(models.Model):
+    """Every cached version of a package, with complete reqs, pre-rendered as the
+    range endpoints return them, and compressed; see `snapshots`. Rebuilt when we
+    pull versions of the package, so cached lookups are one row read."""
+
+    name = models.CharField(max_length=100, unique=True)
+    data = models.BinaryField()
+    versions = models.IntegerField(default=0)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __repr__(self):
+        return f"{self.name}: {self.versions} versions"
+
+    def __str__(self):
+        return self.__repr__()
@@ -0,0 +1,216 @@
+"""Filling the cache ahead of users, so the first people to ask for a release don't
+pay to pull it: From requirement specs, Pypi's most downloaded projects, or a local
+directory of wheels and sdists, eg a mirror snapshot. Work runs in batches on a
+pool of threads, and finished batches are appended to a checkpoint file, so an
+interrupted run picks up where it left off."""
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from . import metadata, projects, pypi, reqs, snapshots
+from .models import Dependency
+from .version import SpecifierSet, Version, version_key
+from .views import group_by_name, process_many, save_reqs
+
+Key = Tuple[str, str]
+
+SDIST_SUFFIXES = (".tar.gz", ".tar.bz2", ".tgz", ".zip")
+
+
+def spec_keys(specs: Iterable[str], latest: int = 0) -> List[Key]:
+    """The releases matching requirement specs, eg `django>=3.2`. A bare name
+    matches every release. With `latest`, only that many of the newest matching
+    releases of each spec."""
+    parsed = []
+    for spec in specs:
+        req = reqs.parse(spec)
+        if req is None:
+            raise ValueError(f"{spec} isn't a valid requirement")
+        parsed.append((req, SpecifierSet(req.specifier)))
+
+    releases = projects.get_releases_many(req.name for req, _ in parsed)
+    keys = []
+    for req, specifier in parsed:
+        versions = specifier.filter(releases.get(req.name) or [])
+        if latest:
+            versions = sorted(versions, key=Version.from_str)[-latest:]
+        keys.extend((req.name, version) for version in versions)
+    return list(dict.fromkeys(keys))
+
+
+def top_projects(n: int) -> List[str]:
+    """The `n` most downloaded projects on Pypi."""
+    resp = pypi.get(settings.TOP_PACKAGES_URL)
+    resp.raise_for_status()
+    return [reqs.normalize_name(row["project"]) for row in resp.json()["rows"][:n]]
+
+
+def split_filename(filename: str) -> Optional[Key]:
+    """The (name, version) of a wheel or sdist, from its filename."""
+    if filename.endswith(".whl"):
+        parts = filename[: -len(".whl")].split("-")
+        if len(parts) < 5:
+            return None
+        return reqs.normalize_name(parts[0]), parts[1]
+
+    for suffix in SDIST_SUFFIXES:
+        if filename.endswith(suffix):
+            name, _, version = filename[: -len(suffix)].rpartition("-")
+            if not name or Version.from_str(version) is None:
+                return None
+            return reqs.normalize_name(name), version
+    return None
+
+
+def dist_files(directory: Path) -> Dict[Key, Path]:
+    """The distribution files in a directory tree, one per (name, version),
+    preferring wheels, which we can read without building."""
+    found: Dict[Key, Path] = {}
+    for root, _, filenames in os.walk(directory):
+        for filename in sorted(filenames):
+            key = split_filename(filename)
+            if key is None:
+                continue
+            if key not in found or filename.endswith(".whl"):
+                found[key] = Path(root) / filename
+    return found
+
+
+def ingest_file(key: Key, path: Path) -> None:
+    """Store the reqs and Requires-Python of a local distribution file, with the
+    same metadata reading `cache_dep` uses for downloaded ones. New versions are
+    left for the caller to add to snapshots in bulk."""
+    name, version = key
+    if Dependency.objects.filter(
+        name=name, version=version, reqs_complete=True
+    ).exists():
+        return
+
+    req_strs = metadata.file_requires_dist(path)
+    requires_python = metadata.file_requires_python(path)
+    with transaction.atomic():
+        dep, created = Dependency.objects.get_or_create(
+            name=name,
+            version=version,
+            defaults={
+                "version_key": version_key(version),
+                "requires_python": requires_python,
+            },
+        )
+        filled = not created and requires_python and not dep.requires_python
+        if filled:
+            dep.requires_python = requires_python
+            dep.save(update_fields=["requires_python"])
+        save_reqs([(dep, req_strs)])
+    if filled:
+        # It was cached already, so bring its snapshot up to date now.
+        snapshots.refresh([key])
+
+
+def pull_batch(batch: List[Key]) -> List[Key]:
+    """Pull a batch. Returns the keys we were unable to get reqs for, eg ones
+    recorded as failures."""
+    pulled = {(dep.name, dep.version) for dep in process_many(group_by_name(batch))}
+    return [key for key in batch if key not in pulled]
+
+
+class Checkpoint:
+    """The (name, version) pairs done so far, one `name==version` per line."""
+
+    def __init__(self, path: Optional[Path]):
+        self.path = path
+        self.done: Set[Key] = set()
+        self._lock = threading.Lock()
+        if path is not None and path.exists():
+            for line in path.read_text().splitlines():
+                name, sep, version = line.partition("==")
+                if sep:
+                    self.done.add((name, version))
+
+    def add(self, keys: List[Key]) -> None:
+        with self._lock:
+            self.done.update(keys)
+            if self.path is not None:
+                with self.path.open("a") as f:
+                    f.writelines(f"{name}=={version}\n" for name, version in keys)
+
+
+class Progress:
+    def __init__(self, total: int):
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.start = time.monotonic()
+
+    def __str__(self) -> str:
+        elapsed = time.monotonic() - self.start
+        rate = self.done / elapsed if elapsed else 0
+        return (
+            f"{self.done}/{self.total} versions, {self.failed} failed, "
+            f"{rate:.1f}/s, {elapsed:.0f}s elapsed"
+        )
+
+
+def run(
+    keys: List[Key],
+    handle: Callable[[List[Key]], Optional[List[Key]]],
+    checkpoint: Checkpoint,
+    workers: int,
+    batch_size: int,
+    report: Callable[[str], None] = print,
+) -> Progress:
+    """Run `handle` over batches of `keys` on a pool of threads, skipping keys
+    already checkpointed. `handle` may return keys it failed on; those, and whole
+    batches it raises on, count as failed and aren't checkpointed, so a later run
+    tries them again. Reports progress every `PREWARM_REPORT_INTERVAL` seconds."""
+    todo = [key for key in keys if key not in checkpoint.done]
+    batches = [todo[i : i + batch_size] for i in range(0, len(todo), batch_size)]
+    progress = Progress(len(todo))
+    last_report = progress.start
+
+    def work(batch: List[Key]) -> Optional[List[Key]]:
+        try:
+            return handle(batch)
+        finally:
+            # Each thread has its own connection; don't leave them open.
+            connection.close()
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    futures = {executor.submit(work, batch): batch for batch in batches}
+    try:
+        for future in as_completed(futures):
+            batch = futures[future]
+            try:
+                failed = future.result() or []
+            except Exception as e:
+                progress.failed += len(batch)
+                report(f"Failed on {batch}: {e!r}")
+            else:
+                if failed:
+                    report(f"Failed on {failed}")
+                done = [key for key in batch if key not in failed]
+                checkpoint.add(done)
+                progress.done += len(done)
+                progress.failed += len(failed)
+
+            now = time.monotonic()
+            if now - last_report >= settings.PREWARM_REPORT_INTERVAL:
+                report(str(progress))
+                last_report = now
+    except KeyboardInterrupt:
+        # Let the batches in flight finish, so they're checkpointed, but no more.
+        for future in futures:
+            future.cancel()
+        raise
+    finally:
+        executor.shutdown()
+
+    report(str(progress))
+    return progress
@@ -0,0 +1,226 @@
+"""A cache of Pypi warehouse project documents, which list every release of a
+project. For big projects these are megabytes, and we need them for every range
+query, so we keep them in two layers: The `Project` table, shared between workers,
+and an in-process LRU of parsed documents, bounded by size. Documents are trusted
+for `PROJECT_CACHE_TTL` seconds; after that they're revalidated with Pypi, which
+usually costs a 304."""
+
+import json
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import requests
+from django.conf import settings
+from django.db import IntegrityError
+from django.utils import timezone
+
+from . import metrics, pypi
+from .models import Project
+
+
+class ProjectLRU:
+    """Parsed project documents, keyed by name. Evicts least-recently-used entries
+    once the total size of the raw documents passes `max_bytes`."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        # name: (document, size, fetched)
+        self._entries: "OrderedDict[str, Tuple[dict, int, datetime]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, name: str) -> Optional[Tuple[dict, datetime]]:
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None:
+                return None
+            self._entries.move_to_end(name)
+            return entry[0], entry[2]
+
+    def put(self, name: str, data: dict, size: int, fetched: datetime):
+        with self._lock:
+            self._discard(name)
+            if size > self.max_bytes:
+                return
+            self._entries[name] = (data, size, fetched)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self.size -= evicted_size
+
+    def _discard(self, name: str):
+        """Callers must hold the lock."""
+        entry = self._entries.pop(name, None)
+        if entry is not None:
+            self.size -= entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+_lru = ProjectLRU(settings.PROJECT_CACHE_MAX_BYTES)
+
+
+def is_fresh(fetched: datetime) -> bool:
+    return timezone.now() - fetched < timedelta(seconds=settings.PROJECT_CACHE_TTL)
+
+
+def get_project(name: str, refresh: bool = False) -> Optional[dict]:
+    """Get the warehouse document for a project, only going to Pypi if our copy is
+    stale, or if `refresh` is set (eg we're looking for a release newer than our copy).
+    Returns None if Pypi doesn't know about the project."""
+    if not refresh:
+        cached = _lru.get(name)
+        if cached is not None and is_fresh(cached[1]):
+            metrics.CACHE.inc(cache="project", result="memory")
+            return cached[0]
+
+    project = Project.objects.filter(name=name).first()
+    if project is not None and not refresh and is_fresh(project.fetched):
+        metrics.CACHE.inc(cache="project", result="db")
+        data = json.loads(project.data)
+        _lru.put(name, data, len(project.data), project.fetched)
+        return data
+
+    return _update(name, project, lambda: _request(name, project))
+
+
+def _request(name: str, project: Optional[Project]) -> Optional[pypi.ProjectResponse]:
+    if project is None:
+        return pypi.get_project(name)
+    return pypi.get_project(name, project.etag, project.last_modified)
+
+
+def _update(
+    name: str,
+    project: Optional[Project],
+    get_response: Callable[[], Optional[pypi.ProjectResponse]],
+) -> Optional[dict]:
+    """Store the result of revalidating our copy of a project, and return the
+    document. `get_response` gives Pypi's response, or raises if the request failed."""
+    try:
+        resp = get_response()
+    except requests.RequestException:
+        if project is None:
+            raise
+        return use_stale(name, project)
+
+    if resp is None:
+        return None
+
+    now = timezone.now()
+    metrics.CACHE.inc(
+        cache="project", result="revalidated" if resp.text is None else "miss"
+    )
+    if resp.text is None:  # Unchanged since our copy.
+        Project.objects.filter(id=project.id).update(fetched=now)
+        text = project.data
+    else:
+        text = resp.text
+        if project is None:
+            project = Project(name=name)
+        project.data = text
+        project.releases = json.dumps(list(json.loads(text)["releases"]))
+        project.etag = resp.etag
+        project.last_modified = resp.last_modified
+        project.fetched = now
+        try:
+            project.save()
+        except IntegrityError:
+            # Another request cached it at the same time; theirs is as good as ours.
+            pass
+
+    data = json.loads(text)
+    _lru.put(name, data, len(text), now)
+    return data
+
+
+def store_response(
+    name: str, project: Optional[Project], resp: Optional[pypi.ProjectResponse]
+) -> Optional[dict]:
+    """`_update`, for a response we already have, eg from the async client."""
+    return _update(name, project, lambda: resp)
+
+
+def use_stale(name: str, project: Project) -> dict:
+    """Better a stale copy than nothing, if we're unable to revalidate it."""
+    print(f"Unable to revalidate {name} with Pypi; using a stale copy.")
+    data = json.loads(project.data)
+    _lru.put(name, data, len(project.data), project.fetched)
+    return data
+
+
+def fresh_releases(name: str) -> Optional[List[str]]:
+    """The versions a project has released, if we have a fresh copy of its
+    document. Returns None if we'd need to ask Pypi."""
+    cached = _lru.get(name)
+    if cached is not None and is_fresh(cached[1]):
+        metrics.CACHE.inc(cache="project", result="memory")
+        return list(cached[0]["releases"])
+
+    project = Project.objects.filter(name=name).only("releases", "fetched").first()
+    if project is not None and is_fresh(project.fetched):
+        metrics.CACHE.inc(cache="project", result="db")
+        return json.loads(project.releases)
+    return None
+
+
+def get_releases(name: str) -> Optional[List[str]]:
+    """The versions a project has released, as Pypi lists them. Where we don't have
+    the project's document in memory, this reads our stored list of releases instead
+    of the whole document. Returns None if Pypi doesn't know about the project."""
+    releases = fresh_releases(name)
+    if releases is not None:
+        return releases
+
+    data = get_project(name)
+    return None if data is None else list(data["releases"])
+
+
+def get_releases_many(names: Iterable[str]) -> Dict[str, Optional[List[str]]]:
+    """`get_releases` for many projects: One query for the stored lists, and the
+    projects we need to revalidate are requested from Pypi concurrently."""
+    names = list(dict.fromkeys(names))
+    result: Dict[str, Optional[List[str]]] = {}
+    for name in names:
+        cached = _lru.get(name)
+        if cached is not None and is_fresh(cached[1]):
+            metrics.CACHE.inc(cache="project", result="memory")
+            result[name] = list(cached[0]["releases"])
+
+    missing = [name for name in names if name not in result]
+    if not missing:
+        return result
+
+    stale = {}
+    for project in Project.objects.filter(name__in=missing).defer("data"):
+        if is_fresh(project.fetched):
+            metrics.CACHE.inc(cache="project", result="db")
+            result[project.name] = json.loads(project.releases)
+        else:
+            stale[project.name] = project
+    # Revalidating may need the stored document; only load it for stale projects.
+    stale = {
+        project.name: project for project in Project.objects.filter(name__in=stale)
+    }
+
+    to_fetch = [name for name in missing if name not in result]
+    if not to_fetch:
+        return result
+
+    with ThreadPoolExecutor(
+        max_workers=min(settings.PYPI_FETCH_WORKERS, len(to_fetch))
+    ) as executor:
+        futures = {
+            name: executor.submit(_request, name, stale.get(name)) for name in to_fetch
+        }
+        # Store from this thread, so we don't need a database connection per worker.
+        for name, future in futures.items():
+            data = _update(name, stale.get(name), future.result)
+            result[name] = None if data is None else list(data["releases"])
+    return result
@@ -0,0 +1,116 @@
+"""A shared HTTP client for talking to Pypi. There's one session per worker process,
+so connections are pooled and kept alive between requests, instead of paying for a
+new TCP and TLS handshake on every call."""
+
+import threading
+import xmlrpc.client
+from typing import NamedTuple, Optional
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from . import metrics
+
+USER_AGENT = "pydeps (https://pydeps.herokuapp.com)"
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+
+def session() -> requests.Session:
+    """Lazily create the worker's session; the retry and pool settings are read
+    from Django settings, so this can't happen at import time."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                retry = Retry(
+                    total=settings.PYPI_RETRIES,
+                    backoff_factor=settings.PYPI_BACKOFF,
+                    status_forcelist=RETRY_STATUSES,
+                )
+                adapter = HTTPAdapter(
+                    pool_connections=settings.PYPI_POOL_SIZE,
+                    pool_maxsize=settings.PYPI_POOL_SIZE,
+                    max_retries=retry,
+                )
+                s = requests.Session()
+                s.mount("https://", adapter)
+                s.mount("http://", adapter)
+                s.headers["User-Agent"] = USER_AGENT
+                _session = s
+    return _session
+
+
+def get(url: str, **kwargs) -> requests.Response:
+    """A GET through the shared session, with our default timeout."""
+    kwargs.setdefault("timeout", settings.PYPI_TIMEOUT)
+    return session().get(url, **kwargs)
+
+
+def head(url: str, **kwargs) -> requests.Response:
+    kwargs.setdefault("timeout", settings.PYPI_TIMEOUT)
+    kwargs.setdefault("allow_redirects", True)
+    return session().head(url, **kwargs)
+
+
+class ProjectResponse(NamedTuple):
+    # None if the document hasn't changed since the validators we sent.
+    text: Optional[str]
+    etag: Optional[str]
+    last_modified: Optional[str]
+
+
+def get_project(
+    name: str, etag: Optional[str] = None, last_modified: Optional[str] = None
+) -> Optional[ProjectResponse]:
+    """Pull the warehouse document for a project, with all its releases. If we pass
+    the ETag or Last-Modified headers of a copy we already have, Pypi answers with a
+    304 instead of sending an unchanged document again. Returns None if Pypi doesn't
+    know about the project. Callers should use `projects.get_project`, which caches."""
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+
+    with metrics.stage("pypi_project"):
+        resp = get(f"{settings.PYPI_URL}/pypi/{name}/json", headers=headers)
+    metrics.DOWNLOADED_BYTES.inc(len(resp.content), kind="json")
+    if resp.status_code == 404:
+        return None
+    if resp.status_code == 304:
+        return ProjectResponse(None, etag, last_modified)
+    resp.raise_for_status()
+
+    return ProjectResponse(
+        resp.text, resp.headers.get("ETag"), resp.headers.get("Last-Modified")
+    )
+
+
+def get_release(name: str, version: str) -> Optional[dict]:
+    """Pull the warehouse document for a single version. Returns None if Pypi
+    doesn't know about it."""
+    with metrics.stage("pypi_release"):
+        resp = get(f"{settings.PYPI_URL}/pypi/{name}/{version}/json")
+    metrics.DOWNLOADED_BYTES.inc(len(resp.content), kind="json")
+    if resp.status_code == 404:
+        return None
+    resp.raise_for_status()
+    return resp.json()
+
+
+def xmlrpc_call(method: str, *params):
+    """Call a method of Pypi's XML-RPC API, through the shared session. Only a few
+    methods, like the changelog, have no JSON equivalent."""
+    resp = session().post(
+        f"{settings.PYPI_URL}/pypi",
+        data=xmlrpc.client.dumps(params, method),
+        headers={"Content-Type": "text/xml"},
+        timeout=settings.PYPI_TIMEOUT,
+    )
+    resp.raise_for_status()
+    return xmlrpc.client.loads(resp.content)[0][0]
@@ -0,0 +1,52 @@
+"""Compact response formats for clients that load many deps at once: newline-
+delimited JSON, and msgpack if it's installed. Both can be streamed a record at a
+time, so clients can start on the first records while later ones are pulled."""
+
+import json
+from typing import Iterable, Iterator
+
+from rest_framework.renderers import BaseRenderer
+
+try:
+    import msgpack
+except ImportError:  # Optional; without it, msgpack isn't offered.
+    msgpack = None
+
+
+class NDJSONRenderer(BaseRenderer):
+    """One JSON document per line. Lists are rendered an item per line."""
+
+    media_type = "application/x-ndjson"
+    format = "ndjson"
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None) -> bytes:
+        records = data if isinstance(data, list) else [data]
+        return b"".join(self.stream(records))
+
+    def stream(self, records: Iterable) -> Iterator[bytes]:
+        for record in records:
+            yield json.dumps(record, separators=(",", ":")).encode() + b"\n"
+
+
+class MsgpackRenderer(BaseRenderer):
+    """A stream of msgpack objects, eg for `msgpack.Unpacker`. Lists are rendered an
+    item per object."""
+
+    media_type = "application/msgpack"
+    format = "msgpack"
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None) -> bytes:
+        records = data if isinstance(data, list) else [data]
+        return b"".join(self.stream(records))
+
+    def stream(self, records: Iterable) -> Iterator[bytes]:
+        packer = msgpack.Packer()
+        for record in records:
+            yield packer.pack(record)
+
+
+STREAMING_RENDERERS = [NDJSONRenderer]
+if msgpack is not None:
+    STREAMING_RENDERERS.append(MsgpackRenderer)
@@ -0,0 +1,78 @@
+"""Parsing requirement strings, as they appear in `Requires-Dist`, eg
+`requests[socks] (>=2.20,<3) ; python_version >= "3.6" and extra == "net"`."""
+
+import re
+from typing import FrozenSet, NamedTuple, Optional
+
+REQ_RE = re.compile(
+    r"""
+    ^\s*
+    (?P<name>[A-Za-z0-9](?:[A-Za-z0-9._-]*[A-Za-z0-9])?)
+    \s*
+    (?:\[(?P<extras>[^\]]*)\])?
+    \s*
+    (?P<rest>.*?)
+    \s*$
+    """,
+    re.VERBOSE,
+)
+
+# Markers that gate a requirement on an extra, eg `extra == "socks"`.
+EXTRA_MARKER_RE = re.compile(
+    r"""\bextra\s*==\s*(?:"([^"]*)"|'([^']*)')|(?:"([^"]*)"|'([^']*)')\s*==\s*extra\b"""
+)
+
+
+class ParsedReq(NamedTuple):
+    name: str
+    extras: FrozenSet[str]
+    specifier: str
+    marker: str
+    url: str
+
+    @property
+    def marker_extras(self) -> FrozenSet[str]:
+        """The extras this requirement's marker asks for. If any, it only applies
+        when one of them is installed."""
+        return frozenset(
+            normalize_extra(next(g for g in m.groups() if g is not None))
+            for m in EXTRA_MARKER_RE.finditer(self.marker)
+        )
+
+
+def normalize_name(name: str) -> str:
+    """There's inconsistent package name formatting across the ecosystem; all db
+    entries are lowercase, with dashes."""
+    return name.replace("_", "-").lower()
+
+
+def normalize_extra(extra: str) -> str:
+    return re.sub(r"[-_.]+", "-", extra.strip()).lower()
+
+
+def parse(data: str) -> Optional[ParsedReq]:
+    """Returns None if `data` isn't a requirement we can make sense of."""
+    m = REQ_RE.match(data)
+    if m is None:
+        return None
+
+    rest = m.group("rest")
+    url = ""
+    if rest.startswith("@"):
+        # A URL must be followed by whitespace before a marker, since it may contain `;`.
+        url, _, marker = rest[1:].strip().partition(" ;")
+        specifier = ""
+    else:
+        specifier, _, marker = rest.partition(";")
+        specifier = specifier.strip()
+        if specifier.startswith("(") and specifier.endswith(")"):
+            specifier = specifier[1:-1]
+
+    extras = m.group("extras") or ""
+    return ParsedReq(
+        name=normalize_name(m.group("name")),
+        extras=frozenset(normalize_extra(e) for e in extras.split(",") if e.strip()),
+        specifier=specifier.replace(" ", ""),
+        marker=marker.strip().lstrip(";").strip(),
+        url=url.strip(),
+    )
@@ -0,0 +1,139 @@
+"""Materialized per-package responses. A package's snapshot holds every cached
+version with complete reqs, each already rendered as the range endpoints return it,
+sorted by version and compressed. Cached lookups read one row, slice it, and join
+the rendered versions, instead of loading deps and reqs and serializing each.
+Versions are added to a snapshot as they're pulled, and a pull that finds the
+snapshot missing versions we have cached, eg ones cached before snapshots, rebuilds
+it. Reads never write; `build_snapshots` builds them for packages nobody pulls."""
+
+import zlib
+from bisect import bisect_left, bisect_right
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.db import IntegrityError
+from django.http import HttpResponse
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from . import metrics
+from .models import Dependency, Snapshot
+from .version import Version
+
+# (version_key, version, rendered)
+Entry = Tuple[str, str, bytes]
+Key = Tuple[str, str]
+
+
+def render(deps: Iterable[Dependency]) -> List[Entry]:
+    """Deps with complete reqs, as snapshot entries. Deps' reqs should be
+    prefetched."""
+    # Avoid a circular import; views uses this module to serve snapshots.
+    from .views import DepSerializer
+
+    to_json = JSONRenderer().render
+    return [
+        (dep.version_key, dep.version, to_json(DepSerializer(dep).data)) for dep in deps
+    ]
+
+
+def complete_deps(name: str, versions: Optional[List[str]] = None):
+    """A package's deps that belong in its snapshot, or just these versions of it."""
+    deps = Dependency.objects.filter(name=name, reqs_complete=True)
+    if versions is not None:
+        deps = deps.filter(version__in=versions)
+    return deps.exclude(version_key="").prefetch_related("requirements")
+
+
+def save(name: str, entries: List[Entry]) -> None:
+    entries.sort()
+    # Rendered JSON has no raw tabs or newlines, nor do versions.
+    text = b"\n".join(
+        b"\t".join((key.encode(), version.encode(), rendered))
+        for key, version, rendered in entries
+    )
+    data = zlib.compress(text)
+
+    if Snapshot.objects.filter(name=name).update(
+        data=data, versions=len(entries), updated=timezone.now()
+    ):
+        return
+    try:
+        Snapshot.objects.create(name=name, data=data, versions=len(entries))
+    except IntegrityError:
+        # Another worker created it at the same time; theirs will have caught up
+        # soon enough.
+        pass
+
+
+def rebuild(names: Iterable[str]) -> None:
+    """Build packages' snapshots from scratch."""
+    with metrics.stage("build_snapshots"):
+        for name in dict.fromkeys(names):
+            save(name, render(complete_deps(name)))
+
+
+def refresh(keys: Iterable[Key]) -> None:
+    """Add just-cached (name, version)s to their packages' snapshots. Only the new
+    versions are loaded and rendered; the rest are taken from the current snapshot.
+    If that's still short of the versions we have cached, eg because two workers
+    added to it at once and one's were lost, it's rebuilt from scratch."""
+    packages: Dict[str, List[str]] = {}
+    for name, version in keys:
+        packages.setdefault(name, []).append(version)
+
+    with metrics.stage("build_snapshots"):
+        for name, versions in packages.items():
+            entries = load(name)
+            added = render(complete_deps(name, versions))
+            if entries is not None:
+                replaced = {version for _, version, _ in added}
+                entries = [entry for entry in entries if entry[1] not in replaced]
+                entries.extend(added)
+            if entries is None or len(entries) < complete_deps(name).count():
+                save(name, render(complete_deps(name)))
+            elif added:
+                save(name, entries)
+
+
+def load(name: str) -> Optional[List[Entry]]:
+    """A package's snapshot, in version order, or None if it hasn't got one."""
+    data = Snapshot.objects.filter(name=name).values_list("data", flat=True).first()
+    if data is None:
+        return None
+    text = zlib.decompress(bytes(data))
+    if not text:
+        return []
+
+    entries = []
+    for line in text.split(b"\n"):
+        key, version, rendered = line.split(b"\t", 2)
+        entries.append((key.decode(), version.decode(), rendered))
+    return entries
+
+
+def select(
+    entries: List[Entry],
+    versions: List[str],
+    min_vers: Optional[Version],
+    max_vers: Optional[Version],
+) -> Tuple[List[bytes], List[str]]:
+    """The rendered versions in `versions`, which are between `min_vers` and
+    `max_vers`, in version order, and the ones the snapshot hasn't got."""
+    keys = [key for key, _, _ in entries]
+    start = bisect_left(keys, min_vers.sortable()) if min_vers else 0
+    end = bisect_right(keys, max_vers.sortable()) if max_vers else len(keys)
+
+    wanted = set(versions)
+    result = []
+    found = set()
+    for _, version, rendered in entries[start:end]:
+        if version in wanted:
+            result.append(rendered)
+            found.add(version)
+    return result, [version for version in versions if version not in found]
+
+
+def response(rendered: List[bytes]) -> HttpResponse:
+    return HttpResponse(
+        b"[" + b",".join(rendered) + b"]", content_type="application/json"
+    )
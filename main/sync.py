@@ -0,0 +1,160 @@
+"""Following upstream changes, so cached projects learn about new releases without
+waiting for someone to ask. A feed lists changes after a serial number; we keep
+the last serial we've processed in `SyncState`, and for each changed project we
+cache, refresh its document and pull its new versions. The feed is pluggable: Pypi's
+changelog, or a JSON-lines file or URL standing in for it."""
+
+import abc
+import json
+import threading
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from . import projects, pypi
+from .models import Dependency, SyncState
+from .reqs import normalize_name
+from .views import process_many
+
+
+class Change(NamedTuple):
+    name: str
+    # None for changes to a project as a whole.
+    version: Optional[str]
+    serial: int
+
+
+class Feed(abc.ABC):
+    """A source of upstream changes, ordered by serial."""
+
+    # Identifies this feed's position in `SyncState`.
+    name = ""
+
+    @abc.abstractmethod
+    def last_serial(self) -> int: ...
+
+    @abc.abstractmethod
+    def changes_since(self, serial: int) -> List[Change]: ...
+
+
+class PypiFeed(Feed):
+    """Pypi's changelog, from its XML-RPC API."""
+
+    name = "pypi"
+
+    def last_serial(self) -> int:
+        return pypi.xmlrpc_call("changelog_last_serial")
+
+    def changes_since(self, serial: int) -> List[Change]:
+        # Rows are (name, version, timestamp, action, serial).
+        return [
+            Change(name, version, serial)
+            for name, version, _, _, serial in pypi.xmlrpc_call(
+                "changelog_since_serial", serial
+            )
+        ]
+
+
+class FileFeed(Feed):
+    """Changes as JSON lines, eg `{"serial": 3, "name": "django", "version": "3.2"}`,
+    from a local file, or a URL."""
+
+    def __init__(self, location: str):
+        self.location = location
+        self.name = f"file:{location}"
+
+    def read(self) -> List[Change]:
+        if self.location.startswith(("http://", "https://")):
+            resp = pypi.get(self.location)
+            resp.raise_for_status()
+            text = resp.text
+        else:
+            with open(self.location) as f:
+                text = f.read()
+
+        changes = []
+        for line in text.splitlines():
+            if line.strip():
+                row = json.loads(line)
+                changes.append(Change(row["name"], row.get("version"), row["serial"]))
+        return sorted(changes, key=lambda change: change.serial)
+
+    def last_serial(self) -> int:
+        return max((change.serial for change in self.read()), default=0)
+
+    def changes_since(self, serial: int) -> List[Change]:
+        return [change for change in self.read() if change.serial > serial]
+
+
+def get_feed(location: str) -> Feed:
+    """`pypi`, or the path or URL of a JSON-lines feed."""
+    return PypiFeed() if location == "pypi" else FileFeed(location)
+
+
+def apply(changes: List[Change]) -> int:
+    """Refresh the cached projects these changes touch, and pull their new
+    versions. Projects we don't cache any versions of are skipped. Returns the
+    number of versions pulled."""
+    by_name: Dict[str, Set[str]] = {}
+    for change in changes:
+        versions = by_name.setdefault(normalize_name(change.name), set())
+        if change.version:
+            versions.add(change.version)
+
+    cached: Set[Tuple[str, str]] = set(
+        Dependency.objects.filter(name__in=by_name).values_list("name", "version")
+    )
+    tracked = {name for name, _ in cached}
+
+    new: Dict[str, List[str]] = {}
+    for name in sorted(tracked):
+        data = projects.get_project(name, refresh=True)
+        if data is None:
+            continue
+        versions = [
+            version
+            for version in by_name[name]
+            if version in data["releases"] and (name, version) not in cached
+        ]
+        if versions:
+            new[name] = versions
+
+    if new:
+        process_many(new)
+    return sum(len(versions) for versions in new.values())
+
+
+def sync_once(feed: Feed) -> int:
+    """Process the feed's changes since we last synced, a batch at a time, saving
+    our position after each. The first sync starts from the feed's current position,
+    rather than replaying its history. Returns the number of changes processed."""
+    state = SyncState.objects.filter(feed=feed.name).first()
+    if state is None:
+        state = SyncState.objects.create(feed=feed.name, serial=feed.last_serial())
+        print(f"Starting to follow {feed.name} from serial {state.serial}")
+        return 0
+
+    changes = feed.changes_since(state.serial)
+    for start in range(0, len(changes), settings.SYNC_BATCH_SIZE):
+        batch = changes[start : start + settings.SYNC_BATCH_SIZE]
+        pulled = apply(batch)
+        state.serial = max(change.serial for change in batch)
+        state.save()
+        print(
+            f"Synced to serial {state.serial}: {len(batch)} changes, "
+            f"{pulled} new versions pulled"
+        )
+    return len(changes)
+
+
+def serve(feed: Feed, stop: threading.Event) -> None:
+    """Sync every `SYNC_INTERVAL` seconds until told to stop."""
+    while not stop.is_set():
+        close_old_connections()
+        try:
+            sync_once(feed)
+        except Exception as e:
+            # Eg Pypi's unavailable; we'll pick up from the same serial next time.
+            print(f"Sync with {feed.name} failed: {e!r}")
+        stop.wait(settings.SYNC_INTERVAL)
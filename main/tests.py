@@ -1,3 +1,1408 @@
-from django.test import TestCase
+import io
+import json
+import os
+import random
+import signal
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+from contextlib import redirect_stdout
+from datetime import timedelta
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+import requests
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import (
+    RequestFactory,
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.urls import resolve
+from django.utils import timezone
+
+from . import (
+    caching,
+    closure,
+    distfiles,
+    failures,
+    jobs,
+    locks,
+    metadata,
+    prewarm,
+    projects,
+    pypi,
+    reqs,
+    snapshots,
+    sync,
+    views,
+)
+from .fakepypi import FakePypi, make_sdist, make_wheel
+from .models import (
+    Dependency,
+    DistFile,
+    FailedFetch,
+    Job,
+    Requirement,
+    Snapshot,
+    SyncState,
+)
+from .version import Version, version_key
+from .views import process_many
+
+
+class FakePypiTestCase(SimpleTestCase):
+    """Runs a small fake Pypi for the class, and points `PYPI_URL` at it. Each test
+    gets a fresh session, since the session reads its settings when created, and
+    empty caches."""
+
+    pypi_options = {"projects": 2, "versions": 2, "wheel_size": 0}
+
+    @classmethod
+    def setUpClass(cls):
+        # Before the base class, which may set up test data using the fake.
+        cls.fake = FakePypi(**cls.pypi_options)
+        cls.fake.start()
+        cls.settings_override = override_settings(
+            PYPI_URL=cls.fake.url, PYPI_BACKOFF=0, PYPI_TIMEOUT=(1, 1)
+        )
+        cls.settings_override.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.settings_override.disable()
+        cls.fake.stop()
+        super().tearDownClass()
+
+    def setUp(self):
+        # Classes share project names, so nothing cached about them carries over.
+        cache.clear()
+        projects._lru.clear()
+        pypi._session = None
+        self.fake.failures = {}
+        self.fake.latency = 0.0
+        self.fake.ranges = True
+        self.fake.requests = 0
+        self.fake.connections = 0
+
+    def tearDown(self):
+        if pypi._session is not None:
+            pypi._session.close()
+        pypi._session = None
+
+
+class PypiClientTests(FakePypiTestCase):
+    def test_session_reused(self):
+        self.assertIs(pypi.session(), pypi.session())
+        name = self.fake.names[0]
+        for version in self.fake.versions:
+            self.assertIsNotNone(pypi.get_release(name, version))
+        self.assertIsNotNone(pypi.get_project(name))
+        # Every request went over the same kept-alive connection.
+        self.assertEqual(self.fake.requests, 3)
+        self.assertEqual(self.fake.connections, 1)
+
+    def test_user_agent(self):
+        self.assertEqual(pypi.session().headers["User-Agent"], pypi.USER_AGENT)
+
+    def test_not_found(self):
+        self.assertIsNone(pypi.get_project("missing"))
+        self.assertIsNone(pypi.get_release(self.fake.names[0], "9.9"))
+
+    def test_not_modified(self):
+        name = self.fake.names[0]
+        first = pypi.get_project(name)
+        again = pypi.get_project(name, etag=first.etag)
+        self.assertIsNone(again.text)
+        self.assertEqual(again.etag, first.etag)
+
+    def test_retries_rate_limits_and_server_errors(self):
+        name = self.fake.names[0]
+        self.fake.failures[f"/pypi/{name}/json"] = [429, 503]
+        resp = pypi.get_project(name)
+        self.assertIn(f'"{name}"', resp.text)
+        self.assertEqual(self.fake.requests, 3)
+
+    @override_settings(PYPI_RETRIES=1)
+    def test_retries_exhausted(self):
+        name = self.fake.names[0]
+        self.fake.failures[f"/pypi/{name}/json"] = [500, 502, 504]
+        with self.assertRaises(requests.exceptions.RetryError):
+            pypi.get_project(name)
+        self.assertEqual(self.fake.requests, 2)
+
+    def test_client_errors_not_retried(self):
+        name = self.fake.names[0]
+        self.fake.failures[f"/pypi/{name}/json"] = [403]
+        with self.assertRaises(requests.HTTPError):
+            pypi.get_project(name)
+        self.assertEqual(self.fake.requests, 1)
+
+    @override_settings(PYPI_TIMEOUT=(1, 0.1), PYPI_RETRIES=0)
+    def test_timeout(self):
+        self.fake.latency = 0.3
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            pypi.get_project(self.fake.names[0])
+
+    @override_settings(PYPI_TIMEOUT=(1, 0.1), PYPI_RETRIES=2)
+    def test_timeout_retried(self):
+        self.fake.latency = 0.3
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            pypi.get_project(self.fake.names[0])
+        self.assertEqual(self.fake.requests, 3)
+
+    def test_timeout_override(self):
+        self.fake.latency = 0.3
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            pypi.get(f"{self.fake.url}/pypi/{self.fake.names[0]}/json", timeout=0.1)
+
+
+class WheelMetadataTests(FakePypiTestCase):
+    # Wheels several range chunks long, so reading all of one is noticeable.
+    pypi_options = {"projects": 2, "versions": 1, "wheel_size": 256 * 1024}
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.download_dir = tempfile.TemporaryDirectory()
+        cls.download_override = override_settings(DOWNLOAD_DIR=cls.download_dir.name)
+        cls.download_override.enable()
+
+        name = cls.fake.names[0]
+        release = cls.fake.projects[name]["releases"][cls.fake.versions[0]][0]
+        cls.url, cls.size = release["url"], release["size"]
+        cls.reqs = [f"{cls.fake.names[1]}>=1.0"]
+
+        data = cls.fake.files[release["filename"]]
+        cls.fake.files["truncated.whl"] = data[: len(data) // 2]
+        cls.truncated_url = f"{cls.fake.url}/files/truncated.whl"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.download_override.disable()
+        cls.download_dir.cleanup()
+        super().tearDownClass()
+
+    def setUp(self):
+        super().setUp()
+        self.fake.bytes_sent = 0
+
+    def test_range_read(self):
+        self.assertEqual(metadata.wheel_requires_dist(self.url, self.size), self.reqs)
+        # The central directory and METADATA are at the end of the wheel.
+        self.assertLessEqual(self.fake.bytes_sent, metadata.RANGE_CHUNK)
+        self.assertEqual(self.fake.requests, 1)
+
+    def test_range_file_size_from_head(self):
+        file = metadata.HttpRangeFile(self.url)
+        self.assertEqual(file.size, self.size)
+        self.assertEqual(metadata.read_wheel(file, self.url), self.reqs)
+        self.assertEqual(self.fake.requests, 2)
+
+    def test_range_file_reads(self):
+        file = metadata.HttpRangeFile(self.url, self.size)
+        data = self.fake.files[self.url.rsplit("/", 1)[-1]]
+        self.assertEqual(file.read(4), data[:4])
+        self.assertEqual(file.tell(), 4)
+        file.seek(-10, 2)
+        self.assertEqual(file.read(), data[-10:])
+        self.assertEqual(file.read(), b"")
+
+    def test_no_range_support(self):
+        self.fake.ranges = False
+        with self.assertRaises(metadata.RangesUnsupported):
+            metadata.HttpRangeFile(self.url)
+
+        out = io.StringIO()
+        with redirect_stdout(out):
+            reqs = metadata.wheel_requires_dist(self.url, self.size)
+        self.assertEqual(reqs, self.reqs)
+        self.assertIn("No range support", out.getvalue())
+        # One abandoned range request, then the download.
+        self.assertEqual(self.fake.requests, 3)
+        self.assertGreaterEqual(self.fake.bytes_sent, self.size)
+
+    def test_head_refused(self):
+        for status in (405, 403):
+            with self.subTest(status=status):
+                self.fake.failures[self.url[len(self.fake.url) :]] = [status]
+                with self.assertRaises(metadata.RangesUnsupported):
+                    metadata.HttpRangeFile(self.url)
+
+        self.fake.failures[self.url[len(self.fake.url) :]] = [405]
+        with redirect_stdout(io.StringIO()):
+            self.assertEqual(metadata.wheel_requires_dist(self.url), self.reqs)
+
+    def test_head_without_length(self):
+        resp = requests.Response()
+        resp.status_code = 200
+        resp.headers["Accept-Ranges"] = "bytes"
+        with mock.patch.object(metadata.pypi, "head", return_value=resp):
+            with self.assertRaises(metadata.RangesUnsupported):
+                metadata.HttpRangeFile(self.url)
+            with redirect_stdout(io.StringIO()):
+                self.assertEqual(metadata.wheel_requires_dist(self.url), self.reqs)
+
+    def test_truncated_wheel(self):
+        with self.assertRaises(zipfile.BadZipFile):
+            metadata.wheel_requires_dist(self.truncated_url)
+
+    def test_truncated_wheel_downloaded(self):
+        self.fake.ranges = False
+        with redirect_stdout(io.StringIO()), self.assertRaises(zipfile.BadZipFile):
+            metadata.wheel_requires_dist(self.truncated_url)
+
+
+class SdistMetadataTests(SimpleTestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+
+    def sdist(self, members, zipped=False):
+        """An sdist of `members`, paths relative to its root, with their text."""
+        path = Path(self.dir.name) / ("pkg-1.0.zip" if zipped else "pkg-1.0.tar.gz")
+        if zipped:
+            with zipfile.ZipFile(path, "w") as archive:
+                for name, text in members.items():
+                    archive.writestr(f"pkg-1.0/{name}", text)
+            return path
+        with tarfile.open(path, "w:gz") as archive:
+            for name, text in members.items():
+                data = text.encode()
+                info = tarfile.TarInfo(f"pkg-1.0/{name}")
+                info.size = len(data)
+                archive.addfile(info, io.BytesIO(data))
+        return path
+
+    def pkg_info(self, version, *lines):
+        return "\n".join(
+            [f"Metadata-Version: {version}", "Name: pkg", "Version: 1.0", *lines, ""]
+        )
+
+    def test_pkg_info(self):
+        path = self.sdist(
+            {"PKG-INFO": self.pkg_info("2.2", "Requires-Dist: requests>=2")}
+        )
+        self.assertEqual(metadata.read_sdist(path), ["requests>=2"])
+
+    def test_pkg_info_without_requirements(self):
+        # From 2.2, a missing Requires-Dist means there aren't any...
+        path = self.sdist({"PKG-INFO": self.pkg_info("2.2")})
+        self.assertEqual(metadata.read_sdist(path), [])
+        # ...unless they're dynamic.
+        path = self.sdist({"PKG-INFO": self.pkg_info("2.2", "Dynamic: Requires-Dist")})
+        self.assertIsNone(metadata.read_sdist(path))
+
+    def test_old_pkg_info_without_requirements(self):
+        # Before 2.2, setup.py may compute them, so they're unknown.
+        for version in ("1.0", "2.1", "", "2.x", "two"):
+            with self.subTest(version=version):
+                path = self.sdist({"PKG-INFO": self.pkg_info(version)})
+                self.assertIsNone(metadata.read_sdist(path))
+
+    def test_old_pkg_info_with_requirements(self):
+        for version in ("2.1", "2.x"):
+            with self.subTest(version=version):
+                info = self.pkg_info(version, "Requires-Dist: six")
+                self.assertEqual(
+                    metadata.read_sdist(self.sdist({"PKG-INFO": info})), ["six"]
+                )
+
+    def test_falls_back_in_order(self):
+        members = {
+            "PKG-INFO": self.pkg_info("2.1"),
+            "pkg.egg-info/requires.txt": "six\n",
+            "pyproject.toml": '[project]\ndependencies = ["attrs"]\n',
+            "setup.cfg": "[options]\ninstall_requires = idna\n",
+        }
+        self.assertEqual(metadata.read_sdist(self.sdist(members)), ["six"])
+        del members["pkg.egg-info/requires.txt"]
+        self.assertEqual(metadata.read_sdist(self.sdist(members)), ["attrs"])
+        members["pyproject.toml"] = '[project]\ndynamic = ["dependencies"]\n'
+        self.assertEqual(metadata.read_sdist(self.sdist(members)), ["idna"])
+        del members["setup.cfg"]
+        self.assertIsNone(metadata.read_sdist(self.sdist(members)))
+
+    def test_zip_and_src_layout(self):
+        members = {"src/pkg.egg-info/requires.txt": "six\n"}
+        self.assertEqual(metadata.read_sdist(self.sdist(members, zipped=True)), ["six"])
+        # Only the sdist's own egg-info counts, not a vendored one.
+        members = {"vendor/other/other.egg-info/requires.txt": "six\n"}
+        self.assertIsNone(metadata.read_sdist(self.sdist(members)))
+
+    def test_parse_requires_txt(self):
+        text = """
+            requests>=2
+            # a comment
+
+            [socks]
+            PySocks!=1.5.7
+
+            [:python_version < "3.8"]
+            importlib-metadata
+
+            [tests:sys_platform == "win32"]
+            pywin32; implementation_name == "cpython"
+        """
+        self.assertEqual(
+            metadata.parse_requires_txt(text),
+            [
+                "requests>=2",
+                'PySocks!=1.5.7; extra == "socks"',
+                'importlib-metadata; python_version < "3.8"',
+                'pywin32; (implementation_name == "cpython") and '
+                '((sys_platform == "win32") and extra == "tests")',
+            ],
+        )
+
+    def test_parse_pyproject(self):
+        text = """
+            [project]
+            name = "pkg"
+            dependencies = ["requests>=2"]
+            [project.optional-dependencies]
+            socks = ["PySocks; python_version >= '3'"]
+        """
+        self.assertEqual(
+            metadata.parse_pyproject(text),
+            [
+                "requests>=2",
+                "PySocks; (python_version >= '3') and (extra == \"socks\")",
+            ],
+        )
+        for text in (
+            '[project]\ndynamic = ["optional-dependencies"]\n',
+            "[tool.poetry]\nname = 'pkg'\n",
+            "not toml [",
+        ):
+            with self.subTest(text=text):
+                self.assertIsNone(metadata.parse_pyproject(text))
+        self.assertEqual(metadata.parse_pyproject("[project]\nname = 'pkg'\n"), [])
+
+    def test_parse_setup_cfg(self):
+        text = """
+[options]
+install_requires =
+    requests>=2
+    six
+[options.extras_require]
+socks = PySocks
+"""
+        self.assertEqual(
+            metadata.parse_setup_cfg(text),
+            ["requests>=2", "six", 'PySocks; extra == "socks"'],
+        )
+        for text in (
+            "[options]\ninstall_requires = file: requirements.txt\n",
+            "[options]\ninstall_requires = six\n"
+            "[options.extras_require]\nall = attr: pkg.EXTRAS\n",
+            "[metadata]\nname = pkg\n",
+            "not ini",
+        ):
+            with self.subTest(text=text):
+                self.assertIsNone(metadata.parse_setup_cfg(text))
+
+
+class SyncTests(FakePypiTestCase, TransactionTestCase):
+    # Pulls run on worker threads, so they need to see committed rows.
+    pypi_options = {"projects": 2, "versions": 3, "wheel_size": 0}
+
+    def setUp(self):
+        super().setUp()
+        fd, self.path = tempfile.mkstemp(suffix=".jsonl")
+        os.close(fd)
+        self.feed = sync.FileFeed(self.path)
+        self.name = self.fake.names[0]
+
+    def tearDown(self):
+        os.remove(self.path)
+        super().tearDown()
+
+    def publish(self, serial, name, version=None):
+        with open(self.path, "a") as f:
+            f.write(json.dumps({"serial": serial, "name": name, "version": version}))
+            f.write("\n")
+
+    def test_feed_is_abstract(self):
+        with self.assertRaises(TypeError):
+            sync.Feed()
+
+    def test_new_releases_ingested(self):
+        old, new, other = self.fake.versions
+        Dependency.objects.create(name=self.name, version=old)
+        self.publish(1, self.name, old)
+
+        # The first sync only records where the feed's up to.
+        with redirect_stdout(io.StringIO()):
+            self.assertEqual(sync.sync_once(self.feed), 0)
+        self.assertEqual(SyncState.objects.get(feed=self.feed.name).serial, 1)
+
+        self.publish(2, self.name, new)
+        # Projects we don't cache are skipped.
+        self.publish(3, self.fake.names[1], new)
+        with redirect_stdout(io.StringIO()):
+            self.assertEqual(sync.sync_once(self.feed), 2)
+
+        self.assertEqual(SyncState.objects.get(feed=self.feed.name).serial, 3)
+        dep = Dependency.objects.get(name=self.name, version=new)
+        self.assertEqual(dep.requires_dist(), [f"{self.fake.names[1]}>=1.0"])
+        self.assertFalse(
+            Dependency.objects.filter(name=self.name, version=other).exists()
+        )
+        self.assertFalse(Dependency.objects.filter(name=self.fake.names[1]).exists())
+
+        # Nothing new; the checkpoint stays put.
+        with redirect_stdout(io.StringIO()):
+            self.assertEqual(sync.sync_once(self.feed), 0)
+        self.assertEqual(SyncState.objects.get(feed=self.feed.name).serial, 3)
+
+
+@override_settings(DEPENDENTS_MAX_PAGE_SIZE=3, DEPENDENTS_MAX_SCAN=6)
+class DependentsTests(FakePypiTestCase, TestCase):
+    pypi_options = {"projects": 1, "versions": 3, "wheel_size": 0}
+
+    @classmethod
+    def setUpTestData(cls):
+        # Every other dependent requires a release that doesn't exist.
+        cls.target = cls.fake.names[0]
+        cls.ids = []
+        for i in range(10):
+            dep = Dependency.objects.create(name=f"dependent-{i}", version="1.0")
+            spec = ">=1.1" if i % 2 == 0 else ">=5"
+            req = Requirement.objects.create(data=f"{cls.target}{spec}", dependency=dep)
+            cls.ids.append(req.id)
+
+    def get(self, **params):
+        resp = self.client.get(f"/api/dependents/{self.target}/", params)
+        self.assertEqual(resp.status_code, 200)
+        data = resp.json()
+        return [r["name"] for r in data["results"]], data["next"]
+
+    def test_unfiltered(self):
+        names, after = self.get(limit=3)
+        self.assertEqual(names, ["dependent-0", "dependent-1", "dependent-2"])
+        self.assertEqual(after, self.ids[2])
+        pages = [names]
+        while after is not None:
+            names, after = self.get(after=after)
+            pages.append(names)
+        self.assertEqual([len(page) for page in pages], [3, 3, 3, 1])
+
+    def test_projects_not_shadowed(self):
+        for name in ("closure", "dependents", "jobs"):
+            with self.subTest(name=name):
+                self.assertEqual(resolve(f"/{name}/").func, views.get_all)
+                self.assertEqual(resolve(f"/{name}/1.0/").func, views.get_one)
+
+    def test_filtered_page_full(self):
+        names, after = self.get(min="1.0", max="1.2", limit=2)
+        self.assertEqual(names, ["dependent-0", "dependent-2"])
+        # The last row scanned, not the end of the batch.
+        self.assertEqual(after, self.ids[2])
+
+    def test_filtered_pages(self):
+        names, after = self.get(min="1.0", max="1.2")
+        while after is not None:
+            more, after = self.get(min="1.0", max="1.2", after=after)
+            names += more
+        self.assertEqual(names, [f"dependent-{i}" for i in range(0, 10, 2)])
+
+    def test_filtered_scan_budget(self):
+        names, after = self.get(min="5.0")
+        self.assertEqual(names, [])
+        # Two batches in, we're out of budget.
+        self.assertEqual(after, self.ids[5])
+        names, after = self.get(min="5.0", after=after)
+        self.assertEqual(names, [])
+        self.assertIsNone(after)
+
+
+class ClosureTests(FakePypiTestCase, TransactionTestCase):
+    # Each project requires the next, and the last the first.
+    pypi_options = {"projects": 3, "versions": 2, "wheel_size": 0}
+
+    def resolve(self, *requirements):
+        with redirect_stdout(io.StringIO()):
+            deps = closure.Walk().resolve(list(requirements))
+        return [(dep.name, dep.version) for dep in deps]
+
+    def test_closure(self):
+        everything = [(name, v) for name in self.fake.names for v in self.fake.versions]
+        root = (self.fake.names[0], self.fake.versions[0])
+        self.assertEqual(self.resolve(f"{root[0]}=={root[1]}"), everything)
+
+        # Every node's successors were memoized.
+        node = ((self.fake.names[2], self.fake.versions[1]), frozenset())
+        self.assertEqual(
+            cache.get(closure.node_key(node)),
+            [(self.fake.names[0], v, []) for v in self.fake.versions],
+        )
+
+    def test_closure_from_memoized_nodes(self):
+        first, second = self.fake.names[:2]
+        self.resolve(f"{first}=={self.fake.versions[0]}")
+        requests = self.fake.requests
+
+        # Another root's closure is built from the memoized nodes, without pulling
+        # anything.
+        self.assertEqual(len(self.resolve(f"{second}=={self.fake.versions[0]}")), 6)
+        self.assertEqual(self.fake.requests, requests)
+
+        node = ((second, self.fake.versions[1]), frozenset())
+        cache.set(closure.node_key(node), [])
+        self.assertEqual(
+            self.resolve(f"{second}=={self.fake.versions[1]}"),
+            [(second, self.fake.versions[1])],
+        )
+
+
+class SingleFlightTests(FakePypiTestCase, TransactionTestCase):
+    def test_lock_id_normalized(self):
+        self.assertEqual(locks.lock_id(("a", "1.0")), locks.lock_id(("a", "1.0.0")))
+        self.assertNotEqual(locks.lock_id(("a", "1.0")), locks.lock_id(("a", "1.1")))
+        self.assertNotEqual(locks.lock_id(("a", "1.0")), locks.lock_id(("b", "1.0")))
+        # Unparseable versions hash as they are.
+        self.assertEqual(locks.lock_id(("a", "foo")), locks.lock_id(("a", "foo")))
+
+    def test_pull_after_other_worker_gives_up(self):
+        key = (self.fake.names[0], self.fake.versions[0])
+        acquired, done = threading.Event(), threading.Event()
+
+        def other_worker():
+            # Holds the key's lock for a moment, then gives up without pulling it.
+            ours, _ = locks.try_acquire([key])
+            acquired.set()
+            done.wait(0.2)
+            locks.release(ours)
+
+        thread = threading.Thread(target=other_worker)
+        thread.start()
+        acquired.wait()
+        with redirect_stdout(io.StringIO()):
+            deps = process_many({key[0]: [key[1]]})
+        done.set()
+        thread.join()
+
+        self.assertEqual([(dep.name, dep.version) for dep in deps], [key])
+
+
+class IngestFileTests(TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        rand = random.Random(0)
+        for filename, make in (
+            ("local_wheel-1.0-py3-none-any.whl", make_wheel),
+            ("local-sdist-2.0.tar.gz", make_sdist),
+        ):
+            name, version = prewarm.split_filename(filename)
+            data = make(name, version, ["requests>=2"], 0, rand)
+            (Path(self.dir.name) / filename).write_bytes(data)
+
+    def test_ingest(self):
+        files = prewarm.dist_files(Path(self.dir.name))
+        self.assertEqual(set(files), {("local-wheel", "1.0"), ("local-sdist", "2.0")})
+        for key, path in files.items():
+            prewarm.ingest_file(key, path)
+
+        for name, version in files:
+            dep = Dependency.objects.get(name=name, version=version)
+            self.assertEqual(dep.requires_dist(), ["requests>=2"])
+            self.assertEqual(dep.requires_python, ">=3.6")
+            self.assertEqual(dep.version_key, version_key(version))
+            self.assertTrue(dep.reqs_complete)
+
+    def test_ingest_fills_requires_python(self):
+        Dependency.objects.create(name="local-wheel", version="1.0")
+        path = Path(self.dir.name) / "local_wheel-1.0-py3-none-any.whl"
+        prewarm.ingest_file(("local-wheel", "1.0"), path)
+        dep = Dependency.objects.get(name="local-wheel", version="1.0")
+        self.assertEqual(dep.requires_python, ">=3.6")
+        self.assertEqual(dep.requires_dist(), ["requests>=2"])
+
+
+class StoreReleasesTests(FakePypiTestCase, TransactionTestCase):
+    # Pypi lists no requires_dist for any of these, so their wheels are read.
+    pypi_options = {"projects": 2, "versions": 2, "wheel_size": 0, "unlisted": 1.0}
+
+    def pull(self, name, versions):
+        with redirect_stdout(io.StringIO()):
+            return process_many({name: versions})
+
+    def test_inspected_dep_saved_with_reqs(self):
+        name, version = self.fake.names[0], self.fake.versions[0]
+        [dep] = self.pull(name, [version])
+        self.assertEqual(dep.requires_dist(), [f"{self.fake.names[1]}>=1.0"])
+        self.assertEqual(dep.requires_python, ">=3.6")
+        self.assertEqual(dep.version_key, version_key(version))
+        self.assertEqual(dep.files.count(), 1)
+
+    def test_unreadable_dep_not_saved(self):
+        name, version = self.fake.names[1], self.fake.versions[1]
+        [release] = self.fake.projects[name]["releases"][version]
+        filename = release["filename"]
+        data = self.fake.files[filename]
+        self.fake.files[filename] = data[: len(data) // 2]
+        self.addCleanup(self.fake.files.__setitem__, filename, data)
+
+        self.assertEqual(self.pull(name, [version]), [])
+        self.assertFalse(Dependency.objects.filter(name=name).exists())
+        failure = FailedFetch.objects.get(name=name, version=version)
+        self.assertEqual(failure.reason, FailedFetch.BAD_WHEEL)
+
+
+class FailureTests(FakePypiTestCase, TransactionTestCase):
+    # Pypi lists no requires_dist for any of these, so their files are read.
+    pypi_options = {"projects": 2, "versions": 2, "wheel_size": 0, "unlisted": 1.0}
+
+    def setUp(self):
+        super().setUp()
+        self.name, self.version = self.fake.names[0], self.fake.versions[0]
+        [self.release] = self.fake.projects[self.name]["releases"][self.version]
+        self.path = f"/{self.name}/{self.version}/"
+
+    def get(self):
+        with redirect_stdout(io.StringIO()):
+            resp = self.client.get(self.path)
+        self.assertEqual(resp.status_code, 200)
+        return resp
+
+    def test_missing_wheel(self):
+        # The range request, then the download.
+        self.fake.failures[f"/files/{self.release['filename']}"] = [404, 410]
+        resp = self.get()
+        self.assertEqual(resp.json(), [])
+        [failure] = json.loads(resp["X-Failures"])
+        self.assertEqual(
+            (
+                failure["name"],
+                failure["version"],
+                failure["reason"],
+                failure["attempts"],
+            ),
+            (self.name, self.version, FailedFetch.BAD_WHEEL, 1),
+        )
+        self.assertNotIn("detail", failure)
+        self.assertIn("410", FailedFetch.objects.get().detail)
+
+    def test_corrupt_zip_sdist(self):
+        filename = self.release["filename"]
+        data = self.fake.files[filename]
+        self.addCleanup(self.fake.files.__setitem__, filename, data)
+        self.addCleanup(self.release.__setitem__, "packagetype", "bdist_wheel")
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, "w") as archive:
+            archive.writestr(f"{self.name}-{self.version}/PKG-INFO", "Name: x\n")
+        # The central directory's intact, but the member it points to isn't.
+        self.fake.files[filename] = b"\0" * 4 + buf.getvalue()[4:]
+        self.release["packagetype"] = "sdist"
+
+        [failure] = json.loads(self.get()["X-Failures"])
+        self.assertEqual(failure["reason"], FailedFetch.NO_METADATA)
+
+    def test_backoff_expiry(self):
+        self.fake.failures[f"/files/{self.release['filename']}"] = [404, 404]
+        first = self.get()
+        self.assertIn("X-Failures", first)
+
+        # Backing off: reported again without another attempt.
+        requests_before = self.fake.requests
+        again = self.get()
+        self.assertEqual(again["X-Failures"], first["X-Failures"])
+        self.assertEqual(self.fake.requests, requests_before)
+
+        # Once it expires, it's retried, and this time the file's there.
+        FailedFetch.objects.update(retry_after=timezone.now())
+        cache.clear()
+        retried = self.get()
+        self.assertEqual([dep["version"] for dep in retried.json()], [self.version])
+        self.assertNotIn("X-Failures", retried)
+        self.assertFalse(FailedFetch.objects.exists())
+
+    def test_backoff_grows(self):
+        key = (self.name, self.version)
+        failures.record(key, FailedFetch.BAD_WHEEL)
+        failures.record(key, FailedFetch.BAD_WHEEL)
+        failure = FailedFetch.objects.get()
+        self.assertEqual(failure.attempts, 2)
+        self.assertAlmostEqual(
+            (failure.retry_after - timezone.now()).total_seconds(),
+            2 * settings.FAILURE_BACKOFF,
+            delta=60,
+        )
+        self.assertEqual(
+            failures.backoff(100).total_seconds(), settings.FAILURE_BACKOFF_MAX
+        )
+
+
+class PrewarmTests(FakePypiTestCase, TransactionTestCase):
+    # Pypi lists no requires_dist for any of these, so their files are read.
+    pypi_options = {"projects": 2, "versions": 2, "wheel_size": 0, "unlisted": 1.0}
+
+    def test_failed_versions_not_checkpointed(self):
+        keys = [(name, v) for name in self.fake.names for v in self.fake.versions]
+        bad = keys[1]
+        [release] = self.fake.projects[bad[0]]["releases"][bad[1]]
+        self.fake.failures[f"/files/{release['filename']}"] = [404, 404]
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / "checkpoint"
+            with redirect_stdout(io.StringIO()):
+                progress = prewarm.run(
+                    keys,
+                    prewarm.pull_batch,
+                    prewarm.Checkpoint(path),
+                    workers=2,
+                    batch_size=2,
+                    report=lambda message: None,
+                )
+            self.assertEqual((progress.done, progress.failed), (3, 1))
+            self.assertEqual(
+                prewarm.Checkpoint(path).done, {key for key in keys if key != bad}
+            )
+        self.assertTrue(
+            FailedFetch.objects.filter(name=bad[0], version=bad[1]).exists()
+        )
+
+
+class SnapshotTests(FakePypiTestCase, TransactionTestCase):
+    pypi_options = {"projects": 2, "versions": 3, "wheel_size": 0, "unlisted": 0.0}
+
+    def get(self):
+        with redirect_stdout(io.StringIO()):
+            resp = self.client.get(f"/{self.fake.names[0]}/")
+        self.assertEqual(resp.status_code, 200)
+        return resp
+
+    def test_served_with_failed_versions(self):
+        name = self.fake.names[0]
+        failed = self.fake.versions[1]
+        self.fake.failures[f"/pypi/{name}/{failed}/json"] = [404]
+
+        first = self.get()
+        self.assertEqual(
+            [dep["version"] for dep in first.json()],
+            [v for v in self.fake.versions if v != failed],
+        )
+        self.assertEqual(json.loads(first["X-Failures"])[0]["version"], failed)
+
+        # The snapshot has everything but the failure, which is backing off.
+        with mock.patch.object(views, "load_range", side_effect=AssertionError):
+            again = self.get()
+        self.assertEqual(again.json(), first.json())
+        self.assertEqual(again["X-Failures"], first["X-Failures"])
+
+    def snapshot_versions(self):
+        return [version for _, version, _ in snapshots.load(self.fake.names[0])]
+
+    def test_reads_dont_write(self):
+        name = self.fake.names[0]
+        first = self.get()
+        self.assertEqual(self.snapshot_versions(), self.fake.versions)
+
+        # Eg cached before snapshots: served from the database, and left alone.
+        Snapshot.objects.all().delete()
+        again = self.get()
+        self.assertEqual(again.json(), first.json())
+        self.assertFalse(Snapshot.objects.exists())
+
+        call_command("build_snapshots", name, stdout=io.StringIO())
+        self.assertEqual(self.snapshot_versions(), self.fake.versions)
+
+    def test_refresh_catches_up(self):
+        self.get()
+        name, versions = self.fake.names[0], self.fake.versions
+        # Eg lost to another worker's refresh at the same time.
+        entries = snapshots.load(name)
+        snapshots.save(name, entries[1:])
+        snapshots.refresh([(name, versions[2])])
+        self.assertEqual(self.snapshot_versions(), versions)
+
+    def test_ingest_refreshes(self):
+        self.get()
+        name, version = self.fake.names[0], self.fake.versions[0]
+        Dependency.objects.filter(name=name, version=version).update(
+            requires_python=None, reqs_complete=False
+        )
+        snapshots.rebuild([name])
+        self.assertNotIn(version, self.snapshot_versions())
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / f"{name}-{version}-py3-none-any.whl"
+            path.write_bytes(make_wheel(name, version, [], 0, random.Random(0)))
+            prewarm.ingest_file((name, version), path)
+
+        entries = {version: json.loads(r) for _, version, r in snapshots.load(name)}
+        self.assertEqual(entries[version]["requires_python"], ">=3.6")
+
+
+class DistFilesTests(FakePypiTestCase, TransactionTestCase):
+    def get(self, path):
+        with redirect_stdout(io.StringIO()):
+            resp = self.client.get(path)
+        self.assertEqual(resp.status_code, 200)
+        return resp
+
+    def old_dep(self, version):
+        """A dep cached before we kept files."""
+        return Dependency.objects.create(
+            name=self.fake.names[0], version=version, reqs_complete=True
+        )
+
+    def test_files_response(self):
+        name, version = self.fake.names[0], self.fake.versions[0]
+        info = self.fake.projects[name]["releases"][version][0]
+        resp = self.get(f"/{name}/{version}/?files=true")
+        [dep] = resp.json()
+        [file] = dep["files"]
+        self.assertEqual(file["filename"], info["filename"])
+        self.assertEqual(file["url"], info["url"])
+        self.assertEqual(file["sha256"], info["digests"]["sha256"])
+        self.assertEqual(file["size"], info["size"])
+        self.assertEqual(
+            (file["python_tag"], file["abi_tag"], file["platform_tag"]),
+            ("py3", "none", "any"),
+        )
+        self.assertFalse(file["yanked"])
+        self.assertTrue(
+            Dependency.objects.get(name=name, version=version).files_recorded
+        )
+
+        # Files can be yanked, so they're only cached as long as projects are.
+        self.assertNotIn("immutable", resp["Cache-Control"])
+        self.assertIn(f"max-age={settings.PROJECT_CACHE_TTL}", resp["Cache-Control"])
+        plain = self.get(f"/{name}/{version}/")
+        self.assertIn("immutable", plain["Cache-Control"])
+        self.assertNotEqual(plain["ETag"], resp["ETag"])
+
+    def test_fill(self):
+        version = self.fake.versions[0]
+        dep = self.old_dep(version)
+        distfiles.attach([dep])
+        self.assertEqual(
+            [f.filename for f in dep.files.all()],
+            [self.fake.projects[dep.name]["releases"][version][0]["filename"]],
+        )
+        self.assertTrue(Dependency.objects.get(pk=dep.pk).files_recorded)
+
+    def test_fill_once_without_files(self):
+        name, version = self.fake.names[0], self.fake.versions[1]
+        releases = self.fake.projects[name]["releases"]
+        self.addCleanup(releases.__setitem__, version, releases[version])
+        releases[version] = []
+        self.old_dep(version)
+        with mock.patch.object(
+            distfiles.projects, "get_project", wraps=projects.get_project
+        ) as get_project:
+            for _ in range(2):
+                dep = Dependency.objects.get(name=name, version=version)
+                distfiles.attach([dep])
+                self.assertEqual(list(dep.files.all()), [])
+        self.assertEqual(get_project.call_count, 1)
+        self.assertFalse(DistFile.objects.exists())
+
+
+class JobTests(FakePypiTestCase, TransactionTestCase):
+    def get(self, path, status=200):
+        with redirect_stdout(io.StringIO()):
+            resp = self.client.get(path)
+        self.assertEqual(resp.status_code, status)
+        return resp.json()
+
+    def status(self, job_id):
+        return self.get(f"/api/jobs/{job_id}/")["status"]
+
+    def test_background_then_run(self):
+        name, versions = self.fake.names[0], self.fake.versions
+        data = self.get(f"/{name}/?background=true")
+        self.assertEqual(data["results"], [])
+        self.assertEqual(
+            [(job["version"], job["status"]) for job in data["jobs"]],
+            [(v, Job.PENDING) for v in versions],
+        )
+        self.assertFalse(Dependency.objects.exists())
+        # Asking again collapses into the same jobs.
+        again = self.get(f"/{name}/?background=true")
+        self.assertEqual(
+            [job["id"] for job in again["jobs"]], [job["id"] for job in data["jobs"]]
+        )
+
+        claimed = [jobs.claim() for _ in versions]
+        # Each claim takes a different job, oldest first; then there's nothing left.
+        self.assertEqual([job.version for job in claimed], versions)
+        self.assertIsNone(jobs.claim())
+        self.assertEqual(self.status(claimed[0].id), Job.RUNNING)
+
+        with redirect_stdout(io.StringIO()):
+            for job in claimed:
+                jobs.run(job)
+        ids = ",".join(str(job["id"]) for job in data["jobs"])
+        self.assertEqual(
+            [job["status"] for job in self.get(f"/api/jobs/?ids={ids}")],
+            [Job.DONE] * len(versions),
+        )
+        done = self.get(f"/{name}/?background=true")
+        self.assertEqual([dep["version"] for dep in done["results"]], versions)
+        self.assertEqual(done["jobs"], [])
+
+    def test_stalled_job_reclaimed(self):
+        [job] = jobs.enqueue([(self.fake.names[0], self.fake.versions[0])]).values()
+        self.assertEqual(jobs.claim().id, job.id)
+        self.assertIsNone(jobs.claim())
+        # Its worker died long ago.
+        stalled = timezone.now() - timedelta(seconds=settings.JOB_TIMEOUT + 1)
+        Job.objects.filter(id=job.id).update(updated=stalled)
+        self.assertEqual(jobs.claim().id, job.id)
+
+    def test_failed_job(self):
+        [job] = jobs.enqueue([(self.fake.names[0], self.fake.versions[0])]).values()
+        job = jobs.claim()
+        with mock.patch.object(views, "process_many", side_effect=RuntimeError("boom")):
+            with redirect_stdout(io.StringIO()):
+                jobs.run(job)
+        data = self.get(f"/api/jobs/{job.id}/")
+        self.assertEqual(data["status"], Job.FAILED)
+        self.assertIn("boom", data["error"])
+
+        # Finished jobs are queued again when the work's asked for again.
+        jobs.enqueue([(job.name, job.version)])
+        self.assertEqual(self.status(job.id), Job.PENDING)
+
+    def test_job_status_errors(self):
+        self.get("/api/jobs/12345/", status=404)
+        self.get("/api/jobs/?ids=1,x", status=400)
+        self.assertEqual(self.get("/api/jobs/?ids="), [])
+
+    @override_settings(JOB_POLL_INTERVAL=0.01)
+    def test_ingest_worker(self):
+        keys = [(self.fake.names[0], v) for v in self.fake.versions]
+        queued = jobs.enqueue(keys)
+        self.addCleanup(signal.signal, signal.SIGTERM, signal.getsignal(signal.SIGTERM))
+        deadline = time.monotonic() + 10
+
+        def sleep(seconds):
+            # The worker runs until interrupted; interrupt it once the jobs are done.
+            if (
+                time.monotonic() > deadline
+                or not Job.objects.exclude(status=Job.DONE).exists()
+            ):
+                raise KeyboardInterrupt
+            time.sleep(0.01)
+
+        with mock.patch.object(jobs, "time", mock.Mock(sleep=sleep)):
+            with redirect_stdout(io.StringIO()):
+                # One thread: SQLite can't upgrade concurrent claims' read locks.
+                call_command("ingest_worker", threads=1, stdout=io.StringIO())
+
+        self.assertEqual(
+            {Job.objects.get(id=job.id).status for job in queued.values()}, {Job.DONE}
+        )
+        self.assertEqual(
+            Dependency.objects.filter(reqs_complete=True).count(), len(keys)
+        )
+
+
+class CachingTests(FakePypiTestCase, TransactionTestCase):
+    def get(self, path, **headers):
+        with redirect_stdout(io.StringIO()):
+            return self.client.get(path, **headers)
+
+    def test_complete_response_cached(self):
+        path = f"/{self.fake.names[0]}/{self.fake.versions[0]}/"
+        first = self.get(path)
+        self.assertEqual(first.status_code, 200)
+        self.assertRegex(first["ETag"], r'^"[0-9a-f]{64}"$')
+        self.assertIn("immutable", first["Cache-Control"])
+        self.assertIn(f"max-age={settings.CACHE_MAX_AGE}", first["Cache-Control"])
+
+        with mock.patch.object(views, "get_helper", side_effect=AssertionError):
+            again = self.get(path)
+        self.assertEqual(again.content, first.content)
+        self.assertEqual(again["ETag"], first["ETag"])
+        self.assertEqual(again["Cache-Control"], first["Cache-Control"])
+
+    def test_not_modified(self):
+        path = f"/{self.fake.names[0]}/{self.fake.versions[0]}/"
+        tag = self.get(path)["ETag"]
+        # Both straight from the view, and from the response cache.
+        for _ in range(2):
+            for header in (tag, f'"other", {tag}', "*"):
+                resp = self.get(path, HTTP_IF_NONE_MATCH=header)
+                self.assertEqual(resp.status_code, 304, header)
+                self.assertEqual(resp.content, b"")
+                self.assertEqual(resp["ETag"], tag)
+                self.assertIn("immutable", resp["Cache-Control"])
+            cache.clear()
+        self.assertEqual(self.get(path, HTTP_IF_NONE_MATCH='"other"').status_code, 200)
+
+    def test_incomplete_response_not_cached(self):
+        name, version = self.fake.names[0], self.fake.versions[0]
+        self.fake.failures[f"/pypi/{name}/{version}/json"] = [404]
+        path = f"/{name}/{version}/"
+        with mock.patch.object(views, "get_helper", wraps=views.get_helper) as view:
+            first = self.get(path)
+            again = self.get(path)
+        self.assertEqual(view.call_count, 2)
+        self.assertEqual(first.json(), [])
+        self.assertIn("X-Failures", first)
+        self.assertNotIn("immutable", first["Cache-Control"])
+        self.assertIn(
+            f"max-age={settings.CACHE_MAX_AGE_INCOMPLETE}", first["Cache-Control"]
+        )
+        # Still revalidates, but only until it changes.
+        self.assertEqual(
+            self.get(path, HTTP_IF_NONE_MATCH=again["ETag"]).status_code, 304
+        )
+
+    def test_variants_cached_separately(self):
+        path = f"/{self.fake.names[0]}/{self.fake.versions[0]}/"
+        plain = self.get(path)
+        files = self.get(path + "?files=true")
+        self.assertIn("files", files.json()[0])
+        self.assertNotEqual(files["ETag"], plain["ETag"])
+        # Snapshot responses are always JSON, but these aren't.
+        browsable = self.get(path + "?files=true", HTTP_ACCEPT="text/html")
+        self.assertTrue(browsable["Content-Type"].startswith("text/html"))
+        self.assertEqual(self.get(path + "?files=true").content, files.content)
+        self.assertEqual(self.get(path).content, plain.content)
+
+    def test_cache_key(self):
+        factory = RequestFactory()
+        key = caching.cache_key
+        base = key(factory.get("/a/1.0/"))
+        self.assertEqual(key(factory.get("/a/1.0/")), base)
+        for request in (
+            factory.get("/a/1.1/"),
+            factory.get("/a/1.0/?files=true"),
+            factory.get("/a/1.0/", HTTP_ACCEPT="application/x-ndjson"),
+            factory.head("/a/1.0/"),
+        ):
+            self.assertNotEqual(key(request), base, request)
+
+        def multiple(body):
+            return key(factory.post("/multiple/", body, "application/json"))
+
+        self.assertNotEqual(
+            multiple({"packages": {"a": ["1.0"]}}),
+            multiple({"packages": {"a": ["1.1"]}}),
+        )
+
+
+class MetricsTests(FakePypiTestCase, TransactionTestCase):
+    # Pypi lists no requires_dist for any of these, so their wheels are read.
+    pypi_options = {"projects": 2, "versions": 2, "wheel_size": 0, "unlisted": 1.0}
+
+    def sample(self, sample):
+        """A sample's value in the current exposition, or 0 if it has none yet.
+        Metrics are process-wide, so tests compare before and after."""
+        resp = self.client.get("/metrics")
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(
+            resp["Content-Type"], "text/plain; version=0.0.4; charset=utf-8"
+        )
+        for line in resp.content.decode().splitlines():
+            if line.startswith(sample + " "):
+                return float(line.rsplit(" ", 1)[1])
+        return 0.0
+
+    def test_exposition(self):
+        text = self.client.get("/metrics").content.decode()
+        for name, kind in (
+            ("pydeps_stage_seconds", "histogram"),
+            ("pydeps_request_seconds", "histogram"),
+            ("pydeps_request_queries", "histogram"),
+            ("pydeps_cache_total", "counter"),
+            ("pydeps_downloaded_bytes_total", "counter"),
+        ):
+            self.assertIn(f"# TYPE {name} {kind}\n", text)
+
+    def test_requests_counted(self):
+        path = f"/{self.fake.names[0]}/{self.fake.versions[0]}/"
+        labels = 'route="<str:name>/<str:version>/",method="GET"'
+        samples = (
+            f'pydeps_request_seconds_count{{{labels},status="200"}}',
+            f"pydeps_request_queries_count{{{labels}}}",
+            f"pydeps_request_queries_sum{{{labels}}}",
+            'pydeps_cache_total{cache="response",result="miss"}',
+            'pydeps_cache_total{cache="response",result="hit"}',
+            'pydeps_downloaded_bytes_total{kind="range"}',
+        )
+        before = [self.sample(sample) for sample in samples]
+        with redirect_stdout(io.StringIO()):
+            self.assertEqual(self.client.get(path).status_code, 200)
+            self.assertEqual(self.client.get(path).status_code, 200)
+        after = [self.sample(sample) for sample in samples]
+        requests, queries, query_sum, misses, hits, downloaded = (
+            b - a for a, b in zip(before, after)
+        )
+        self.assertEqual((requests, queries, misses, hits), (2, 2, 1, 1))
+        self.assertGreater(query_sum, 0)
+        self.assertGreater(downloaded, 0)
+
+    def test_streaming_recorded_on_close(self):
+        labels = 'route="multiple/",method="POST"'
+        count = f'pydeps_request_seconds_count{{{labels},status="200"}}'
+        query_sum = f"pydeps_request_queries_sum{{{labels}}}"
+        before = (self.sample(count), self.sample(query_sum))
+
+        body = {"packages": {name: self.fake.versions for name in self.fake.names}}
+        with redirect_stdout(io.StringIO()):
+            resp = self.client.post(
+                "/multiple/",
+                body,
+                content_type="application/json",
+                HTTP_ACCEPT="application/x-ndjson",
+            )
+            self.assertTrue(resp.streaming)
+            # Nothing's been sent yet.
+            self.assertEqual(self.sample(count), before[0])
+            lines = b"".join(resp.streaming_content).splitlines()
+        self.assertEqual(len(lines), len(self.fake.names) * len(self.fake.versions))
+
+        # The test client closes the response once it's been read.
+        self.assertEqual(self.sample(count), before[0] + 1)
+        self.assertGreater(self.sample(query_sum), before[1])
+
+
+class ParseReqTests(SimpleTestCase):
+    # (requirement, (name, extras, specifier, marker, url))
+    CASES = [
+        ("requests", ("requests", set(), "", "", "")),
+        ("requests>=2.20,<3", ("requests", set(), ">=2.20,<3", "", "")),
+        (
+            "requests[socks, Security_Extra] (>= 2.20, < 3)",
+            ("requests", {"socks", "security-extra"}, ">=2.20,<3", "", ""),
+        ),
+        (
+            'requests (>=2.20) ; python_version >= "3.6"',
+            ("requests", set(), ">=2.20", 'python_version >= "3.6"', ""),
+        ),
+        ("Foo_Bar[]", ("foo-bar", set(), "", "", "")),
+        ("Django~=3.2", ("django", set(), "~=3.2", "", "")),
+        ("zope.interface==5.*", ("zope.interface", set(), "==5.*", "", "")),
+        (
+            "pkg @ https://example.com/pkg-1.0.whl ; sys_platform == 'win32'",
+            (
+                "pkg",
+                set(),
+                "",
+                "sys_platform == 'win32'",
+                "https://example.com/pkg-1.0.whl",
+            ),
+        ),
+        (
+            # A `;` in the URL itself, without whitespace before it, isn't a marker.
+            "Pkg[extra]@https://example.com/pkg;v=1.zip",
+            ("pkg", {"extra"}, "", "", "https://example.com/pkg;v=1.zip"),
+        ),
+    ]
+
+    def test_parse(self):
+        for data, (name, extras, specifier, marker, url) in self.CASES:
+            with self.subTest(data=data):
+                req = reqs.parse(data)
+                self.assertEqual(req.name, name)
+                self.assertEqual(req.extras, frozenset(extras))
+                self.assertEqual(req.specifier, specifier)
+                self.assertEqual(req.marker, marker)
+                self.assertEqual(req.url, url)
+
+    def test_unparseable(self):
+        for data in ("", "   ", ">=1.0", "-pkg", "[extra]"):
+            with self.subTest(data=data):
+                self.assertIsNone(reqs.parse(data))
+
+    def test_marker_extras(self):
+        for data, extras in (
+            ('PySocks; extra == "Socks_Proxy"', {"socks-proxy"}),
+            ("pytest; 'test' == extra or extra=='Dev'", {"test", "dev"}),
+            ('six; (python_version < "3") and (extra == "compat")', {"compat"}),
+            ('six; python_version < "3"', set()),
+            ('six; extra_thing == "x"', set()),
+        ):
+            with self.subTest(data=data):
+                self.assertEqual(reqs.parse(data).marker_extras, frozenset(extras))
+
+    def test_normalize_name(self):
+        self.assertEqual(reqs.normalize_name("Foo_Bar-baz"), "foo-bar-baz")
+
+
+class ProjectLRUTests(SimpleTestCase):
+    def test_evicts_least_recently_used(self):
+        lru = projects.ProjectLRU(max_bytes=10)
+        now = timezone.now()
+        lru.put("a", {"a": 1}, 4, now)
+        lru.put("b", {"b": 1}, 4, now)
+        lru.get("a")
+        lru.put("c", {"c": 1}, 4, now)
+        self.assertIsNone(lru.get("b"))
+        self.assertEqual(lru.get("a"), ({"a": 1}, now))
+        self.assertEqual(lru.size, 8)
+
+    def test_replace(self):
+        lru = projects.ProjectLRU(max_bytes=10)
+        now = timezone.now()
+        lru.put("a", {"v": 1}, 4, now)
+        lru.put("a", {"v": 2}, 6, now)
+        self.assertEqual(lru.get("a"), ({"v": 2}, now))
+        self.assertEqual(lru.size, 6)
+        # Too big to keep; the old copy's dropped too.
+        lru.put("a", {"v": 3}, 11, now)
+        self.assertIsNone(lru.get("a"))
+        self.assertEqual(lru.size, 0)
+
+
+@override_settings(ROOT_URLCONF="pydeps.urls_async")
+class AsyncViewTests(FakePypiTestCase, TransactionTestCase):
+    pypi_options = {"projects": 2, "versions": 2, "wheel_size": 0}
+
+    def request(self, method, path, sync=False, **kwargs):
+        with redirect_stdout(io.StringIO()):
+            if sync:
+                with self.settings(ROOT_URLCONF="pydeps.urls"):
+                    return getattr(self.client, method)(path, **kwargs)
+            return async_to_sync(getattr(self.async_client, method))(path, **kwargs)
+
+    def assertSameResponse(self, path, **kwargs):
+        """The async route answers like the sync one."""
+        method = "post" if path.startswith("/multiple/") else "get"
+        ours = self.request(method, path, **kwargs)
+        cache.clear()
+        theirs = self.request(method, path, sync=True, **kwargs)
+        self.assertEqual(ours.status_code, theirs.status_code)
+        self.assertEqual(ours.content, theirs.content)
+        for header in ("Content-Type", "Vary", "ETag", "Cache-Control", "X-Failures"):
+            self.assertEqual(ours.get(header), theirs.get(header), header)
+        return ours
+
+    def test_get_one(self):
+        name, version = self.fake.names[0], self.fake.versions[0]
+        resp = self.assertSameResponse(f"/{name}/{version}/")
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(
+            resp.json(),
+            [
+                {
+                    "version": version,
+                    "requires_python": ">=3.6",
+                    "requires_dist": [f"{self.fake.names[1]}>=1.0"],
+                }
+            ],
+        )
+
+    def test_multiple(self):
+        body = {"packages": {name: self.fake.versions for name in self.fake.names}}
+        resp = self.assertSameResponse(
+            "/multiple/", data=body, content_type="application/json"
+        )
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(
+            [(dep["name"], dep["version"]) for dep in resp.json()],
+            [(name, v) for name in self.fake.names for v in self.fake.versions],
+        )
+
+    def test_not_modified(self):
+        path = f"/{self.fake.names[0]}/{self.fake.versions[0]}/"
+        first = self.request("get", path)
+        self.assertIn("immutable", first["Cache-Control"])
+        # Django 3.2's AsyncClient takes extra headers by their raw names.
+        again = self.request("get", path, **{"If-None-Match": first["ETag"]})
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again["ETag"], first["ETag"])
+        self.assertEqual(again.content, b"")
+
+    def test_bad_version(self):
+        resp = self.assertSameResponse(f"/{self.fake.names[0]}/not-a-version/")
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(resp.json(), ["not-a-version isn't a valid version"])
+
+    def test_unknown_package(self):
+        resp = self.assertSameResponse("/missing/1.0/")
+        self.assertEqual(resp.status_code, 404)
+        self.assertEqual(resp.json(), {"detail": "Unable to find missing on Pypi"})
+
+    def test_method_not_allowed(self):
+        resp = self.request("get", "/multiple/")
+        self.assertEqual(resp.status_code, 405)
+        self.assertEqual(resp.json(), {"detail": 'Method "GET" not allowed.'})
+
+
+class VersionTests(SimpleTestCase):
+    # Each version sorts strictly after the one before it.
+    ORDERED = [
+        "1.0.dev0",
+        "1.0a1.dev1",
+        "1.0a1",
+        "1.0a2.post1.dev0",
+        "1.0a2.post1",
+        "1.0b1",
+        "1.0rc1",
+        "1.0",
+        "1.0+abc",
+        "1.0+abc.2",
+        "1.0+1",
+        "1.0+2",
+        "1.0.post1.dev0",
+        "1.0.post1",
+        "1.0.post2",
+        "1.0.1",
+        "1.1.dev0",
+        "1.1",
+        "2.0",
+        "10.0",
+        "1!0.1",
+        "1!1.0",
+        "2!0.0.1",
+    ]
+    EQUAL = [
+        ("1.0", "1.0.0"),
+        ("1", "1.0.0.0"),
+        ("1.0-beta2", "1.0b2"),
+        ("1.0c1", "1.0rc1"),
+        ("1.0-1", "1.0.post1"),
+        ("1.0.post", "1.0.post0"),
+        ("v1.0", "1.0"),
+        ("0!1.0", "1.0"),
+        ("1.0+Local_1", "1.0+local.1"),
+    ]
+    INVALID = ["", "1.0.x", "one", "1.0+", "1..0", "1.0-dev-post"]
+
+    def test_order(self):
+        for lower, higher in zip(self.ORDERED, self.ORDERED[1:]):
+            with self.subTest(lower=lower, higher=higher):
+                self.assertLess(Version.from_str(lower), Version.from_str(higher))
+                self.assertLess(version_key(lower), version_key(higher))
+
+    def test_sortable_matches_order(self):
+        shuffled = self.ORDERED[:]
+        random.Random(0).shuffle(shuffled)
+        self.assertEqual(sorted(shuffled, key=Version.from_str), self.ORDERED)
+        self.assertEqual(sorted(shuffled, key=version_key), self.ORDERED)
+        for v in self.ORDERED:
+            self.assertTrue(version_key(v).isdigit(), v)
+
+    def test_equal(self):
+        for a, b in self.EQUAL:
+            with self.subTest(a=a, b=b):
+                self.assertEqual(Version.from_str(a), Version.from_str(b))
+                self.assertEqual(hash(Version.from_str(a)), hash(Version.from_str(b)))
+                self.assertEqual(version_key(a), version_key(b))
+
+    def test_invalid(self):
+        for s in self.INVALID:
+            with self.subTest(s=s):
+                self.assertIsNone(Version.from_str(s))
+                self.assertEqual(version_key(s), "")
+
+    def test_str_normalizes(self):
+        self.assertEqual(
+            str(Version.from_str("1.0-Beta-2.POST-3_dev4")), "1.0b2.post3.dev4"
+        )
+        self.assertEqual(str(Version.from_str("2!1.0c1+ubuntu-1")), "2!1.0rc1+ubuntu.1")
@@ -0,0 +1,343 @@
+"""PEP 440 versions. Parsing is one precompiled regex, memoized per string, and each
+Version computes its sort key once, so parsing and sorting every release of a big
+project is cheap. For the database, `Version.sortable` encodes the sort key as a
+string of digits, so version ranges can be queried with an index."""
+
+import re
+from functools import lru_cache, total_ordering
+from typing import Iterable, List, Optional, Tuple
+
+# How many distinct version strings to keep parsed.
+PARSE_CACHE_SIZE = 1 << 16
+
+# From PEP 440, appendix B.
+VERSION_RE = re.compile(
+    r"""
+    ^\s*
+    v?
+    (?:
+        (?:(?P<epoch>[0-9]+)!)?
+        (?P<release>[0-9]+(?:\.[0-9]+)*)
+        (?P<pre>
+            [-_\.]?
+            (?P<pre_l>alpha|a|beta|b|preview|pre|c|rc)
+            [-_\.]?
+            (?P<pre_n>[0-9]+)?
+        )?
+        (?P<post>
+            (?:-(?P<post_n1>[0-9]+))
+            |
+            (?:
+                [-_\.]?
+                (?P<post_l>post|rev|r)
+                [-_\.]?
+                (?P<post_n2>[0-9]+)?
+            )
+        )?
+        (?P<dev>
+            [-_\.]?
+            (?P<dev_l>dev)
+            [-_\.]?
+            (?P<dev_n>[0-9]+)?
+        )?
+    )
+    (?:\+(?P<local>[a-z0-9]+(?:[-_\.][a-z0-9]+)*))?
+    \s*$
+    """,
+    re.VERBOSE | re.IGNORECASE,
+)
+
+PRE_LABELS = {
+    "a": "a",
+    "alpha": "a",
+    "b": "b",
+    "beta": "b",
+    "c": "rc",
+    "rc": "rc",
+    "pre": "rc",
+    "preview": "rc",
+}
+# Pre-release ordering; a final release sorts after all of them.
+PRE_RANKS = {"a": 0, "b": 1, "rc": 2}
+FINAL_RANK = 3
+# A dev release of a final release, eg `1.0.dev1`, sorts before its pre-releases.
+DEV_ONLY_RANK = -1
+
+
+@total_ordering
+class Version:
+    """A parsed PEP 440 version. Equal versions compare and hash equal, even if
+    written differently, eg `1.0` and `1.0.0`, or `1.0-beta2` and `1.0b2`."""
+
+    __slots__ = ("epoch", "release", "pre", "post", "dev", "local", "key")
+
+    def __init__(
+        self,
+        release: Tuple[int, ...],
+        epoch: int = 0,
+        pre: Optional[Tuple[str, int]] = None,
+        post: Optional[int] = None,
+        dev: Optional[int] = None,
+        local: Optional[str] = None,
+    ):
+        self.epoch = epoch
+        self.release = release
+        self.pre = pre
+        self.post = post
+        self.dev = dev
+        self.local = local
+        self.key = self._sort_key()
+
+    def _sort_key(self) -> tuple:
+        release = self.release
+        while len(release) > 1 and release[-1] == 0:
+            release = release[:-1]
+
+        if self.pre is not None:
+            pre = (PRE_RANKS[self.pre[0]], self.pre[1])
+        elif self.post is None and self.dev is not None:
+            pre = (DEV_ONLY_RANK, 0)
+        else:
+            pre = (FINAL_RANK, 0)
+
+        post = -1 if self.post is None else self.post
+        dev = (1, 0) if self.dev is None else (0, self.dev)
+
+        # Numeric local segments sort after alphanumeric ones.
+        local: tuple = ()
+        if self.local is not None:
+            local = tuple(
+                (1, int(seg), "") if seg.isdigit() else (0, 0, seg)
+                for seg in self.local.split(".")
+            )
+
+        return (self.epoch, release, pre, post, dev, local)
+
+    def sortable(self) -> str:
+        """The sort key, encoded as a string whose lexicographic order matches version
+        order. It's only digits, so database collations can't reorder it. Numbers are
+        prefixed with their length, and variable-length parts are made of items
+        prefixed with 1, and ended with 0."""
+        epoch, release, pre, post, dev, local = self.key
+
+        parts = [encode_int(epoch)]
+        parts.extend("1" + encode_int(n) for n in release)
+        parts.append("0")
+        parts.append(str(pre[0] - DEV_ONLY_RANK) + encode_int(pre[1]))
+        parts.append("0" if post == -1 else "1" + encode_int(post))
+        parts.append("0" + encode_int(dev[1]) if dev[0] == 0 else "1")
+
+        for numeric, n, seg in local:
+            if numeric:
+                parts.append("11" + encode_int(n))
+            else:
+                # Two digits per character, then a terminator lower than any of them.
+                parts.append("10" + "".join(f"{ord(c) - 38:02d}" for c in seg) + "00")
+        parts.append("0")
+
+        return "".join(parts)
+
+    @property
+    def major(self) -> int:
+        return self.release[0]
+
+    @property
+    def minor(self) -> int:
+        return self.release[1] if len(self.release) > 1 else 0
+
+    @property
+    def patch(self) -> int:
+        return self.release[2] if len(self.release) > 2 else 0
+
+    @property
+    def is_prerelease(self) -> bool:
+        return self.pre is not None or self.dev is not None
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Version):
+            return NotImplemented
+        return self.key == other.key
+
+    def __lt__(self, other: "Version") -> bool:
+        return self.key < other.key
+
+    def __hash__(self) -> int:
+        return hash(self.key)
+
+    @classmethod
+    def from_str(cls, s: str) -> Optional["Version"]:
+        """Returns None if `s` isn't a valid PEP 440 version."""
+        return _parse(s)
+
+    def __str__(self) -> str:
+        """The normalized form."""
+        result = ".".join(str(n) for n in self.release)
+        if self.epoch:
+            result = f"{self.epoch}!{result}"
+        if self.pre is not None:
+            result += f"{self.pre[0]}{self.pre[1]}"
+        if self.post is not None:
+            result += f".post{self.post}"
+        if self.dev is not None:
+            result += f".dev{self.dev}"
+        if self.local is not None:
+            result += f"+{self.local}"
+        return result
+
+    def __repr__(self) -> str:
+        return f'Version("{self}")'
+
+
+def encode_int(n: int) -> str:
+    """A number as a string that sorts in numeric order: its length, then its digits."""
+    digits = str(n)
+    return f"{len(digits):02d}{digits}"
+
+
+def version_key(version: str) -> str:
+    """The sortable key for a version string, for the database. Versions we can't
+    parse get an empty key, and are left out of range queries."""
+    parsed = Version.from_str(version)
+    return "" if parsed is None else parsed.sortable()
+
+
+def clear_cache() -> None:
+    """Forgets every parsed version, eg to time parsing from cold."""
+    _parse.cache_clear()
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def _parse(s: str) -> Optional[Version]:
+    m = VERSION_RE.match(s)
+    if m is None:
+        return None
+
+    pre = None
+    if m.group("pre_l"):
+        pre = (PRE_LABELS[m.group("pre_l").lower()], int(m.group("pre_n") or 0))
+
+    post = None
+    if m.group("post_n1"):
+        post = int(m.group("post_n1"))
+    elif m.group("post_l"):
+        post = int(m.group("post_n2") or 0)
+
+    dev = None
+    if m.group("dev_l"):
+        dev = int(m.group("dev_n") or 0)
+
+    local = m.group("local")
+    if local is not None:
+        local = re.sub(r"[-_]", ".", local.lower())
+
+    return Version(
+        tuple(int(n) for n in m.group("release").split(".")),
+        epoch=int(m.group("epoch") or 0),
+        pre=pre,
+        post=post,
+        dev=dev,
+        local=local,
+    )
+
+
+SPECIFIER_RE = re.compile(r"^\s*(~=|===|==|!=|<=|>=|<|>)\s*(\S+?)\s*$")
+
+
+class SpecifierSet:
+    """A comma-separated set of PEP 440 version specifiers, eg `>=1.2,!=1.3.*,<2`.
+    Pre-releases only match if a specifier names one, or if nothing else does."""
+
+    __slots__ = ("specs", "prereleases")
+
+    def __init__(self, s: str):
+        self.specs = []
+        self.prereleases = False
+        for item in s.split(","):
+            if not item.strip():
+                continue
+            m = SPECIFIER_RE.match(item)
+            if m is None:
+                raise ValueError(f"Invalid specifier: {item}")
+            op, version = m.groups()
+
+            if op == "===":
+                self.specs.append((op, version, None))
+                continue
+            wildcard = version.endswith(".*") and op in ("==", "!=")
+            parsed = Version.from_str(version[:-2] if wildcard else version)
+            if parsed is None or (op == "~=" and len(parsed.release) < 2):
+                raise ValueError(f"Invalid specifier: {item}")
+            if wildcard:
+                op += "*"
+            if parsed.is_prerelease and op not in ("!=", "!=*"):
+                self.prereleases = True
+            self.specs.append((op, version, parsed))
+
+    def contains(self, v: Version, raw: str = "") -> bool:
+        return all(matches(op, spec, parsed, v, raw) for op, spec, parsed in self.specs)
+
+    def filter(self, versions: Iterable[str]) -> List[str]:
+        """The version strings matching all specifiers, in the order given. Strings
+        that aren't valid versions never match."""
+        matched = []
+        pre = []
+        for raw in versions:
+            v = Version.from_str(raw)
+            if v is None or not self.contains(v, raw):
+                continue
+            if v.is_prerelease and not self.prereleases:
+                pre.append(raw)
+            else:
+                matched.append(raw)
+        return matched if matched or self.prereleases else pre
+
+    def __str__(self) -> str:
+        return ",".join(f"{op.rstrip('*')}{spec}" for op, spec, _ in self.specs)
+
+
+def base_key(v: Version) -> tuple:
+    """The sort key of just the epoch and release, eg 1.0 for 1.0rc1 and 1.0.post2."""
+    return v.key[:2]
+
+
+def prefix_match(spec: Version, v: Version) -> bool:
+    """Whether v's release starts with spec's, as for `==1.2.*`."""
+    n = len(spec.release)
+    release = v.release + (0,) * (n - len(v.release))
+    return v.epoch == spec.epoch and release[:n] == spec.release
+
+
+def matches(op: str, spec: str, parsed: Optional[Version], v: Version, raw: str):
+    if op == "===":
+        return raw.strip().lower() == spec.lower()
+    if op == "==*":
+        return prefix_match(parsed, v)
+    if op == "!=*":
+        return not prefix_match(parsed, v)
+
+    # Local versions only matter if the specifier has one.
+    key = v.key if parsed.local is not None else v.key[:5] + ((),)
+    if op == "==":
+        return key == parsed.key
+    if op == "!=":
+        return key != parsed.key
+    if op == "<=":
+        return key <= parsed.key
+    if op == ">=":
+        return key >= parsed.key
+    if op == "<":
+        # `<1.0` doesn't match 1.0rc1, unless it's a pre-release itself.
+        return key < parsed.key and (
+            parsed.is_prerelease
+            or not v.is_prerelease
+            or base_key(v) != base_key(parsed)
+        )
+    if op == ">":
+        # `>1.0` doesn't match 1.0.post1, unless it's a post-release itself.
+        return key > parsed.key and (
+            parsed.post is not None or v.post is None or base_key(v) != base_key(parsed)
+        )
+    if op == "~=":
+        prefix = Version(parsed.release[:-1], epoch=parsed.epoch)
+        return key >= parsed.key and prefix_match(prefix, v)
+    return False
@@ -1,27 +1,43 @@
-from dataclasses import dataclass
-from functools import total_ordering
-from typing import List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
 
-import requests
-from django.db import IntegrityError
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.http import HttpResponse, StreamingHttpResponse
 
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, renderer_classes
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.request import Request
 from rest_framework.response import Response
 from rest_framework import serializers
+from rest_framework.settings import api_settings
 
-from pathlib import Path
-from shutil import rmtree
+import json
 import zipfile
 
+import requests
+
 # from dataclasses import dataclass
 # from enum import Enum
 
-import os  # , subprocess
-
-import re
-
-from .models import Dependency, Requirement
+from . import (
+    closure,
+    distfiles,
+    failures,
+    jobs,
+    locks,
+    metadata,
+    metrics,
+    projects,
+    pypi,
+    snapshots,
+)
+from .caching import cacheable, cached_response
+from .models import Dependency, DistFile, FailedFetch, Job, Requirement
+from .renderers import STREAMING_RENDERERS
+from .reqs import normalize_name
+from .version import SpecifierSet, Version, version_key
 
 # We keep versions as strings in this package for consistency with the database, file reads,
 # and rest endpoints.
@@ -43,55 +59,6 @@ def print_heroku(s: str):
     sys.stdout.flush()
 
 
-@dataclass
-@total_ordering
-class Version:
-    major: int
-    minor: int
-    patch: int
-    # todo: Need to parse/format modifier if you want to use this .
-    modifier: str  # includes extra nums, and modifiers.
-
-    def __eq__(self: "Version", other: "Version") -> bool:
-        return (
-            self.major == other.major
-            and self.minor == other.minor
-            and self.patch == other.patch
-        )
-
-    def __gt__(self: "Version", other: "Version") -> bool:
-        if self.major != other.major:
-            return self.major > other.major
-        if self.minor != other.minor:
-            return self.minor > other.minor
-        if self.patch != other.patch:
-            return self.patch > other.patch
-        return False
-
-    @classmethod
-    def from_str(cls: "Version", s: str) -> Optional["Version"]:
-        # todo: Not as robust as the Rust version for handling modifiers etc.
-        maj_only = re.match(r"^(\d{1,9})\.?(.*)$", s)
-        maj_minor = re.match(r"^(\d{1,9})\.(\d{1,9})\.?(.*)$", s)
-        maj_minor_patch = re.match(r"^(\d{1,9})\.(\d{1,9})\.(\d{1,9})\.?(.*)$", s)
-
-        if maj_minor_patch:
-            major, minor, patch, modifier = maj_minor_patch.groups()
-            return cls(int(major), int(minor), int(patch), modifier)
-        if maj_minor:
-            major, minor, modifier = maj_minor.groups()
-            return cls(int(major), int(minor), 0, modifier)
-        if maj_only:
-            major, modifier = maj_only.groups()
-            return cls(int(major), 0, 0, modifier)
-
-        # raise ValueError(f"Unable to parse Version from {s}")
-        return None
-
-    def __str__(self) -> str:
-        return f"{self.major}.{self.minor}.{self.patch}{self.modifier}"
-
-
 class DepSerializer(serializers.ModelSerializer):
     class Meta:
         model = Dependency
@@ -110,208 +77,670 @@ class DepSerializerWName(serializers.ModelSerializer):
         depth = 1
 
 
-class ReqSerializer(serializers.ModelSerializer):
+class DistFileSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = DistFile
+        fields = (
+            "filename",
+            "url",
+            "sha256",
+            "size",
+            "packagetype",
+            "python_version",
+            "requires_python",
+            "yanked",
+            "python_tag",
+            "abi_tag",
+            "platform_tag",
+        )
+
+
+class DepFilesSerializer(DepSerializer):
+    """With each version's files, for `?files=true`. Files should be loaded with
+    `distfiles.attach`."""
+
+    files = DistFileSerializer(many=True)
+
+    class Meta(DepSerializer.Meta):
+        fields = DepSerializer.Meta.fields + ("files",)
+
+
+class DepFilesSerializerWName(DepSerializerWName):
+    files = DistFileSerializer(many=True)
+
+    class Meta(DepSerializerWName.Meta):
+        fields = DepSerializerWName.Meta.fields + ("files",)
+
+
+class JobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Job
+        fields = ("id", "name", "version", "status", "error", "created", "updated")
+
+
+class DependentSerializer(serializers.ModelSerializer):
+    name = serializers.CharField(source="dependency.name")
+    version = serializers.CharField(source="dependency.version")
+    requirement = serializers.CharField(source="data")
+
     class Meta:
         model = Requirement
-        fields = ("data",)
+        fields = ("name", "version", "requirement")
 
 
-def reqs_from_installed(dep: Dependency) -> Optional[List[Requirement]]:
-    """Check for dist-info and egg-info, and delegate to the appropriate
-    sub function to find dependency info."""
-    result = []
-    names_to_try = [
-        dep.name.replace("-", "_").capitalize(),
-        dep.name.replace("-", "_").lower(),
-        dep.name.replace("_", "-").capitalize(),
-        dep.name.replace("_", "-").lower(),
-    ]
-    for name in names_to_try:
-        try:
-            with open(
-                f"{str(Path.cwd())}/deps_to_query/{name}-{dep.version}.dist-info/METADATA"
-            ) as f:
-                for line in f.readlines():
-                    m = re.match(r"^Requires-Dist:\s*(.*)$", line)
-                    if m:
-                        data = m.groups()[0]
-
-                        result.append(Requirement(data=data, dependency=dep))
-        except FileNotFoundError:
-            continue
+class FailureSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = FailedFetch
+        fields = ("name", "version", "reason", "detail", "attempts", "retry_after")
 
-    return result
 
+class ReqSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Requirement
+        fields = ("data",)
 
-def cleanup_downloaded() -> None:
-    """Remove all download dependencies; they're temporary"""
-    for path in Path("deps_to_query").glob("**/*"):
-        if path.is_file():
-            path.unlink()
-        elif path.is_dir():
-            rmtree(path)
 
+class DistUnreadable(Exception):
+    """Unable to get a dep's reqs from its distribution files. `reason` is one of
+    `FailedFetch`'s."""
 
-def install_from_wheel(dep: Dependency) -> None:
-    """Try this first; if unable to find a wheel, use install_with_pip.
-    Doing this avoids installing sub-dependencies, and issues where we
-    can't install due to Heroku using an old version of pip incompatible
-    with manylinux2010, and problems building from source."""
+    def __init__(self, reason: str, detail: str):
+        super().__init__(detail)
+        self.reason = reason
+
+
+def reqs_from_dist(dep: Dependency) -> List[str]:
+    """Read the requirements from the dep's METADATA. Try a wheel first, reading
+    its METADATA in place. If unable to find one, read the sdist's metadata;
+    this avoids installing the package, or its sub-dependencies. Raises
+    `DistUnreadable` if neither works, including when Pypi lists a file it can't
+    serve, eg with a 404 or 410."""
 
     # Version is exact.
-    data = requests.get(f"https://pypi.org/pypi/{dep.name}/json").json()
-    releases = data["releases"]
-    found_wheel = False
-
-    for rel_v, rel_data in releases.items():
-        if rel_v == dep.version:
-            # Pick the first wheel you find.
-            for rel in rel_data:
-                if rel["packagetype"] == "bdist_wheel":
-                    found_wheel = True
-                    downloaded_wheel = requests.get(rel["url"])
-                    archive_path = f"deps_to_query/{rel['filename']}"
-                    with open(archive_path, "wb") as f:
-                        f.write(downloaded_wheel.content)
-                        try:
-                            with zipfile.ZipFile(archive_path, "r") as zip_ref:
-                                zip_ref.extractall("deps_to_query")
-                        except zipfile.BadZipFile:
-                            print("Bad zipfile on ", dep)
-                            continue
-
-                        zip_ref.close()
-                    sys.stdout.flush()  # so we can output errors on heroku
-                    break
-            break
-    if not found_wheel:
-        print_heroku(f"Can't find a wheel; installing {dep} with Pip")
-        install_with_pip(dep)
-
-
-def install_with_pip(dep: Dependency) -> None:
-    # Version is exact.
-    name_with_version = f"{dep.name}=={dep.version}"
-    os.system(f"python3 -m pip install {name_with_version} --target deps_to_query")
-    sys.stdout.flush()
+    data = projects.get_project(dep.name)
+    if data is not None and dep.version not in data["releases"]:
+        # Our copy may predate this release.
+        data = projects.get_project(dep.name, refresh=True)
+    if data is None or dep.version not in data["releases"]:
+        raise DistUnreadable(FailedFetch.NOT_FOUND, f"Unable to find {dep} on Pypi")
+    files = data["releases"][dep.version]
+
+    # Pick the first wheel you find.
+    bad_wheel = None
+    for rel in files:
+        if rel["packagetype"] == "bdist_wheel":
+            try:
+                return metadata.wheel_requires_dist(rel["url"], rel.get("size"))
+            except zipfile.BadZipFile as e:
+                print_heroku(f"Bad zipfile on {dep}")
+                bad_wheel = f"Bad wheel {rel['filename']}: {e}"
+                continue
+            except requests.HTTPError as e:
+                print_heroku(f"Unable to download a wheel for {dep}")
+                bad_wheel = f"Unable to download {rel['filename']}: {e}"
+                continue
+
+    for rel in files:
+        if rel["packagetype"] == "sdist":
+            print_heroku(f"Can't find a usable wheel; reading the sdist for {dep}")
+            try:
+                return metadata.sdist_requires_dist(rel["url"])
+            except metadata.MetadataError as e:
+                raise DistUnreadable(FailedFetch.NO_METADATA, str(e))
+            except requests.HTTPError as e:
+                raise DistUnreadable(
+                    FailedFetch.NO_METADATA,
+                    f"Unable to download {rel['filename']}: {e}",
+                )
 
+    if bad_wheel is not None:
+        raise DistUnreadable(FailedFetch.BAD_WHEEL, bad_wheel)
+    raise DistUnreadable(FailedFetch.NO_FILES, f"Can't find a wheel or sdist for {dep}")
+
+
+def save_reqs(reqs: List[Tuple[Dependency, List[str]]]) -> None:
+    """Write the requirements for a batch of saved deps with one bulk insert, and mark
+    the deps complete, in one transaction; either a dep's reqs are all saved and
+    it's marked complete, or neither. Reqs we already have are skipped."""
+    with transaction.atomic():
+        Requirement.objects.bulk_create(
+            [
+                Requirement.from_data(data, dep)
+                for dep, req_strs in reqs
+                for data in req_strs
+            ],
+            ignore_conflicts=True,
+        )
+        Dependency.objects.filter(id__in=[dep.id for dep, _ in reqs]).update(
+            reqs_complete=True
+        )
 
-def cache_dep(name: str, version: str) -> None:
-    """Wrapper for subfns: Downloads a dep, pulls subdeps, cleans up
-    downloaded files. Stores deps and reqs to database"""
-    name = name.replace("_", "-").lower()
-    dep, created = Dependency.objects.get_or_create(name=name, version=version)
 
-    install_from_wheel(dep)
+def cache_dep(name: str, version: str, release: Optional[dict] = None) -> None:
+    """Wrapper for subfns: Downloads a dep and pulls subdeps. Stores deps
+    and reqs to database. `release` is the version's warehouse document, if we
+    fetched it, for a new dep's requires_python and files."""
+    name = normalize_name(name)
+    dep = Dependency.objects.filter(name=name, version=version).first()
+    if dep is None:
+        dep = Dependency(name=name, version=version)
 
-    reqs = reqs_from_installed(dep)
-    # if reqs is not None:
-    for req in reqs:
-        try:
-            req.save()
-        except IntegrityError:
-            continue
+    try:
+        with metrics.stage("read_dist"):
+            req_strs = reqs_from_dist(dep)
+    except DistUnreadable as e:
+        print_heroku(str(e))
+        failures.record((name, version), e.reason, str(e))
+        return
 
     # Don't save the dep unless also saving its associated reqs.
-    if created:
-        dep.save()
+    with transaction.atomic():
+        if dep.id is None:
+            dep.version_key = version_key(version)
+            if release:
+                dep.requires_python = release["info"]["requires_python"]
+            # Insert first, rather than `get_or_create`'s select first, so concurrent
+            # jobs on SQLite wait for the write lock instead of deadlocking.
+            Dependency.objects.bulk_create([dep], ignore_conflicts=True)
+            dep = Dependency.objects.get(name=name, version=version)
+            if release:
+                distfiles.record([(dep, release.get("urls") or [])])
+        save_reqs([(dep, req_strs)])
+
+
+def group_query(packages: Dict[str, List[str]]) -> Q:
+    """Match every (name, version) pair in `packages`."""
+    query = Q()
+    for name, versions in packages.items():
+        if versions:
+            query |= Q(name=name, version__in=versions)
+    return query
+
+
+def load_cached(packages: Dict[str, List[str]]) -> Dict[Tuple[str, str], Dependency]:
+    """Fetch every requested (name, version) pair that's already in the database
+    with one query, with requirements prefetched so serializing them doesn't
+    cost a query per dependency. Names must already be normalized."""
+    query = group_query(packages)
+    if not query:
+        return {}
+
+    deps = Dependency.objects.filter(query).prefetch_related("requirements")
+    return {(dep.name, dep.version): dep for dep in deps}
+
+
+def fetch_release(name: str, version: str) -> Optional[dict]:
+    """Pull the Pypi warehouse info for a single version. Returns None if Pypi
+    doesn't know about it."""
+    data = pypi.get_release(name, version)
+    if data is None:
+        print_heroku(f'Unable to find {name} = "{version}" on Pypi')
+        return None
+    return data
+
+
+def fetch_releases(keys: List[Tuple[str, str]]) -> Dict[Tuple[str, str], dict]:
+    """Pull warehouse info for many (name, version) pairs concurrently; these are
+    independent network round trips, so there's no reason to make them one at a time."""
+    if not keys:
+        return {}
+
+    with ThreadPoolExecutor(
+        max_workers=min(settings.PYPI_FETCH_WORKERS, len(keys))
+    ) as executor:
+        fetched = executor.map(lambda key: fetch_release(*key), keys)
+        return {key: data for key, data in zip(keys, fetched) if data is not None}
+
+
+def store_releases(fetched: Dict[Tuple[str, str], dict]) -> List[Tuple[str, str]]:
+    """Save deps and reqs where Pypi lists them, in bulk, in one transaction. Returns
+    the (name, version) pairs Pypi shows no deps for, which we need to download and
+    check manually; they're left for `cache_dep` to save."""
+    if not fetched:
+        return []
+
+    reqs = []
+    to_inspect = []
+    for key, data in fetched.items():
+        name, version = key
+        requires_dist = data["info"]["requires_dist"]
+
+        if requires_dist is None:
+            if name in KNOWN_NO_DEPS:
+                print(f"Skipping {name}; it's known to have no deps")
+                reqs.append((key, []))
+                continue
+
+            # This may mean there are no dependencies, or Pypi is unable to properly
+            # find them. Unfortunately, there's currently no way to tell the difference.
+            # todo: Even if not none, we may not be able to trust Pypi.
+            # todo: Perhaps always determine ourselves?
+            print(
+                f"Deps is empty on pypi warehouse for {name}, {version}. Downloading and checking manually."
+            )
+            # `cache_dep` saves these, with their reqs.
+            to_inspect.append(key)
+        else:
+            # Use the info on Pypi without downloading/inspecting METADATA.
+            reqs.append((key, requires_dist))
+    if not reqs:
+        return to_inspect
+
+    with transaction.atomic():
+        Dependency.objects.bulk_create(
+            [
+                Dependency(
+                    name=name,
+                    version=version,
+                    version_key=version_key(version),
+                    requires_python=fetched[name, version]["info"]["requires_python"],
+                )
+                for (name, version), _ in reqs
+            ],
+            # Possibly a conflict between multiple requests; the existing row is fine.
+            ignore_conflicts=True,
+        )
+        deps = {
+            (dep.name, dep.version): dep
+            for dep in Dependency.objects.filter(
+                group_query(group_by_name(key for key, _ in reqs))
+            )
+        }
 
-    if not dep.reqs_complete:
-        dep.reqs_complete = True
-        dep.save()
-    cleanup_downloaded()
+        distfiles.record((deps[key], fetched[key].get("urls") or []) for key, _ in reqs)
+        save_reqs([(deps[key], req_strs) for key, req_strs in reqs])
+    return to_inspect
+
+
+def group_by_name(keys: Iterable[Tuple[str, str]]) -> Dict[str, List[str]]:
+    result: Dict[str, List[str]] = {}
+    for name, version in keys:
+        result.setdefault(name, []).append(version)
+    return result
 
 
-# todo: Until version handles modifiers
-# def process_reqs(name: str, versions: List[Version]) -> List[Dependency]:
 def process_reqs(name: str, versions: List[str]) -> List[Dependency]:
-    """Helper function to reduce repetition"""
-    result_ = []
-    name = name.replace("_", "-").lower()
-
-    for version in versions:
-        # version = str(version) # todo put back once version handles modifiers
-        try:
-            # valid_names = [name.replace("-", "_"), name.replace("_", "-").lower()]
-            # todo: May need a case check too, but can't chain _in and __iexact,
-            # todo, and it appears that all db entries are lowercase
-            dep = Dependency.objects.get(name=name, version=version)
-            if not dep.reqs_complete:
-                # Possible interruption between saving the dep, and adding the reqs.
-                print(
-                    f"Reqs not complete for {name}, {version}. Downloading and checking manually."
-                )
-                cache_dep(name, version)
-                result_.append(dep)
-        except Dependency.DoesNotExist:
-            data = requests.get(f"https://pypi.org/pypi/{name}/{version}/json").json()
-            info = data["info"]
-            dep = Dependency(
-                name=name, version=version, requires_python=info["requires_python"]
+    """Helper function to reduce repetition. Versions are strings as Pypi lists them,
+    not normalized; that's how we store them."""
+    return process_many({normalize_name(name): versions})
+
+
+def pull(keys: List[Tuple[str, str]]) -> None:
+    """Pull cold (name, version) pairs from Pypi, and store them. Callers should hold
+    their single-flight locks."""
+    if not keys:
+        return
+    # Another worker may have finished some of these before we got their locks.
+    existing = load_cached(group_by_name(keys))
+
+    misses = [key for key in keys if key not in existing]
+    with metrics.stage("fetch_releases"):
+        fetched = fetch_releases(misses)
+    to_inspect = store_pulled(keys, existing, fetched)
+
+    for name, version in to_inspect:
+        cache_dep(name, version, fetched.get((name, version)))
+    snapshots.refresh(list(fetched) + to_inspect)
+
+    for name, version in fetched:
+        print_heroku(f'Cached {name} = "{version}" ')
+
+
+def store_pulled(
+    keys: List[Tuple[str, str]],
+    existing: Dict[Tuple[str, str], Dependency],
+    fetched: Dict[Tuple[str, str], dict],
+) -> List[Tuple[str, str]]:
+    """Store what we fetched for `keys` that weren't in the database, and record
+    failures for the ones Pypi doesn't have. Returns the (name, version) pairs we
+    need to download and check manually."""
+    for key in keys:
+        if key not in existing and key not in fetched:
+            failures.record(key, FailedFetch.NOT_FOUND, "Not found on Pypi")
+    with metrics.stage("store_releases"):
+        to_inspect = store_releases(fetched)
+
+    for key in keys:
+        if key in existing and not existing[key].reqs_complete:
+            # Possible interruption between saving the dep, and adding the reqs.
+            print(
+                f"Reqs not complete for {key[0]}, {key[1]}. Downloading and checking manually."
             )
+            to_inspect.append(key)
+    return to_inspect
+
+
+def process_many(packages: Dict[str, List[str]]) -> List[Dependency]:
+    """Load deps for many packages at once: Everything already cached is read with
+    one query, uncached versions are pulled from Pypi concurrently and stored in bulk.
+    If another worker's already pulling some of them, we wait for its results instead
+    of repeating its work. Versions that recently failed aren't tried again until
+    their backoff expires. Names must already be normalized. Results are in the
+    order requested, and only include deps with complete reqs."""
+    cached = load_cached(packages)
+    keys, cold, failed = plan_pull(packages, cached)
+
+    with locks.single_flight(cold) as (ours, theirs):
+        pull(ours)
+
+    if theirs:
+        locks.wait(theirs)
+        # Pull anything the other worker didn't manage to, ourselves. Others may have
+        # been waiting on it too, so this is single-flight as well.
+        with locks.single_flight(unfinished(theirs)) as (ours, theirs):
+            pull(ours)
+        locks.wait(theirs)
+
+    return collect(keys, cold, cached, failed)
+
+
+def plan_pull(
+    packages: Dict[str, List[str]], cached: Dict[Tuple[str, str], Dependency]
+) -> Tuple[
+    List[Tuple[str, str]], List[Tuple[str, str]], Dict[Tuple[str, str], FailedFetch]
+]:
+    """Returns the requested (name, version) pairs, the ones we need to pull, and
+    recorded failures for any that aren't cached. Versions whose failures are still
+    backing off aren't pulled."""
+    keys = [
+        (name, version) for name, versions in packages.items() for version in versions
+    ]
+    cold = list(
+        dict.fromkeys(
+            key for key in keys if key not in cached or not cached[key].reqs_complete
+        )
+    )
+    failed = failures.load(cold)
+    blocked = {key for key, failure in failed.items() if failures.is_active(failure)}
+    cold = [key for key in cold if key not in blocked]
+
+    hits = len(dict.fromkeys(keys)) - len(cold) - len(blocked)
+    metrics.CACHE.inc(hits, cache="deps", result="hit")
+    metrics.CACHE.inc(len(cold), cache="deps", result="miss")
+    metrics.CACHE.inc(len(blocked), cache="deps", result="failed")
+    return keys, cold, failed
+
+
+def unfinished(keys: List[Tuple[str, str]]) -> List[Tuple[str, str]]:
+    """The keys another worker pulled that still aren't complete."""
+    done = load_cached(group_by_name(keys))
+    return [key for key in keys if key not in done or not done[key].reqs_complete]
+
+
+def collect(
+    keys: List[Tuple[str, str]],
+    cold: List[Tuple[str, str]],
+    cached: Dict[Tuple[str, str], Dependency],
+    failed: Dict[Tuple[str, str], FailedFetch],
+) -> List[Dependency]:
+    """The complete deps for `keys`, in order, once `cold` ones have been pulled."""
+    # Deps we've just written weren't part of the first query; load them, and
+    # their reqs, in one more.
+    fresh = load_cached(group_by_name(cold))
+    failures.clear([key for key in failed if key in fresh and fresh[key].reqs_complete])
 
-            try:
-                dep.save()
-            except IntegrityError:
-                # Possibly a conflict between multiple requests. If this happens,
-                # make sure we pull req info again. (?)
-                print("Integrity error; trying to get dep again.")
-                # There's inconsistent package name formatting across the ecosystem.
-                # valid_names = [name.replace("-", "_"), name.replace("_", "-")]
-                dep = Dependency.objects.get(
-                    name=name.replace("_", "-").lower(), version=version
-                )
+    result = []
+    for key in keys:
+        dep = fresh.get(key) or cached.get(key)
+        if dep is not None and dep.reqs_complete:
+            result.append(dep)
+    return result
 
-            if info["requires_dist"] is None:
-                if name in KNOWN_NO_DEPS:
-                    dep.reqs_complete = True
-                    dep.save()
-                    print(f"Skipping {name}; it's known to have no deps")
-                    continue
 
-                # This may mean there are no dependencies, or Pypi is unable to properly
-                # find them. Unfortunately, there's currently no way to tell the difference.
-                # todo: Even if not none, we may not be able to trust Pypi.
-                # todo: Perhaps always determine ourselves?
-                print(
-                    f"Deps is empty on pypi warehouse for {name}, {version}. Downloading and checking manually."
-                )
-                cache_dep(name, version)
+def iter_many(
+    packages: Dict[str, List[str]], files: bool = False
+) -> Iterator[Dependency]:
+    """Like process_many, but yields deps as they're ready, a chunk of requested
+    versions at a time: A chunk's cached deps first, then its uncached ones as
+    they're pulled. Memory use is bounded by the chunk size, not the number
+    of requested versions. Deps aren't in the order requested. With `files`,
+    deps' files are loaded a batch at a time."""
+    keys = list(
+        dict.fromkeys(
+            (name, version)
+            for name, versions in packages.items()
+            for version in versions
+        )
+    )
+    for start in range(0, len(keys), settings.STREAM_CHUNK_SIZE):
+        chunk = keys[start : start + settings.STREAM_CHUNK_SIZE]
+        cached = load_cached(group_by_name(chunk))
+
+        ready = []
+        cold = []
+        for key in chunk:
+            dep = cached.get(key)
+            if dep is not None and dep.reqs_complete:
+                ready.append(dep)
             else:
-                # Use the info on Pypi without downloading/inspecting METADATA.
-                for req in info["requires_dist"]:
-                    req2 = Requirement(data=req, dependency=dep)
-                    try:
-                        req2.save()
-                    except IntegrityError:
-                        continue
-            dep.reqs_complete = True
-            dep.save()
-            print_heroku(f'Cached {name} = "{version}" ')
+                cold.append(key)
+        if files:
+            distfiles.attach(ready)
+        yield from ready
+
+        # One round of concurrent fetches at a time, so each is sent once it's in.
+        for i in range(0, len(cold), settings.PYPI_FETCH_WORKERS):
+            pulled = process_many(
+                group_by_name(cold[i : i + settings.PYPI_FETCH_WORKERS])
+            )
+            if files:
+                distfiles.attach(pulled)
+            yield from pulled
+
+
+def process_cached(
+    packages: Dict[str, List[str]],
+) -> Tuple[List[Dependency], List[Job], List[FailedFetch]]:
+    """Like process_many, but instead of pulling anything that isn't cached, queue it
+    for the ingest workers. Returns what's already cached, the queued jobs, and
+    recent failures, which aren't queued again until their backoff expires."""
+    cached = load_cached(packages)
+
+    keys = [
+        (name, version) for name, versions in packages.items() for version in versions
+    ]
+    cold = [key for key in keys if key not in cached or not cached[key].reqs_complete]
+    failed = failures.active(cold)
+    blocked = {(f.name, f.version) for f in failed}
+    cold = [key for key in cold if key not in blocked]
+    queued = jobs.enqueue(cold)
+
+    result = [
+        cached[key] for key in keys if key in cached and cached[key].reqs_complete
+    ]
+    return result, [queued[key] for key in dict.fromkeys(cold)], failed
+
+
+def query_flag(request: Request, name: str) -> bool:
+    """Whether an option's set, with eg `?background=true`, or `"background": true`
+    in a POST body."""
+    flag = request.query_params.get(name)
+    if flag is None and isinstance(request.data, dict):
+        flag = request.data.get(name)
+    return str(flag).lower() in ("1", "true")
+
+
+def wants_background(request: Request) -> bool:
+    """Whether the client's asked for cold work to be queued instead of waited on."""
+    return query_flag(request, "background")
+
+
+def wants_files(request: Request) -> bool:
+    """Whether the client's asked for each version's files, with their URLs and
+    hashes."""
+    return query_flag(request, "files")
+
+
+def process_background(packages: Dict[str, List[str]], serializer, files: bool = False):
+    """`process_cached`, as a response."""
+    result, queued, failed = process_cached(packages)
+    if files:
+        distfiles.attach(result)
+    return background_response(result, queued, failed, serializer, files)
+
+
+def background_response(
+    result: List[Dependency],
+    queued: List[Job],
+    failed: List[FailedFetch],
+    serializer,
+    files: bool = False,
+):
+    return cacheable(
+        Response(
+            {
+                "results": serializer(result, many=True).data,
+                "jobs": JobSerializer(queued, many=True).data,
+                "failures": FailureSerializer(failed, many=True).data,
+            }
+        ),
+        bool(result) and not queued and not failed,
+        files_ttl(files),
+    )
+
+
+def files_ttl(files: bool) -> Optional[int]:
+    """How long a complete response stays fresh: Files can be yanked, so responses
+    with them are only cached as long as project documents are."""
+    return settings.PROJECT_CACHE_TTL if files else None
+
+
+def missing_failures(
+    requested: List[Tuple[str, str]], found: Set[Tuple[str, str]]
+) -> List[FailedFetch]:
+    """Recent failures for requested versions we didn't find."""
+    return failures.active([key for key in requested if key not in found])
+
+
+def with_failures(response: Response, failed: List[FailedFetch]) -> Response:
+    """List responses have nowhere in the body to report failures without breaking
+    clients, so they're listed in a header."""
+    if failed:
+        data = FailureSerializer(failed[: settings.FAILURES_HEADER_MAX], many=True).data
+        response["X-Failures"] = json.dumps(
+            [{k: v for k, v in f.items() if k != "detail"} for f in data]
+        )
+    return response
+
+
+def is_complete(requested: List[Tuple[str, str]], result: List[Dependency]) -> bool:
+    """Whether the response for these deps is final: Everything requested was found,
+    with its reqs complete. Results for versions Pypi doesn't have may change."""
+    found = {(dep.name, dep.version) for dep in result if dep.reqs_complete}
+    return bool(requested) and found.issuperset(requested)
+
 
-        result_.append(dep)
-    return result_
+def parse_version(version: str) -> Version:
+    result = Version.from_str(version)
+    if result is None:
+        raise ValidationError(f"{version} isn't a valid version")
+    return result
 
 
-def get_helper(name: str, min_vers: Optional[Version], max_vers: Optional[Version]):
-    r = requests.get(f"https://pypi.org/pypi/{name}/json").json()
+def filter_versions(
+    releases: List[str], min_vers: Optional[Version], max_vers: Optional[Version]
+) -> List[str]:
+    """Filter on parsed versions, but keep the strings as Pypi lists them; a
+    version's normalized form may not be how it was published."""
+    versions = []
+    for v in releases:
+        parsed = Version.from_str(v)
+        if parsed is None:
+            continue
+        if min_vers and parsed < min_vers:
+            continue
+        if max_vers and parsed > max_vers:
+            continue
+        versions.append(v)
+    return versions
 
-    versions = [Version.from_str(v) for v in r["releases"].keys()]
-    versions = [v for v in versions if v is not None]
 
+def load_range(
+    name: str, min_vers: Optional[Version], max_vers: Optional[Version]
+) -> Dict[str, Dependency]:
+    """What we have cached, by version. It's one indexed range scan."""
+    cached = Dependency.objects.filter(name=name, reqs_complete=True)
     if min_vers:
-        versions = [v for v in versions if v >= min_vers]
+        cached = cached.filter(version_key__gte=min_vers.sortable())
     if max_vers:
-        versions = [v for v in versions if v <= max_vers]
+        cached = cached.filter(version_key__lte=max_vers.sortable())
+    return {dep.version: dep for dep in cached.prefetch_related("requirements")}
+
+
+def range_response(
+    name: str, versions: List[str], result: List[Dependency], files: bool = False
+):
+    result.sort(key=lambda dep: dep.version_key)
+    keys = [(name, v) for v in versions]
+    if files:
+        distfiles.attach(result)
+    dep_serializer = (DepFilesSerializer if files else DepSerializer)(result, many=True)
+    return cacheable(
+        with_failures(
+            Response(dep_serializer.data),
+            missing_failures(keys, {(d.name, d.version) for d in result}),
+        ),
+        is_complete(keys, result),
+        files_ttl(files),
+    )
+
+
+def snapshot_response(
+    name: str,
+    versions: List[str],
+    entries: List[snapshots.Entry],
+    min_vers: Optional[Version],
+    max_vers: Optional[Version],
+) -> Optional[HttpResponse]:
+    """The range's response, from the package's snapshot, like `range_response`'s.
+    None if it's missing versions we'd try to pull, rather than ones that failed
+    recently, which we'd only report."""
+    rendered, missing = snapshots.select(entries, versions, min_vers, max_vers)
+    failed = failures.active([(name, v) for v in missing])
+    if len(failed) < len(missing):
+        return None
+    return cacheable(
+        with_failures(snapshots.response(rendered), failed),
+        bool(versions) and not missing,
+    )
+
+
+def get_helper(
+    name: str,
+    min_vers: Optional[Version],
+    max_vers: Optional[Version],
+    background: bool = False,
+    files: bool = False,
+):
+    name = normalize_name(name)
+    releases = projects.get_releases(name)
+    if releases is None:
+        raise NotFound(f"Unable to find {name} on Pypi")
+    versions = filter_versions(releases, min_vers, max_vers)
+
+    if background:
+        return process_background(
+            {name: versions}, DepFilesSerializer if files else DepSerializer, files
+        )
 
-    dep_serializer = DepSerializer(process_reqs(name, versions), many=True)
-    return Response(dep_serializer.data)
+    # Snapshots don't include files.
+    entries = None if files else snapshots.load(name)
+    if entries is not None:
+        response = snapshot_response(name, versions, entries, min_vers, max_vers)
+        if response is not None:
+            return response
 
+    found = load_range(name, min_vers, max_vers)
+    result = [found[v] for v in versions if v in found]
+    result.extend(process_reqs(name, [v for v in versions if v not in found]))
+    return range_response(name, versions, result, files)
 
+
+@cached_response
 @api_view(["GET"])
 def get_one(request: Request, name: str, version: str):
-    vers = Version.from_str(version)
-    return get_helper(name, vers, vers)
+    vers = parse_version(version)
+    return get_helper(name, vers, vers, wants_background(request), wants_files(request))
 
 
 @api_view(["GET"])
@@ -320,39 +749,248 @@ def get_all(request: Request, name: str):
     requirements for all versions of a package with one API hit - Pypi requires
     a hit for each version. We collect and cache that. This may take a while when getting
     for packages with a large number of uncached versions."""
-    return get_helper(name, None, None)
+    return get_helper(name, None, None, wants_background(request), wants_files(request))
 
 
 @api_view(["GET"])
 def get_gte(request: Request, name: str, version: str):
     """Similar to get_all, but only get reqs greater greater than a specific version.
     Has faster catching than get_all."""
-    return get_helper(name, Version.from_str(version), None)
+    return get_helper(
+        name,
+        parse_version(version),
+        None,
+        wants_background(request),
+        wants_files(request),
+    )
 
 
 @api_view(["GET"])
 def get_lte(request: Request, name: str, version: str):
-    return get_helper(name, None, Version.from_str(version))
+    return get_helper(
+        name,
+        None,
+        parse_version(version),
+        wants_background(request),
+        wants_files(request),
+    )
 
 
 @api_view(["GET"])
 def get_range(request: Request, name: str, min_vers: str, max_vers: str):
-    return get_helper(name, Version.from_str(min_vers), Version.from_str(max_vers))
+    return get_helper(
+        name,
+        parse_version(min_vers),
+        parse_version(max_vers),
+        wants_background(request),
+        wants_files(request),
+    )
 
 
+@cached_response
 @api_view(["POST"])
+@renderer_classes(list(api_settings.DEFAULT_RENDERER_CLASSES) + STREAMING_RENDERERS)
 def multiple(request: Request):
     """This is the main API used by Pyflow; it can load arbitrary package/version combos
-    in one request, but requires passing the versions to query in the request."""
-    result = []
+    in one request, but requires passing the versions to query in the request.
+    With `Accept: application/x-ndjson` (or `application/msgpack`), deps are streamed
+    a record at a time as they're ready, instead of all at once. With
+    `"files": true`, each version's files are included, with their URLs and hashes."""
+    packages, keys = parse_packages(request.data)
+    files = wants_files(request)
+
+    if wants_background(request):
+        return process_background(
+            packages, DepFilesSerializerWName if files else DepSerializerWName, files
+        )
+
+    renderer = request.accepted_renderer
+    if isinstance(renderer, tuple(STREAMING_RENDERERS)):
+        return StreamingHttpResponse(
+            renderer.stream(stream_records(packages, keys, files)),
+            content_type=renderer.media_type,
+        )
 
-    for name, versions in request.data["packages"].items():
-        # todo: Perhaps put this logic back if you update Version to parse and format
-        # todo modifiers (ie 1.2.3.4b3
-        # versions = [Version.from_str(v) for v in versions]
-        # result.extend(process_reqs(name, [v for v in versions if v is not None]))
-        result.extend(process_reqs(name, versions))
+    return many_response(keys, process_many(packages), files)
 
-    dep_serializer = DepSerializerWName(result, many=True)
+
+def parse_packages(
+    data: dict,
+) -> Tuple[Dict[str, List[str]], List[Tuple[str, str]]]:
+    """The packages in a `/multiple/` request body, by normalized name, and the
+    (name, version) pairs requested."""
+    packages: Dict[str, List[str]] = {}
+    for name, versions in data["packages"].items():
+        packages.setdefault(normalize_name(name), []).extend(str(v) for v in versions)
+
+    keys = [
+        (name, version) for name, versions in packages.items() for version in versions
+    ]
+    return packages, keys
+
+
+def many_response(
+    keys: List[Tuple[str, str]], result: List[Dependency], files: bool = False
+):
+    if files:
+        distfiles.attach(result)
+    dep_serializer = (DepFilesSerializerWName if files else DepSerializerWName)(
+        result, many=True
+    )
     # print(dep_serializer.data, "\n\n")
-    return Response(dep_serializer.data)
+    return cacheable(
+        with_failures(
+            Response(dep_serializer.data),
+            missing_failures(keys, {(d.name, d.version) for d in result}),
+        ),
+        is_complete(keys, result),
+        files_ttl(files),
+    )
+
+
+def stream_records(
+    packages: Dict[str, List[str]], keys: List[Tuple[str, str]], files: bool = False
+) -> Iterator[dict]:
+    """Serialized deps as they're ready, then a record for each recent failure, eg
+    `{"name": ..., "version": ..., "error": {"reason": ...}}`."""
+    serializer = DepFilesSerializerWName if files else DepSerializerWName
+    sent = set()
+    for dep in iter_many(packages, files):
+        sent.add((dep.name, dep.version))
+        yield serializer(dep).data
+
+    for failure in missing_failures(keys, sent):
+        yield error_record(failure)
+
+
+def error_record(failure: FailedFetch) -> dict:
+    return {
+        "name": failure.name,
+        "version": failure.version,
+        "error": FailureSerializer(failure).data,
+    }
+
+
+@api_view(["POST"])
+def get_closure(request: Request):
+    """The transitive closure of root requirements, eg
+    `{"requirements": ["django>=2.2", "requests[socks]"]}`: Every (name, version) they
+    can reach, with its requirements, in one response, instead of a request per
+    level of the graph."""
+    requirements = request.data.get("requirements")
+    if not isinstance(requirements, list):
+        raise ValidationError("requirements must be a list of requirement strings")
+
+    try:
+        result = closure.Walk().resolve([str(req) for req in requirements])
+    except ValueError as e:
+        raise ValidationError(str(e))
+
+    return Response(DepSerializerWName(result, many=True).data)
+
+
+def query_int(request: Request, param: str, default: int) -> int:
+    try:
+        return int(request.query_params.get(param, default))
+    except ValueError:
+        raise ValidationError(f"{param} must be an integer")
+
+
+@api_view(["GET"])
+def get_dependents(request: Request, name: str):
+    """Cached packages that require `name`, a page at a time, eg
+    `/api/dependents/requests/?min=2.0&max=2.99&limit=100`. With `min` and/or `max`,
+    only dependents allowing a release of `name` in that range are returned, and
+    pages may come back short, or empty, after scanning `DEPENDENTS_MAX_SCAN` rows.
+    Pass the response's `next` as `?after=` for the next page, until it's null."""
+    name = normalize_name(name)
+    after = query_int(request, "after", 0)
+    limit = min(
+        query_int(request, "limit", settings.DEPENDENTS_PAGE_SIZE),
+        settings.DEPENDENTS_MAX_PAGE_SIZE,
+    )
+    if limit < 1:
+        raise ValidationError("limit must be positive")
+
+    min_vers = request.query_params.get("min")
+    max_vers = request.query_params.get("max")
+    candidates = None
+    if min_vers or max_vers:
+        min_vers = parse_version(min_vers) if min_vers else None
+        max_vers = parse_version(max_vers) if max_vers else None
+        releases = projects.get_releases(name)
+        if releases is None:
+            raise NotFound(f"Unable to find {name} on Pypi")
+        candidates = filter_versions(releases, min_vers, max_vers)
+
+    # Filtering may skip most rows, so read full batches rather than what's left of
+    # the page, and give up after a budget; the client can pick up from `next`.
+    batch_size = limit if candidates is None else settings.DEPENDENTS_MAX_PAGE_SIZE
+    # Whether each distinct specifier allows a candidate; many rows share one.
+    allowed: Dict[str, bool] = {}
+    page: List[Requirement] = []
+    scanned = 0
+    done = False
+    while len(page) < limit and scanned < settings.DEPENDENTS_MAX_SCAN and not done:
+        # An index range scan on (name, id).
+        batch = list(
+            Requirement.objects.filter(name=name, id__gt=after)
+            .select_related("dependency")
+            .only("id", "data", "specifier", "dependency__name", "dependency__version")
+            .order_by("id")[:batch_size]
+        )
+        done = len(batch) < batch_size
+        for req in batch:
+            after = req.id
+            scanned += 1
+            if candidates is not None:
+                if req.specifier not in allowed:
+                    allowed[req.specifier] = allows_any(req.specifier, candidates)
+                if not allowed[req.specifier]:
+                    continue
+            page.append(req)
+            if len(page) == limit:
+                done = done and req is batch[-1]
+                break
+    next_after = None if done else after
+
+    return Response(
+        {"results": DependentSerializer(page, many=True).data, "next": next_after}
+    )
+
+
+def allows_any(specifier: str, versions: List[str]) -> bool:
+    try:
+        return bool(SpecifierSet(specifier).filter(versions))
+    except ValueError:
+        return False
+
+
+def metrics_view(request):
+    """Metrics for this worker process, in the Prometheus text format."""
+    return HttpResponse(
+        metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+@api_view(["GET"])
+def get_job(request: Request, job_id: int):
+    """Status of a job queued by a `background` request, so clients can poll for
+    its completion."""
+    try:
+        job = Job.objects.get(id=job_id)
+    except Job.DoesNotExist:
+        raise NotFound(f"No job with id {job_id}")
+    return Response(JobSerializer(job).data)
+
+
+@api_view(["GET"])
+def get_jobs(request: Request):
+    """Status of several jobs at once, eg `/api/jobs/?ids=1,2,3`."""
+    try:
+        ids = [
+            int(id_) for id_ in request.query_params.get("ids", "").split(",") if id_
+        ]
+    except ValueError:
+        raise ValidationError("ids must be a comma-separated list of job ids")
+    return Response(JobSerializer(Job.objects.filter(id__in=ids), many=True).data)
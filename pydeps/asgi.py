@@ -0,0 +1,28 @@
+"""
+ASGI config for pydeps project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+Views that wait on Pypi are async here; see `main.aviews`. Serve it with an ASGI
+server, eg ``gunicorn pydeps.asgi -k uvicorn.workers.UvicornWorker``.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
+"""
+
+import os
+
+from asgiref.sync import ThreadSensitiveContext
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "pydeps.settings")
+os.environ.setdefault("PYDEPS_URLCONF", "pydeps.urls_async")
+
+django_application = get_asgi_application()
+
+
+async def application(scope, receive, send):
+    """Give each request its own thread for database work, as newer versions of
+    Django do; otherwise every request's queries share one thread, and a request
+    waiting on another worker's lock holds up the rest."""
+    async with ThreadSensitiveContext():
+        await django_application(scope, receive, send)
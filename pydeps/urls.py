@@ -28,6 +28,12 @@ from main import views
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("multiple/", views.multiple),
+    path("metrics", views.metrics_view),
+    # Under api/, so they don't shadow Pypi projects with these names.
+    path("api/closure/", views.get_closure),
+    path("api/dependents/<str:name>/", views.get_dependents),
+    path("api/jobs/", views.get_jobs),
+    path("api/jobs/<int:job_id>/", views.get_job),
     path("<str:name>/<str:version>/", views.get_one),
     path("<str:name>/", views.get_all),
     path("gte/<str:name>/<str:version>/", views.get_gte),
@@ -0,0 +1,23 @@
+"""URLs for the ASGI entry point: The same as `pydeps.urls`, with async versions of
+the views that wait on Pypi."""
+
+from django.contrib import admin
+from django.urls import path
+
+from main import aviews, views
+
+urlpatterns = [
+    path("admin/", admin.site.urls),
+    path("multiple/", aviews.multiple),
+    path("metrics", views.metrics_view),
+    # Under api/, so they don't shadow Pypi projects with these names.
+    path("api/closure/", views.get_closure),
+    path("api/dependents/<str:name>/", views.get_dependents),
+    path("api/jobs/", views.get_jobs),
+    path("api/jobs/<int:job_id>/", views.get_job),
+    path("<str:name>/<str:version>/", aviews.get_one),
+    path("<str:name>/", aviews.get_all),
+    path("gte/<str:name>/<str:version>/", aviews.get_gte),
+    path("lte/<str:name>/<str:version>/", aviews.get_lte),
+    path("range/<str:name>/<str:min_vers>/<str:max_vers>/", aviews.get_range),
+]